@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+Command latency benchmark. Flies Flight.mission-style scripts through
+HeadsUpTello against the local TelloSimulator and reports, for each mission,
+the number of SDK round trips, the p50/p99 command latency seen by the caller
+and the total wall time.
+
+    % python3 -m Bench.command_latency
+    % python3 -m Bench.command_latency --time-scale 1 --latency 0.005
+    % python3 -m Bench.command_latency --optimize
+"""
+
+import argparse
+import logging
+import time
+from contextlib import nullcontext
+
+from djitellopy import Tello
+
+from Bench.common import percentile, print_table
+from Sim.tello_sim import TelloSimulator, loopback_tello
+from Src.headsupflight import HeadsUpTello
+from Util import Utility
+from Util import dji_matrix as djim
+
+
+# ------------------------------------------------------------------------------
+# Missions. Each one receives a connected HeadsUpTello object.
+# ------------------------------------------------------------------------------
+
+def mission_status(drone):
+    """ Flight.mission: print battery and temperature, take off and land. """
+    Utility.get_battery(drone.drone)
+    Utility.get_temperature(drone.drone)
+    drone.takeoff()
+    drone.land()
+
+
+def mission_square(drone):
+    """ Fly a one meter square with goToPosition and come home. """
+    drone.takeoff()
+    for x, y in ((100, 0), (100, 100), (0, 100), (0, 0)):
+        drone.goToPosition(x, y)
+    drone.goHome(False)
+    drone.land()
+
+
+def mission_direct(drone):
+    """ Fly the same square with rotate-then-forward direct flight. """
+    drone.takeoff()
+    for x, y in ((100, 0), (100, 100), (0, 100), (0, 0)):
+        drone.fly_to_coordinates(x, y, True)
+    drone.land()
+
+
+def mission_sideways(drone):
+    """ The direct square, but legs are flown without turning when that is quicker. """
+    drone.takeoff()
+    for x, y in ((100, 0), (100, 100), (0, 100), (0, 0)):
+        drone.fly_to_coordinates(x, y, True, sideways=True)
+    drone.land()
+
+
+def mission_waypoints(drone):
+    """ Fly the same square from compiled 'go'/'curve' commands. """
+    drone.takeoff()
+    height = drone.get_height()
+    drone.fly_waypoints([(100, 0, height), (100, 100, height), (0, 100, height), (0, 0, height)])
+    drone.land()
+
+
+def mission_long_leg(drone):
+    """ A single 800 cm leg that has to be split into legal moves. """
+    drone.takeoff()
+    drone.move_forward(800)
+    drone.land()
+
+
+def mission_altitude(drone):
+    """ Climb and descend through the ceiling and floor guards. """
+    drone.takeoff()
+    drone.fly_up(100)
+    drone.fly_up(400)
+    drone.checkMoveDown(100, drone.get_height(), drone.mission_obj["floor"])
+    drone.checkMoveDown(400, drone.get_height(), drone.mission_obj["floor"])
+    drone.land()
+
+
+def mission_envelope(drone):
+    """ Small height corrections just inside the ceiling and the floor. """
+    drone.takeoff()
+    drone.fly_up(410)
+    drone.fly_up(30)
+    drone.checkMoveDown(435, drone.get_height(), drone.mission_obj["floor"])
+    drone.checkMoveDown(30, drone.get_height(), drone.mission_obj["floor"])
+    drone.land()
+
+
+def mission_chatty(drone):
+    """ Short hops, a dodge that cancels out and the same LED color over and over. """
+    drone.takeoff()
+    for _ in range(4):
+        Utility.top_led_color(drone.drone, 0, 0, 255)
+        drone.move_forward(50)
+    drone.move_left(50)
+    drone.move_right(50)
+    drone.move_forward(1200)
+    Utility.top_led_off(drone.drone)
+    drone.land()
+
+
+def mission_leds(drone):
+    """ Count down on the LED matrix while fading the top LED. """
+    for number in range(9, -1, -1):
+        Utility.matrix_pattern(drone.drone, djim.numbers[number], 'b')
+        Utility.top_led_color(drone.drone, 0, 20 * number, 5 * number)
+    Utility.matrix_off(drone.drone)
+    Utility.top_led_off(drone.drone)
+
+
+MISSIONS = {
+    "status": mission_status,
+    "square": mission_square,
+    "direct": mission_direct,
+    "sideways": mission_sideways,
+    "waypoints": mission_waypoints,
+    "long_leg": mission_long_leg,
+    "altitude": mission_altitude,
+    "envelope": mission_envelope,
+    "chatty": mission_chatty,
+    "leds": mission_leds,
+}
+
+
+# ------------------------------------------------------------------------------
+# Measurement
+# ------------------------------------------------------------------------------
+
+def instrument(tello, latencies):
+    """
+    Wraps the Tello object's send_command_with_return so that every round
+    trip, including retries, appends its latency in seconds to latencies.
+    """
+    send = tello.send_command_with_return
+
+    def timed_send(command, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return send(command, *args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - start)
+
+    tello.send_command_with_return = timed_send
+
+
+def reset(sim, drone):
+    """ Lands both the simulator and HeadsUpTello back at the origin. """
+    sim.reset_flight()
+    drone.telemetry.invalidate()
+    drone.drone.is_flying = False
+    drone.inAir = False
+    drone.currentX = drone.currentY = drone.currentRotation = 0
+    drone.homeX = drone.homeY = 0
+
+
+def run_mission(sim, drone, latencies, mission, optimize=False):
+    """
+    Flies one mission and returns its measurements as a dictionary. A mission
+    that raises is still measured up to the failure and reports the error.
+    With optimize the mission runs in drone.batch().
+    """
+    reset(sim, drone)
+    sim.reset_log()
+    latencies.clear()
+    error = ""
+    start = time.perf_counter()
+    try:
+        with drone.batch() if optimize else nullcontext():
+            mission(drone)
+    except Exception as excp:
+        error = str(excp).splitlines()[0]
+    wall = time.perf_counter() - start
+    commands = sim.reset_log()
+    return {
+        "error": error,
+        "round_trips": len(commands),
+        "saved": drone.optimizer.saved if optimize else 0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "wall_s": wall,
+    }
+
+
+def make_drone(sim, mission_obj=None, tether=None):
+    """ Connects a quiet HeadsUpTello object to a running simulator. """
+    Tello.LOGGER.setLevel(logging.WARNING)
+    tello = loopback_tello(sim.address[0])
+    latencies = []
+    instrument(tello, latencies)
+    drone = HeadsUpTello(tello, 0, mission_obj or {'ceiling': 500, 'floor': 50}, tether)
+    drone.logger.setLevel(logging.WARNING)
+    return drone, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--time-scale", type=float, default=0.0,
+                        help="1.0 flies in real time, 0.0 answers instantly")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="simulated one-way Wi-Fi delay in seconds")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="times to fly each mission")
+    parser.add_argument("--optimize", action="store_true",
+                        help="fly every mission through HeadsUpTello.batch()")
+    parser.add_argument("missions", nargs="*", default=list(MISSIONS),
+                        help=f"missions to fly, from: {', '.join(MISSIONS)}")
+    args = parser.parse_args()
+
+    with TelloSimulator(time_scale=args.time_scale, latency=args.latency) as sim:
+        drone, latencies = make_drone(sim)
+        rows = []
+        for name in args.missions:
+            for run in range(args.repeat):
+                result = run_mission(sim, drone, latencies, MISSIONS[name], args.optimize)
+                rows.append([name, run, result["round_trips"], result["saved"],
+                             f"{result['p50_ms']:.2f}", f"{result['p99_ms']:.2f}",
+                             f"{result['wall_s']:.3f}", result["error"]])
+        reset(sim, drone)
+        drone.disconnect()
+
+    print_table(["mission", "run", "round trips", "saved", "p50 ms", "p99 ms", "wall s", "error"],
+                rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,33 @@
+import math
+import time
+
+
+def percentile(values, pct):
+    """
+    Returns the nearest-rank percentile of a list of numbers, or 0 when the
+    list is empty.
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(math.ceil(pct / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+def time_call(function, *args, repeat=1000, **kwargs):
+    """ Returns the mean seconds per call of function over repeat calls. """
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function(*args, **kwargs)
+    return (time.perf_counter() - start) / repeat
+
+
+def print_table(headers, rows):
+    """ Prints rows as a left aligned, space separated table. """
+    rows = [[str(cell) for cell in row] for row in rows]
+    widths = [max(len(str(header)), *(len(row[i]) for row in rows)) if rows else len(str(header))
+              for i, header in enumerate(headers)]
+    print("  ".join(str(header).ljust(width) for header, width in zip(headers, widths)))
+    print("  ".join("-" * width for width in widths))
+    for row in rows:
+        print("  ".join(cell.ljust(width) for cell, width in zip(row, widths)))
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Fleet benchmark. Starts 1 to 16 simulated drones on 127.0.0.2, 127.0.0.3, ...
+in a separate process, connects to all of them with Src.headsupfleet and
+flies every drone through the same mission in step: take off, a number of
+forward moves that all start together at a fleet.sync() barrier, and land.
+Reports the command latency over all drones, the worst drone's p99, how far
+apart the drones left each barrier and the wall time, for each fleet size.
+
+djitellopy polls for answers every 100 ms, so with an instant simulator a
+command takes 100 ms unless the answer beat the first poll; the p99 should
+stay near 100 ms however many drones fly.
+
+    % python3 -m Bench.fleet
+    % python3 -m Bench.fleet --rounds 10 1 4 16
+"""
+
+import argparse
+import gc
+import logging
+import multiprocessing
+import time
+
+from djitellopy import Tello
+
+from Bench.common import percentile, print_table
+from Sim.tello_sim import TelloSimulator, loopback_tello
+from Src.headsupfleet import HeadsUpFleet
+
+
+def host(index):
+    return f"127.0.0.{index + 2}"
+
+
+def run_simulators(count, time_scale, ready, done):
+    """ Runs count simulators until done is set. """
+    simulators = [TelloSimulator(host=host(index), time_scale=time_scale).start()
+                  for index in range(count)]
+    ready.set()
+    done.wait()
+    for simulator in simulators:
+        simulator.stop()
+
+
+def mission(rounds, released):
+    """ A fly() script: take off, rounds of synchronized moves, land. """
+    def script(drone, fleet):
+        drone.takeoff()
+        for round in range(rounds):
+            fleet.sync()
+            released.append((round, time.perf_counter()))
+            drone.move_forward(20)
+        drone.land()
+    return script
+
+
+def measure(count, rounds, time_scale):
+    """ Flies count drones and returns a row of the table. """
+    context = multiprocessing.get_context('spawn')
+    ready, done = context.Event(), context.Event()
+    simulators = context.Process(target=run_simulators, args=(count, time_scale, ready, done),
+                                 daemon=True)
+    simulators.start()
+    ready.wait()
+    try:
+        fleet = HeadsUpFleet.connect([host(index) for index in range(count)], 0,
+                                     {'ceiling': 500, 'floor': 50}, make_tello=loopback_tello)
+        fleet.latency_report(reset=True)
+        released = []
+        start = time.perf_counter()
+        fleet.fly([mission(rounds, released)] * count)
+        wall = time.perf_counter() - start
+        report = fleet.latency_report()
+        latencies = [latency for each in fleet.latencies for latency in each]
+        fleet.disconnect()
+        # A djitellopy object that is collected later forgets its address,
+        # even if the next fleet is already using it again
+        del fleet
+        gc.collect()
+    finally:
+        done.set()
+        simulators.join()
+
+    skews = []
+    for round in range(rounds):
+        times = [moment for number, moment in released if number == round]
+        skews.append(max(times) - min(times))
+    return [count, len(latencies), f"{percentile(latencies, 50) * 1000:.1f}",
+            f"{percentile(latencies, 99) * 1000:.1f}",
+            f"{max(each['p99_ms'] for each in report):.1f}",
+            f"{percentile(skews, 99) * 1e6:.0f}", f"{wall:.2f}"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rounds", type=int, default=5, help="synchronized moves per drone")
+    parser.add_argument("--time-scale", type=float, default=0.0,
+                        help="1.0 flies in real time, 0.0 answers instantly")
+    parser.add_argument("counts", nargs="*", type=int, default=[1, 2, 4, 8, 16])
+    args = parser.parse_args()
+
+    Tello.LOGGER.setLevel(logging.WARNING)
+    rows = [measure(count, args.rounds, args.time_scale) for count in args.counts]
+    print_table(["drones", "commands", "p50 ms", "p99 ms", "worst drone p99 ms", "sync skew us",
+                 "wall s"], rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Geofence benchmark. Compiles random missions of increasing length and times
+how long the vectorized Geofence takes to sample and check every leg,
+compared with calling Utility.isInTether once per waypoint.
+
+    % python3 -m Bench.geofence
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from Bench.common import print_table
+from Src.mission_compiler import compile_mission
+from Util import Utility
+from Util.Geofence import Geofence
+
+
+def random_waypoints(count, radius, floor, ceiling, seed=0):
+    """ A random walk of waypoints that stays inside the cylinder. """
+    rng = np.random.default_rng(seed)
+    angle = rng.uniform(0, 2 * np.pi, count)
+    distance = radius * np.sqrt(rng.uniform(0, 0.9, count))
+    height = rng.uniform(floor, ceiling, count)
+    return np.column_stack((distance * np.cos(angle), distance * np.sin(angle), height)).round().tolist()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--radius", type=float, default=1000)
+    parser.add_argument("--resolution", type=float, default=10)
+    parser.add_argument("counts", nargs="*", type=int, default=[10, 100, 1000, 5000])
+    args = parser.parse_args()
+
+    fence = Geofence(floor=50, ceiling=500, radius=args.radius, resolution=args.resolution,
+                     polygon=[(-1200, -1200), (1200, -1200), (1200, 1200), (-1200, 1200)])
+    rows = []
+    for count in args.counts:
+        plan = compile_mission(random_waypoints(count, args.radius, 60, 490), (0, 0, 80))
+
+        start = time.perf_counter()
+        check = fence.check_plan(plan)
+        vectorized = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for command in plan:
+            Utility.isInTether(0, 0, args.radius, command.end[0], command.end[1])
+        per_point = time.perf_counter() - start
+
+        rows.append([count, plan.command_count, check.samples, check.ok,
+                     f"{vectorized * 1000:.2f}", f"{per_point * 1000:.2f}"])
+
+    print_table(["waypoints", "commands", "samples", "inside", "fence ms", "isInTether ms (ends only)"],
+                rows)
+
+
+if __name__ == '__main__':
+    main()
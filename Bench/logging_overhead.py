@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Logging benchmark. Logs the info and debug lines HeadsUpTello writes for one
+fly_up() and move_forward() over and over, and reports the time the calling
+thread spends per move with the old synchronous handlers and with the
+queue-backed Util.Log.
+
+The old setup printed the debug lines through the root logger and wrote
+every info line to the file and the console before returning. Util.Log
+only puts the records on a queue, and skips the debug lines at INFO level.
+The console is a file in /tmp here, so the terminal doesn't slow it down.
+Moves are spaced --interval seconds apart, as they are in flight, which
+gives the listener thread time to write between them; with --interval 0
+the listener competes with the moves for the GIL.
+
+    % python3 -m Bench.logging_overhead
+    % python3 -m Bench.logging_overhead --moves 5000 --interval 0
+"""
+
+import argparse
+import logging
+import os
+import tempfile
+import time
+
+from Bench.common import percentile, print_table
+from Util.Log import Log
+
+
+def synchronous_logger(path, stream):
+    """ The handlers the old Util.Log set up, writing to path and stream. """
+    root = logging.getLogger()
+    root.handlers = [logging.StreamHandler(stream)]
+    root.setLevel(logging.NOTSET)
+    logger = logging.getLogger("Before")
+    logger.propagate = True
+    for handler in (logging.FileHandler(path), logging.StreamHandler(stream)):
+        handler.setLevel(logging.INFO)
+        logger.addHandler(handler)
+    return logger
+
+
+def move_before(logger, amount, height, ceiling):
+    """ The log calls of one move, the way HeadsUpTello made them before. """
+    logger.info(f"trying to move up {amount}")
+    logger.debug(f"ceiling height: {ceiling}")
+    logger.debug(f"current height: {height}")
+    logger.debug(f"moving: {amount}")
+    logger.info(f"Moving up {amount} cm.")
+    logger.debug(f"New currentheight: {height + amount}")
+    logger.info(f"Moving forward {amount} cm.")
+
+
+def move_after(log, amount, height, ceiling):
+    """ The same calls with lazy arguments and a level guard. """
+    log.info("trying to move up %s", amount)
+    log.debug("ceiling height: %s", ceiling)
+    log.debug("current height: %s", height)
+    log.debug("moving: %s", amount)
+    log.info("Moving up %s cm.", amount)
+    if log.enabled(logging.DEBUG):
+        log.debug(f"New currentheight: {height + amount}")
+    log.info("Moving forward %s cm.", amount)
+
+
+def measure(move, logger, moves, interval):
+    """ Returns the seconds each move spent logging. """
+    times = []
+    for i in range(moves):
+        start = time.perf_counter()
+        move(logger, 20 + i % 50, 80 + i % 100, 500)
+        times.append(time.perf_counter() - start)
+        time.sleep(interval)
+    return times
+
+
+def row(name, times, drain=0.0):
+    return [name, f"{sum(times) / len(times) * 1e6:.1f}", f"{percentile(times, 99) * 1e6:.1f}",
+            f"{percentile(times, 100) * 1e6:.0f}", f"{drain * 1000:.1f}"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--moves", type=int, default=500)
+    parser.add_argument("--interval", type=float, default=0.005,
+                        help="seconds between moves")
+    args = parser.parse_args()
+
+    rows = []
+    with tempfile.TemporaryDirectory() as folder:
+        with open(os.path.join(folder, "before_console.txt"), "w") as stream:
+            logger = synchronous_logger(os.path.join(folder, "before.log"), stream)
+            rows.append(row("synchronous", measure(move_before, logger, args.moves, args.interval)))
+            for handler in logger.handlers + logging.getLogger().handlers:
+                handler.close()
+            logger.handlers = []
+            logging.getLogger().handlers = []
+
+        for name, file_level in (("queue", logging.INFO), ("queue, file DEBUG", logging.DEBUG)):
+            with open(os.path.join(folder, f"{file_level}_console.txt"), "w") as stream:
+                log = Log(name, "bench", 50, 500, os.path.join(folder, f"after{file_level}"),
+                          logging.INFO, file_level, stream)
+                times = measure(move_after, log, args.moves, args.interval)
+                start = time.perf_counter()
+                log.close()
+                rows.append(row(name, times, time.perf_counter() - start))
+
+    print_table(["logging", "mean us/move", "p99 us", "max us", "drain ms"], rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Lossy link benchmark. Flies square laps of moves and turns through
+HeadsUpTello against a simulator that loses some commands and answers, with
+djitellopy's fixed timeouts and retries and with the learned timeouts of
+Util.CommandPolicy, and reports the longest stall, the wall time and how
+many moves the drone flew more than it was asked to.
+
+The drone takes off and flies --warmup laps on a clean link first, so the
+policy has round trip times to learn from; only the --laps after that are
+lossy. A lost answer costs djitellopy 7 seconds and sends the move again.
+
+    % python3 -m Bench.lossy_link
+    % python3 -m Bench.lossy_link --loss 0.02 0.05 0.1 --laps 5
+"""
+
+import argparse
+import gc
+import logging
+import math
+import time
+
+from djitellopy import Tello
+
+from Bench.common import percentile, print_table
+from Sim.tello_sim import TelloSimulator, loopback_tello
+from Src.headsupflight import HeadsUpTello
+from Util.CommandPolicy import command_kind
+
+
+def lap(drone):
+    """ A one meter square, turning at every corner. Ends where it started. """
+    for _ in range(4):
+        drone.move_forward(100)
+        drone.rotate_cw(90)
+
+
+def flown(sim):
+    """ Number of moves and turns the simulator carried out. """
+    return sum(1 for entry in sim.commands
+               if command_kind(entry.command) in ('move', 'rotate') and entry.response == "ok")
+
+
+def run(loss, adaptive, laps, warmup, time_scale, seed):
+    """ Flies one row. Returns its measurements as a dictionary. """
+    with TelloSimulator(time_scale=time_scale, seed=seed) as sim:
+        Tello.LOGGER.setLevel(logging.CRITICAL)
+        latencies = []
+        drone = HeadsUpTello(loopback_tello(sim.address[0]), 0, {'ceiling': 500, 'floor': 50},
+                             debug_level=logging.CRITICAL,
+                             command_policy=None if adaptive else False)
+        drone.channel.add_listener(
+            lambda command, response, sent, latency: latencies.append(latency))
+        error = ""
+        try:
+            drone.takeoff()
+            for _ in range(warmup):
+                lap(drone)
+            sim.reset_log()
+            latencies.clear()
+            sim.loss = loss
+            start = time.perf_counter()
+            try:
+                for _ in range(laps):
+                    lap(drone)
+            except Exception as excp:
+                error = str(excp).splitlines()[0]
+            wall = time.perf_counter() - start
+            sim.loss = 0.0
+            drone.land()
+            extra = flown(sim) - 8 * laps
+            x, y, _, _ = sim.get_pose()
+        finally:
+            drone.disconnect()
+    result = {"lost": sim.lost, "worst_s": percentile(latencies, 100),
+              "p99_ms": percentile(latencies, 99) * 1000, "wall_s": wall,
+              "extra": extra, "off_cm": math.hypot(x, y), "error": error}
+    # djitellopy forgets the address when the Tello object is collected,
+    # which must happen before the next row connects to it again
+    del drone
+    gc.collect()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--loss", type=float, nargs="+", default=[0.05, 0.1],
+                        help="chance that a command or an answer is lost")
+    parser.add_argument("--laps", type=int, default=3, help="lossy laps to fly")
+    parser.add_argument("--warmup", type=int, default=3, help="clean laps to fly first")
+    parser.add_argument("--time-scale", type=float, default=0.2,
+                        help="1.0 flies in real time")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rows = []
+    for loss in args.loss:
+        for name, adaptive in (("fixed", False), ("learned", True)):
+            result = run(loss, adaptive, args.laps, args.warmup, args.time_scale, args.seed)
+            rows.append([f"{loss:g}", name, result["lost"], f"{result['worst_s']:.2f}",
+                         f"{result['p99_ms']:.0f}", f"{result['wall_s']:.1f}", result["extra"],
+                         f"{result['off_cm']:.0f}", result["error"]])
+
+    print_table(["loss", "timeouts", "lost packets", "worst s", "p99 ms", "wall s",
+                 "extra moves", "off by cm", "error"], rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Instrumentation benchmark. Reports what one Util.Metrics sample costs, with
+Histogram.observe() alone and around a call with Histogram.timed(), then
+flies the command_latency missions against the simulator without and with
+HeadsUpTello(metrics=...), once more under the sampling profiler, and
+prints where the instrumented flights spent their time.
+
+    % python3 -m Bench.metrics_overhead
+    % python3 -m Bench.metrics_overhead --export metrics.prom
+"""
+
+import argparse
+import gc
+import logging
+import time
+from contextlib import nullcontext
+
+from djitellopy import Tello
+
+from Bench.command_latency import MISSIONS, reset
+from Bench.common import print_table, time_call
+from Sim.tello_sim import TelloSimulator, loopback_tello
+from Src.headsupflight import HeadsUpTello
+from Util.Metrics import Metrics
+
+
+def nothing():
+    pass
+
+
+def sample_costs(repeat):
+    """ Returns the ns of one observe() and of the timed() wrapper around a call. """
+    histogram = Metrics().histogram("bench_seconds")
+    timed = histogram.timed(nothing)
+    plain = time_call(nothing, repeat=repeat)
+    return [["observe()", f"{time_call(histogram.observe, 0.00123, repeat=repeat) * 1e9:.0f}"],
+            ["timed() call", f"{(time_call(timed, repeat=repeat) - plain) * 1e9:.0f}"]]
+
+
+def fly(metrics, missions, profile=False):
+    """
+    Flies every mission once. Returns the wall time in seconds and the
+    SamplingProfiler that watched the flights, if profile is set.
+    """
+    with TelloSimulator() as sim:
+        Tello.LOGGER.setLevel(logging.WARNING)
+        drone = HeadsUpTello(loopback_tello(sim.address[0]), 0, {'ceiling': 500, 'floor': 50},
+                             debug_level=logging.WARNING, metrics=metrics)
+        start = time.perf_counter()
+        with metrics.profile(interval=0.001) if profile else nullcontext() as profiler:
+            for name in missions:
+                reset(sim, drone)
+                MISSIONS[name](drone)
+        wall = time.perf_counter() - start
+        drone.disconnect()
+    del drone
+    gc.collect()
+    return wall, profiler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeat", type=int, default=200000, help="calls per sample cost")
+    parser.add_argument("--export", help="also write the metrics to this Prometheus text file")
+    parser.add_argument("missions", nargs="*", default=["status", "square", "waypoints", "altitude"])
+    args = parser.parse_args()
+
+    print_table(["sample", "ns"], sample_costs(args.repeat))
+    print()
+
+    metrics = Metrics()
+    if args.export:
+        metrics.export(path=args.export, period=1.0)
+    rows = [["off", f"{fly(None, args.missions)[0]:.3f}"],
+            ["on", f"{fly(metrics, args.missions)[0]:.3f}"]]
+    wall, profiler = fly(metrics, args.missions, profile=True)
+    rows.append(["on, profiled", f"{wall:.3f}"])
+    print_table(["metrics", "wall s"], rows)
+    print()
+
+    print_table(["histogram", "labels", "count", "total s", "p50 ms", "p99 ms"],
+                [[row['name'], ",".join(f"{k}={v}" for k, v in row['labels'].items()),
+                  row['count'], f"{row['total_s']:.3f}", f"{row['p50_ms']:.3f}",
+                  f"{row['p99_ms']:.3f}"] for row in metrics.report()[:12]])
+    start = time.perf_counter()
+    text = metrics.render()
+    print(f"\nrender(): {len(text.splitlines())} lines in {(time.perf_counter() - start) * 1000:.2f} ms")
+    print(f"\nProfiler, most sampled of {profiler.samples} samples:")
+    for function, count in profiler.top(5):
+        print(f"  {count:5d}  {function}")
+    metrics.close()
+
+
+if __name__ == '__main__':
+    main()
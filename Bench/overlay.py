@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Overlay benchmark. Stamps the time and three lines of changing telemetry onto
+960x720 frames with Camera.Photo.cv2TextBoxWithBackground() and with the
+cached Camera.Overlay.OverlayRenderer, and reports the time per frame and
+the share of the frame budget it takes at 30 and 60 FPS.
+
+    % python3 -m Bench.overlay
+    % python3 -m Bench.overlay --seconds 30 30 60 120
+"""
+
+import argparse
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from Bench.common import print_table
+from Camera.Overlay import OverlayRenderer
+from Camera.Photo import cv2TextBoxWithBackground
+
+
+def telemetry_lines(fps, seconds, seed=0):
+    """
+    The overlay text of every frame of a flight: the clock ticks once a
+    second, the height and pose change every few frames, the battery rarely.
+    """
+    rng = np.random.default_rng(seed)
+    start = datetime(2024, 1, 1, 12, 0, 0)
+    position = np.zeros(3)
+    frames = []
+    for i in range(fps * seconds):
+        now = start + timedelta(seconds=i / fps)
+        position += rng.normal(0, 10 / fps, 3)
+        frames.append([now.strftime("%Y-%m-%d %H:%M.%S"),
+                       ["Height ", f"{80 + position[2]:.0f}", "cm  ToF ", f"{90 + position[2]:.0f}",
+                        "cm"],
+                       ["Battery ", f"{100 - i // (fps * 20)}", "%  ", "62", "C"],
+                       ["x ", f"{position[0]:.0f}", "  y ", f"{position[1]:.0f}", "  z ",
+                        f"{position[2]:.0f}", "  yaw ", "0"]])
+    return frames
+
+
+def legacy(img, lines):
+    """ What stamping a frame costs with one cv2TextBoxWithBackground() per line. """
+    y = 0
+    for line in lines:
+        cv2TextBoxWithBackground(img, line if isinstance(line, str) else "".join(line), pos=(0, y))
+        y += 17
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--seconds", type=int, default=10, help="seconds of video to stamp")
+    parser.add_argument("--repeat", type=int, default=3, help="runs to take the best of")
+    parser.add_argument("rates", nargs="*", type=int, default=[30, 60], help="frame rates")
+    args = parser.parse_args()
+
+    img = np.zeros((720, 960, 3), dtype=np.uint8)
+    # Warm up OpenCV and NumPy so the first row isn't slower than the rest
+    for lines in telemetry_lines(30, 1):
+        legacy(img, lines)
+        OverlayRenderer().draw_lines(img, lines)
+
+    rows = []
+    for fps in args.rates:
+        frames = telemetry_lines(fps, args.seconds)
+        for name in ("cv2TextBoxWithBackground", "OverlayRenderer"):
+            # Best of several runs, each with an empty cache
+            best = None
+            for _ in range(args.repeat):
+                renderer = OverlayRenderer()
+                draw = legacy if name == "cv2TextBoxWithBackground" else renderer.draw_lines
+                start = time.perf_counter()
+                for lines in frames:
+                    draw(img, lines)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            per_frame = best / len(frames)
+            lookups = renderer.hits + renderer.misses
+            hits = f"{renderer.hits / lookups:.0%}" if lookups else ""
+            rows.append([fps, name, f"{per_frame * 1e6:.1f}", f"{per_frame * fps:.2%}", hits])
+
+    print_table(["fps", "renderer", "us/frame", "frame budget", "cache hits"], rows)
+
+
+if __name__ == '__main__':
+    main()
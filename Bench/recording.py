@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Recording benchmark. Sends a stream of SDK queries through HeadsUpTello while
+recording the simulator's video, and reports the command latency with no
+recording, with the encoder on a thread and with the encoder in its own
+process. The simulator runs in a separate process so that its own video
+encoding does not compete with the drone client.
+
+djitellopy polls for answers every 100 ms, which hides small delays in the
+command latency, so the lateness of a 10 ms control loop running next to
+the commands is reported as well; it shows time lost waiting for the GIL.
+
+    % python3 -m Bench.recording
+    % python3 -m Bench.recording --size 960 720 --commands 200
+"""
+
+import argparse
+import logging
+import multiprocessing
+import threading
+import time
+
+from djitellopy import Tello
+
+from Bench.command_latency import instrument
+from Bench.common import percentile, print_table
+from Camera.Photo import frame_ring
+from Camera.Recorder import RecordingPipeline
+from Sim.tello_sim import TelloSimulator, loopback_tello
+from Src.headsupflight import HeadsUpTello
+
+
+def run_simulator(ready, done):
+    """ Runs a video streaming simulator until done is set. """
+    with TelloSimulator(video=True):
+        ready.set()
+        done.wait()
+
+
+def control_loop(period, lateness, done):
+    """ Wakes up every period seconds and records how late it woke up. """
+    deadline = time.perf_counter()
+    while not done.is_set():
+        deadline += period
+        time.sleep(max(deadline - time.perf_counter(), 0))
+        lateness.append(time.perf_counter() - deadline)
+
+
+def measure(drone, latencies, commands):
+    """
+    Sends commands battery queries. Returns the p50/p99/max command latency
+    and the p99 control loop lateness in ms.
+    """
+    latencies.clear()
+    lateness, done = [], threading.Event()
+    loop = threading.Thread(target=control_loop, args=(0.01, lateness, done))
+    loop.start()
+    for _ in range(commands):
+        drone.get_battery(max_age=0)
+    done.set()
+    loop.join()
+    values = [percentile(latencies, pct) for pct in (50, 99, 100)] + [percentile(lateness, 99)]
+    return [f"{value * 1000:.1f}" for value in values]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--commands", type=int, default=100,
+                        help="queries to send for each encoder")
+    parser.add_argument("--size", type=int, nargs=2, default=(960, 720),
+                        help="width and height of the recorded movie")
+    parser.add_argument("--fps", type=int, default=30)
+    parser.add_argument("--path", default="/tmp/bench_recording.avi")
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context('spawn')
+    ready, done = context.Event(), context.Event()
+    simulator = context.Process(target=run_simulator, args=(ready, done), daemon=True)
+    simulator.start()
+    ready.wait()
+    try:
+        Tello.LOGGER.setLevel(logging.WARNING)
+        tello = loopback_tello()
+        latencies = []
+        instrument(tello, latencies)
+        drone = HeadsUpTello(tello, 0, {'ceiling': 500, 'floor': 50}, debug_level=logging.WARNING)
+        ring = frame_ring(drone.drone)
+        ring.wait(timeout=10)
+        rows = [["off"] + measure(drone, latencies, args.commands) + ["", "", ""]]
+        for encoder in ('thread', 'process'):
+            pipeline = RecordingPipeline(ring, args.path, args.fps, None, args.size,
+                                         encoder=encoder).start()
+            time.sleep(1)
+            row = [encoder] + measure(drone, latencies, args.commands)
+            pipeline.stop()
+            pipeline.join()
+            encoded = pipeline.encode_stats
+            dropped = sum(stats.dropped for stats in pipeline.stats)
+            rows.append(row + [f"{encoded.fps:.1f}", dropped, f"{encoded.load:.0%}"])
+        drone.drone.frame_grabber.stop()
+        drone.disconnect()
+    finally:
+        done.set()
+        simulator.join()
+
+    print_table(["encoder", "p50 ms", "p99 ms", "max ms", "loop p99 ms", "encode fps", "dropped",
+                 "busy"], rows)
+
+
+if __name__ == '__main__':
+    main()
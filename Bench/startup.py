@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Startup benchmark. Starts a fresh Python process that imports HeadsUpTello,
+connects to the simulator and sends takeoff, and reports how long each step
+took and the time from starting the process to the answer of that first
+flight command. Each row is the median of --repeat runs.
+
+The 'camera' rows also import cv2 and Camera.Photo up front, the way
+flight_controller.py used to. The 'lazy' rows pass lazy_connect=True, which
+leaves the barometer baseline for later.
+
+    % python3 -m Bench.startup
+    % python3 -m Bench.startup --repeat 10
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from Bench.common import print_table
+from Sim.tello_sim import TelloSimulator
+
+
+CHILD = """
+import json, logging, time
+start = time.perf_counter()
+if {camera}:
+    import cv2
+    import Camera.Photo
+from djitellopy import Tello
+from Sim.tello_sim import loopback_tello
+from Src.headsupflight import HeadsUpTello
+imported = time.perf_counter()
+Tello.LOGGER.setLevel(logging.WARNING)
+options = {{'lazy_connect': True}} if {lazy} else {{}}
+drone = HeadsUpTello(loopback_tello(), 0, {{'ceiling': 500, 'floor': 50}},
+                     debug_level=logging.WARNING, name='startup', **options)
+connected = time.perf_counter()
+drone.takeoff()
+first = time.perf_counter()
+print(json.dumps([imported - start, connected - imported, first - connected]), flush=True)
+drone.land()
+drone.disconnect()
+"""
+
+
+def run(camera, lazy):
+    """ Runs one child process. Returns its step times and the total in seconds. """
+    code = CHILD.format(camera=camera, lazy=lazy)
+    start = time.perf_counter()
+    child = subprocess.Popen([sys.executable, "-c", code], stdout=subprocess.PIPE, text=True,
+                             cwd=os.getcwd())
+    line = child.stdout.readline()
+    total = time.perf_counter() - start
+    child.communicate()
+    if not line:
+        raise RuntimeError("The startup process failed")
+    return json.loads(line) + [total]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rows = []
+    with TelloSimulator(settle=0.0):
+        for name, camera, lazy in (("camera imports", True, False), ("plain", False, False),
+                                   ("plain, lazy", False, True)):
+            runs = [run(camera, lazy) for _ in range(args.repeat)]
+            medians = [statistics.median(values) for values in zip(*runs)]
+            rows.append([name] + [f"{value * 1000:.0f}" for value in medians])
+    if os.path.exists("startup.log"):
+        os.remove("startup.log")
+
+    print_table(["imports", "import ms", "connect ms", "takeoff ms", "to first command ms"],
+                rows)
+
+
+if __name__ == '__main__':
+    main()
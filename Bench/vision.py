@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Marker detection benchmark. Feeds 960x720 frames with three moving ArUco
+markers into a FrameRing at the drone's 30 FPS while a display loop, like
+Flight.controller's, takes every new frame. Markers are found inline in
+that loop on full frames, or by Camera.Vision.VisionStage with different
+worker counts and scales. Reports the frames the display loop kept up with,
+its worst gap, the detection results per second, the frame arrival to
+result latency and how many results found all three markers.
+
+    % python3 -m Bench.vision
+    % python3 -m Bench.vision --seconds 10 --workers 1 2 4
+"""
+
+import argparse
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from Bench.common import percentile, print_table
+from Camera.FrameRing import FrameRing
+from Camera.Vision import VisionStage
+
+
+MARKERS = (3, 17, 42)
+
+
+def make_frames(count, size=(960, 720), side=120, seed=0):
+    """ count BGR frames of a noisy floor with the MARKERS drifting across it. """
+    width, height = size
+    rng = np.random.default_rng(seed)
+    dictionary = cv2.aruco.getPredefinedDictionary(cv2.aruco.DICT_4X4_50)
+    tiles = []
+    for marker_id in MARKERS:
+        tile = np.full((side + 40, side + 40), 255, np.uint8)
+        tile[20:20 + side, 20:20 + side] = cv2.aruco.generateImageMarker(dictionary, marker_id, side)
+        tiles.append(cv2.cvtColor(tile, cv2.COLOR_GRAY2BGR))
+    floor = rng.integers(60, 160, (height, width, 3), np.uint8)
+    frames = []
+    for i in range(count):
+        image = floor.copy()
+        for n, tile in enumerate(tiles):
+            x = int((width - tile.shape[1]) * (0.1 + 0.3 * n + 0.05 * np.sin(i / 10 + n)))
+            y = int((height - tile.shape[0]) * (0.5 + 0.3 * np.cos(i / 15 + n)))
+            image[y:y + tile.shape[0], x:x + tile.shape[1]] = tile
+        frames.append(image)
+    return frames
+
+
+def feed(ring, frames, fps, stop):
+    """ Writes the frames into the ring on a 1 / fps schedule, like the decoder. """
+    period = 1 / fps
+    deadline = time.monotonic()
+    index = 0
+    while not stop.is_set():
+        ring.write(frames[index % len(frames)])
+        index += 1
+        deadline += period
+        stop.wait(max(deadline - time.monotonic(), 0))
+    ring.close()
+
+
+def run(frames, fps, seconds, workers, scale):
+    """ One row: workers=0 finds the markers inline in the display loop. """
+    ring = FrameRing()
+    stop = threading.Event()
+    results = []
+    detector = cv2.aruco.ArucoDetector(cv2.aruco.getPredefinedDictionary(cv2.aruco.DICT_4X4_50),
+                                       cv2.aruco.DetectorParameters())
+    vision = None
+    if workers:
+        vision = VisionStage(ring, workers=workers, scale=scale)
+        vision.add_listener(lambda detections: results.append(
+            (detections.detected - detections.arrived, len(detections.markers))))
+        vision.start()
+    feeder = threading.Thread(target=feed, args=(ring, frames, fps, stop), daemon=True)
+    feeder.start()
+
+    shown, gaps = 0, []
+    last_seq, last_shown = -1, time.monotonic()
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        frame = ring.wait(last_seq, timeout=0.05)
+        if frame is None:
+            continue
+        last_seq = frame.seq
+        if not workers:
+            gray = cv2.cvtColor(frame.image, cv2.COLOR_BGR2GRAY)
+            _, ids, _ = detector.detectMarkers(gray)
+            results.append((time.monotonic() - frame.timestamp, 0 if ids is None else len(ids)))
+        now = time.monotonic()
+        gaps.append(now - last_shown)
+        last_shown = now
+        shown += 1
+
+    stop.set()
+    feeder.join()
+    if vision is not None:
+        vision.stop()
+    latencies = [latency for latency, _ in results]
+    return {"shown": shown / (seconds * fps), "worst_gap_ms": percentile(gaps, 100) * 1000,
+            "results_s": len(results) / seconds, "p50_ms": percentile(latencies, 50) * 1000,
+            "p99_ms": percentile(latencies, 99) * 1000,
+            "found": sum(found == len(MARKERS) for _, found in results) / max(len(results), 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--seconds", type=float, default=5.0, help="seconds of video per row")
+    parser.add_argument("--fps", type=int, default=30)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2])
+    parser.add_argument("--scales", type=float, nargs="+", default=[1.0, 0.5])
+    args = parser.parse_args()
+
+    frames = make_frames(60)
+    rows = []
+    for workers, scale in [(0, 1.0)] + [(w, s) for w in args.workers for s in args.scales]:
+        result = run(frames, args.fps, args.seconds, workers, scale)
+        rows.append(["inline" if not workers else f"{workers} workers", f"{scale:g}",
+                     f"{result['shown']:.0%}", f"{result['worst_gap_ms']:.0f}",
+                     f"{result['results_s']:.1f}", f"{result['p50_ms']:.1f}",
+                     f"{result['p99_ms']:.1f}", f"{result['found']:.0%}"])
+
+    print(f"{cv2.getNumberOfCPUs()} CPUs")
+    print_table(["detection", "scale", "frames shown", "worst gap ms", "results/s",
+                 "p50 ms", "p99 ms", "all markers"], rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Visual odometry benchmark. Flies a made-up drone over a textured floor the
+way Sim.tello_sim draws it, 960x720 frames at 30 FPS into a FrameRing, on
+legs that end up to 15% long or short and a few cm to the side, like a real
+drone's moves. Camera.VisualOdometry follows the video in its own process.
+Reports, per leg, how far the commanded distance and the odometry were from
+where the drone really went, then the frames per second the flow kept up
+with, its CPU time per frame and the latency from frame to fix.
+
+    % python3 -m Bench.visual_odometry
+    % python3 -m Bench.visual_odometry --legs 12 --scale 0.5
+"""
+
+import argparse
+import math
+import threading
+import time
+
+import numpy as np
+
+from Bench.common import print_table
+from Camera.FrameRing import FrameRing
+from Camera.VisualOdometry import VisualOdometry
+
+
+HEIGHT = 90
+
+
+class FloorState:
+    """ Stands in for Util.Telemetry: the drone flies level at one height. """
+
+    def snapshot(self):
+        return {'tof': HEIGHT, 'yaw': 0.0}, {}
+
+
+def floor_texture(size, seed=0):
+    """ The simulator's floor: 16 pixel blocks of random gray that tile seamlessly. """
+    width, height = size
+    rng = np.random.default_rng(seed)
+    texture = rng.integers(0, 255, (height // 16, width // 16, 1), np.uint8)
+    texture = np.repeat(np.repeat(texture, 16, axis=0), 16, axis=1).repeat(3, axis=2)
+    return np.tile(texture, (2, 2, 1))
+
+
+def fly(ring, texture, size, legs, fps, speed, done):
+    """
+    Writes a frame every 1 / fps seconds of the drone flying each leg's
+    true offset at speed cm/s, and hovering half a second after it. One
+    pixel is one cm, as in the simulator. Calls done(leg, x, y) after each
+    hover with where the drone really is.
+    """
+    width, height = size
+    rows, cols = texture.shape[:2]
+    x = y = 0.0
+    period = 1 / fps
+    deadline = time.monotonic()
+    for leg, (dx, dy) in enumerate(legs):
+        steps = max(round(math.hypot(dx, dy) / speed * fps), 1)
+        hover = round(0.5 * fps)
+        for step in range(steps + hover):
+            if step < steps:
+                x += dx / steps
+                y += dy / steps
+            top, left = int(-x) % (rows - height), int(-y) % (cols - width)
+            ring.write(np.ascontiguousarray(texture[top:top + height, left:left + width]))
+            deadline += period
+            time.sleep(max(deadline - time.monotonic(), 0))
+        done(leg, x, y)
+    ring.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--legs", type=int, default=8)
+    parser.add_argument("--fps", type=int, default=30)
+    parser.add_argument("--scale", type=float, default=0.25, help="odometry downscale")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    size = (960, 720)
+    rng = np.random.default_rng(args.seed)
+    commanded = [(100, 0), (0, 100), (-100, 0), (0, -100)] * (args.legs // 4 + 1)
+    commanded = commanded[:args.legs]
+    legs = []
+    for dx, dy in commanded:
+        stretch = 1 + rng.uniform(-0.15, 0.15)
+        side = rng.normal(0, 5)
+        legs.append((dx * stretch - dy / 100 * side, dy * stretch + dx / 100 * side))
+
+    ring = FrameRing()
+    texture = floor_texture(size)
+    ring.write(np.ascontiguousarray(texture[:size[1], :size[0]]))
+    # The floor is drawn one pixel per cm, so the focal length in pixels
+    # equals the height in cm
+    odometry = VisualOdometry(ring, FloorState(), scale=args.scale, focal=HEIGHT)
+    fixes = []
+    odometry.add_listener(fixes.append)
+    odometry.start()
+    ends = []
+
+    def done(leg, x, y):
+        ends.append((x, y, ring.latest))
+
+    flight = threading.Thread(target=fly, args=(ring, texture, size, legs, args.fps, 100, done))
+    flight.start()
+    flight.join()
+    odometry.stop()
+
+    rows = []
+    planned = np.zeros(2)
+    command_errors, odometry_errors = [], []
+    for leg, ((x, y, seq), step) in enumerate(zip(ends, commanded)):
+        planned += step
+        # The fix of the last hover frame of the leg, or of the newest
+        # frame before it that the odometry got to
+        fix = max((fix for fix in fixes if fix.seq <= seq), key=lambda fix: fix.seq, default=None)
+        command_error = math.dist(planned, (x, y))
+        odometry_error = math.dist((fix.x, fix.y), (x, y)) if fix is not None else math.nan
+        command_errors.append(command_error)
+        odometry_errors.append(odometry_error)
+        rows.append([leg, f"{x:.0f},{y:.0f}", f"{command_error:.1f}", f"{odometry_error:.1f}"])
+    print_table(["leg", "true x,y cm", "commanded off by cm", "odometry off by cm"], rows)
+    print(f"\nmean: commanded {np.mean(command_errors):.1f} cm, "
+          f"odometry {np.nanmean(odometry_errors):.1f} cm\n")
+    print(odometry.report())
+    frames = odometry.flow_stats.frames
+    print(f"flow: {odometry.flow_stats.busy / max(frames, 1) * 1000:.2f} ms CPU per frame, "
+          f"{frames / max(odometry.flow_stats.elapsed, 1e-9):.1f} frames/s of "
+          f"{args.fps} in the video")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+import threading
+import time
+from collections import namedtuple
+
+import av
+import numpy as np
+from djitellopy import Tello
+
+
+# One video frame. image is a read-only view into the ring's memory; it stays
+# valid until the ring wraps around onto its slot, see FrameRing.valid().
+Frame = namedtuple("Frame", "seq timestamp image")
+
+
+class FrameRing:
+    """
+    A fixed number of preallocated frame buffers that the video thread writes
+    into in turn. Every frame gets a sequence number and its arrival time, so a
+    consumer can tell whether it already saw a frame and can block until the
+    next one arrives. Consumers get read-only views of the buffers, so reading
+    a frame copies and allocates nothing; write() copies each frame into its
+    buffer once.
+    """
+
+    def __init__(self, slots=4):
+        """
+        Arguments
+            slots: Number of buffers. A view stays valid while fewer than
+                   slots - 1 newer frames have arrived.
+        """
+        self.slots = slots
+        self.buffer = None
+        self.views = []
+        self.seqs = [-1] * slots
+        self.stamps = [0.0] * slots
+        self.latest = -1
+        self.closed = False
+        self.ready = threading.Condition()
+
+    def allocate(self, shape, dtype=np.uint8):
+        """ Allocates the buffers once the frame size is known. """
+        self.buffer = np.zeros((self.slots,) + tuple(shape), dtype=dtype)
+        self.views = []
+        for slot in range(self.slots):
+            view = self.buffer[slot].view()
+            view.flags.writeable = False
+            self.views.append(view)
+
+    def write(self, image, timestamp=None):
+        """ Copies one frame into the next buffer and wakes up the readers. """
+        timestamp = time.monotonic() if timestamp is None else timestamp
+        if self.buffer is None or self.buffer.shape[1:] != image.shape:
+            with self.ready:
+                self.allocate(image.shape, image.dtype)
+                self.seqs = [-1] * self.slots
+        seq = self.latest + 1
+        slot = seq % self.slots
+        # Mark the slot as being written so valid() fails for old views of it
+        self.seqs[slot] = -1
+        np.copyto(self.buffer[slot], image)
+        with self.ready:
+            self.seqs[slot] = seq
+            self.stamps[slot] = timestamp
+            self.latest = seq
+            self.ready.notify_all()
+        return seq
+
+    def get(self, seq=None):
+        """ Returns frame seq (the newest by default), or None if it is gone. """
+        seq = self.latest if seq is None else seq
+        if seq < 0:
+            return None
+        slot = seq % self.slots
+        if self.seqs[slot] != seq:
+            return None
+        return Frame(seq, self.stamps[slot], self.views[slot])
+
+    def wait(self, after=-1, timeout=None):
+        """
+        Blocks until a frame newer than sequence number after arrives and
+        returns the newest frame, or None on timeout or when the ring closes.
+        """
+        with self.ready:
+            if not self.ready.wait_for(lambda: self.latest > after or self.closed, timeout):
+                return None
+            if self.latest <= after:
+                return None
+            return self.get(self.latest)
+
+    def valid(self, frame):
+        """ True while frame's buffer has not been reused for a newer frame. """
+        return self.seqs[frame.seq % self.slots] == frame.seq
+
+    def close(self):
+        """ Wakes up every reader; wait() returns None from now on. """
+        with self.ready:
+            self.closed = True
+            self.ready.notify_all()
+
+
+class FrameGrabber:
+    """
+    Decodes the drone's video stream on a background thread into a FrameRing
+    of BGR images. Use this instead of djitellopy's get_frame_read(), which
+    hands every reader a new array (in RGB order). Only one of the two can
+    listen on the video port at a time.
+
+    PyAV can't convert into a buffer of ours, so every frame is still
+    converted into a new array and copied into the ring. Converting the
+    decoded YUV planes with cv2.cvtColor(dst=...) straight into the ring
+    needs the planes copied into one I420 buffer first, and took 1.5 ms per
+    960x720 frame against 0.9 ms for the conversion and the copy.
+    """
+
+    def __init__(self, drone, slots=4):
+        self.drone = drone
+        self.ring = FrameRing(slots)
+        self.frames = 0
+        self.stopped = threading.Event()
+        self.container = None
+        self.worker = None
+
+    def start(self):
+        """ Turns on the video stream and starts decoding it. """
+        if not self.drone.stream_on:
+            self.drone.streamon()
+        try:
+            self.container = av.open(self.drone.get_udp_video_address(),
+                                     timeout=(Tello.FRAME_GRAB_TIMEOUT, None))
+        except av.error.ExitError:
+            raise RuntimeError('Failed to grab video frames from video stream')
+        self.worker = threading.Thread(target=self.decode, daemon=True)
+        self.worker.start()
+        return self
+
+    def decode(self):
+        """ Worker thread: decodes frames until stop() is called. """
+        # HeadsUpTello.instrument() leaves its Metrics on the Tello object
+        metrics = getattr(self.drone, 'metrics', None)
+        convert = None
+        if metrics is not None:
+            convert = metrics.histogram("frame_seconds", "Work per video frame", stage="convert")
+        try:
+            for frame in self.container.decode(video=0):
+                if self.stopped.is_set():
+                    break
+                begin = time.perf_counter()
+                self.ring.write(frame.to_ndarray(format='bgr24'), time.monotonic())
+                self.frames += 1
+                if convert is not None:
+                    convert.observe(time.perf_counter() - begin)
+        except av.error.FFmpegError:
+            pass
+        finally:
+            self.container.close()
+            self.ring.close()
+
+    def stop(self):
+        """ Stops decoding. The thread exits on the next frame. """
+        self.stopped.set()
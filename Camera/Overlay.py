@@ -0,0 +1,192 @@
+from collections import OrderedDict
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+
+class TextSprite:
+    """
+    A piece of text rendered once: the BGR pixels, and a uint8 mask that is
+    non-zero for the pixels to copy onto a frame, or None when every pixel
+    is copied.
+    """
+
+    def __init__(self, pixels, mask):
+        self.pixels = pixels
+        self.mask = mask
+
+    @property
+    def size(self):
+        """ (width, height) in pixels. """
+        return self.pixels.shape[1], self.pixels.shape[0]
+
+
+class OverlayRenderer:
+    """
+    Draws text on video frames from an LRU cache of rendered sprites, so the
+    OpenCV text functions only run the first time a string is seen. Drawing
+    a cached string is a single masked copy into the frame.
+
+    Strings are cached whole, keyed by the text and the style they were drawn
+    in. A time stamp that changes once a second hits the cache on almost
+    every frame. Text whose numbers change all the time, like telemetry, can
+    be passed as a list of segments instead of one string: the labels and
+    each number get a sprite of their own, and a line that was never drawn
+    before is pieced together from them instead of being rendered again.
+    """
+
+    def __init__(self, cache_size=1024, font=cv2.FONT_HERSHEY_PLAIN, font_scale=1,
+                 font_thickness=1, text_color=(30, 255, 205), text_color_bg=(48, 48, 48)):
+        """
+        Arguments
+            cache_size:    Most sprites to keep; the least recently drawn go
+            font:          OpenCV Hershey font
+            font_scale:    Font size multiplier
+            font_thickness: Line thickness in pixels
+            text_color:    BGR color of the text
+            text_color_bg: BGR color of the box behind the text, or None to
+                           draw the text straight onto the frame
+        """
+        self.cache_size = cache_size
+        self.style = (font, font_scale, font_thickness, tuple(text_color),
+                      None if text_color_bg is None else tuple(text_color_bg))
+        self.sprites = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, text, font, font_scale, font_thickness, text_color, text_color_bg):
+        """
+        Renders text into a new sprite. The layout matches
+        Camera.Photo.cv2TextBoxWithBackground(); only the anti-aliased edges
+        of letters that hang below the box come out a little different,
+        since they were blended with black instead of the frame.
+        """
+        (text_w, text_h), baseline = cv2.getTextSize(text, font, font_scale, font_thickness)
+        # cv2.rectangle() fills both corners, so the box is 3 pixels bigger
+        width = text_w + 3
+        height = max(text_h + 3, text_h + font_scale + baseline)
+        pixels = np.zeros((height, width, 3), dtype=np.uint8)
+        if text_color_bg is not None:
+            pixels[:text_h + 3] = text_color_bg
+        origin = (0, text_h + font_scale)
+        cv2.putText(pixels, text, origin, font, font_scale, text_color, font_thickness)
+        # The box is opaque, but letters like 'g' reach below it
+        mask = np.zeros((height, width), dtype=np.uint8)
+        if text_color_bg is not None:
+            mask[:text_h + 3] = 255
+        cv2.putText(mask, text, origin, font, font_scale, 255, font_thickness)
+        return TextSprite(pixels, None if mask.all() else mask)
+
+    def join(self, sprites):
+        """ Places sprites side by side, top aligned, in one new sprite. """
+        height = max(sprite.size[1] for sprite in sprites)
+        width = sum(sprite.size[0] for sprite in sprites)
+        pixels = np.zeros((height, width, 3), dtype=np.uint8)
+        mask = np.zeros((height, width), dtype=np.uint8)
+        x = 0
+        for sprite in sprites:
+            sprite_w, sprite_h = sprite.size
+            pixels[:sprite_h, x:x + sprite_w] = sprite.pixels
+            mask[:sprite_h, x:x + sprite_w] = 255 if sprite.mask is None else sprite.mask
+            x += sprite_w
+        return TextSprite(pixels, None if mask.all() else mask)
+
+    def sprite(self, text, style=None):
+        """
+        Returns the cached sprite for text, a string or a list of segments,
+        rendering it on a miss.
+        """
+        if not isinstance(text, str):
+            text = tuple(text)
+        key = (text, style or self.style)
+        sprite = self.sprites.get(key)
+        if sprite is not None:
+            self.sprites.move_to_end(key)
+            self.hits += 1
+            return sprite
+        self.misses += 1
+        if isinstance(text, str):
+            sprite = self.render(text, *key[1])
+        else:
+            sprite = self.join([self.sprite(segment, style) for segment in text])
+        self.sprites[key] = sprite
+        if len(self.sprites) > self.cache_size:
+            self.sprites.popitem(last=False)
+        return sprite
+
+    def draw(self, img, text, pos=(0, 0), style=None):
+        """
+        Draws text, a string or a list of segments, with its top left corner
+        at pos, clipped to the frame. Returns the (width, height) drawn.
+        """
+        sprite = self.sprite(text, style)
+        x, y = pos
+        frame_h, frame_w = img.shape[:2]
+        width, height = min(sprite.size[0], frame_w - x), min(sprite.size[1], frame_h - y)
+        if x < 0 or y < 0 or width <= 0 or height <= 0:
+            return 0, 0
+        target = img[y:y + height, x:x + width]
+        if sprite.mask is None:
+            target[...] = sprite.pixels[:height, :width]
+        else:
+            cv2.copyTo(sprite.pixels[:height, :width], sprite.mask[:height, :width], target)
+        return width, height
+
+    def draw_lines(self, img, lines, pos=(0, 0), spacing=2):
+        """ Draws several lines of text, strings or segments, below each other. """
+        x, y = pos
+        for line in lines:
+            _, height = self.draw(img, line, (x, y))
+            y += height + spacing
+        return img
+
+
+class TelemetryOverlay:
+    """
+    Stamps the date and time and the drone's live telemetry onto frames.
+
+    Values come from the HeadsUpTello telemetry cache and pose estimator
+    without ever sending a command to the drone. Each line is made of label
+    and number segments, and the numbers are rounded to whole units, so the
+    renderer only has to render a number the first time it shows up.
+    """
+
+    def __init__(self, drone, renderer=None, fields=('time', 'height', 'battery', 'pose'),
+                 pos=(0, 0)):
+        """
+        Arguments
+            drone:    HeadsUpTello object, or None for just the time stamp
+            renderer: OverlayRenderer to draw with
+            fields:   Lines to draw, from 'time', 'height', 'battery', 'pose'
+            pos:      Top left corner of the first line
+        """
+        self.drone = drone
+        self.renderer = renderer or OverlayRenderer()
+        self.fields = fields
+        self.pos = pos
+
+    def lines(self, now=None):
+        """ Returns each line for the current telemetry, see draw_lines(). """
+        values = {}
+        if self.drone is not None:
+            values, _ = self.drone.telemetry.snapshot()
+        lines = []
+        for field in self.fields:
+            if field == 'time':
+                lines.append((now or datetime.now()).strftime("%Y-%m-%d %H:%M.%S"))
+            elif field == 'height' and values:
+                lines.append(["Height ", f"{values['h']:.0f}", "cm  ToF ", f"{values['tof']:.0f}",
+                              "cm"])
+            elif field == 'battery' and values:
+                lines.append(["Battery ", f"{values['bat']:.0f}", "%  ", f"{values['temph']:.0f}",
+                              "C"])
+            elif field == 'pose' and values:
+                x, y, z = self.drone.pose_estimator.position()
+                lines.append(["x ", f"{x:.0f}", "  y ", f"{y:.0f}", "  z ", f"{z:.0f}", "  yaw ",
+                              f"{values['yaw']:.0f}"])
+        return lines
+
+    def draw(self, img, now=None):
+        """ Draws the overlay onto img in place and returns it. """
+        return self.renderer.draw_lines(img, self.lines(now), self.pos)
@@ -3,9 +3,23 @@ from datetime import datetime
 import logging
 from Util import Log
 from Util import Utility
+from Camera.FrameRing import FrameGrabber
+from Camera.Recorder import RecordingPipeline
 import cv2
+import os
+import sys
+import threading
 import time
 
+
+# Ground stations without a display can't open OpenCV windows. Set this to
+# True (or pass headless=True) to take photos and movies without any windows.
+HEADLESS = sys.platform.startswith('linux') and not (os.environ.get('DISPLAY') or
+                                                     os.environ.get('WAYLAND_DISPLAY'))
+
+# Recordings and snapshots can ask for the ring from different threads
+grabber_lock = threading.Lock()
+
 def cv2TextBoxWithBackground(img, text,
         font=cv2.FONT_HERSHEY_PLAIN,
         pos=(0, 0),
@@ -23,9 +37,59 @@ def cv2TextBoxWithBackground(img, text,
     return img
 
 
-def take_photo(drone):
-    drone.streamon()
-    camera = drone.get_frame_read()
+def frame_ring(drone):
+    """
+    Returns the drone's FrameRing, starting the video stream and the decoder
+    thread the first time. Every camera function shares the same ring.
+    """
+    with grabber_lock:
+        grabber = getattr(drone, 'frame_grabber', None)
+        if grabber is None or grabber.stopped.is_set():
+            grabber = FrameGrabber(drone).start()
+            drone.frame_grabber = grabber
+        return grabber.ring
+
+
+def stop_video(drone):
+    """ Stops the decoder thread that frame_ring() started, if there is one. """
+    with grabber_lock:
+        grabber = getattr(drone, 'frame_grabber', None)
+        if grabber is not None:
+            grabber.stop()
+            drone.frame_grabber = None
+
+
+def snapshot(drone, path=None, stamp=True):
+    """
+    Returns the next frame from the drone's camera as a BGR image that the
+    caller owns, without a countdown or a window. The image is saved to path
+    if one is given.
+
+    Arguments
+        drone: djitellopy Tello object
+        path:  Image file to write, or None
+        stamp: Draw the date and time in the corner
+    """
+    camera = frame_ring(drone)
+    frame = camera.wait(camera.latest, timeout=Tello.FRAME_GRAB_TIMEOUT)
+    if frame is None:
+        raise RuntimeError('No video frames arrived from the drone')
+    # The ring's frames are read-only, and we may be about to draw on this one
+    image = frame.image.copy()
+    if stamp:
+        cv2TextBoxWithBackground(image, datetime.now().strftime("%Y-%m-%d %H:%M.%S"))
+    if path is not None:
+        cv2.imwrite(path, image)
+    return image
+
+
+def take_photo(drone, path='my_drone_photo.png', headless=None):
+    """
+    Counts down, saves a time stamped photo to path and shows it until the
+    window is closed. In headless mode the photo is only saved.
+    """
+    headless = HEADLESS if headless is None else headless
+    frame_ring(drone)
 
     print('Taking picture in 3s... ', end='', flush=True)
     time.sleep(1)
@@ -37,10 +101,9 @@ def take_photo(drone):
     print("* CLICK! *")
     print("**********")
 
-    image = camera.frame
-    text = datetime.now().strftime("%Y-%m-%d %H:%m.%S")
-    cv2TextBoxWithBackground(image, text)
-    cv2.imwrite("my_drone_photo.png", image)
+    image = snapshot(drone, path)
+    if headless:
+        return image
 
     cv2.imshow("My Drone Photograph", image)
     time.sleep(0.001)
@@ -59,51 +122,57 @@ def take_photo(drone):
         key_code = cv2.waitKey(100)
         if key_code & 0xFF == 27:
             break
-
-
-    # Turn off the video stream and the drone
-
-
-def record(drone, fps):
-    # Turn on video stream and get the BackgroundFrameRead object
-
-    drone.streamon()
-    camera = drone.get_frame_read()
-
-    # To make the movie play at 'real life' speed, choose a frame rate and then
-    # calculate the time delay between each frame. The video capture loop will have
-    # to regulate itsejlf to write frames at the this frequency.
-
-    movie_name = 'drone_capture.avi'
-    movie_codec = cv2.VideoWriter_fourcc(*'mp4v')
-    movie_fps = fps
-    frame_wait = 1 / movie_fps
-    movie_size = (360, 240)
-
-    print(f"Recording movie at {movie_fps} FPS or 1/{frame_wait:.3f}s")
-
-    # Show video by looping and showing frame by frame (animation style)
-    # Notice that we can't do anything else except take video... if we want the
-    #drone to do something else while taking video, we'll need to use threads
-
-    frame_counter = 0
-    time_prev = time.time()
-    cv2.namedWindow("Drone Video Feed")
-    movie = cv2.VideoWriter(movie_name, movie_codec, movie_fps, movie_size, True)
-
-    while frame_counter < 10 * movie_fps:
-        time_curr = time.time()
-        time_elapsed = time_curr - time_prev
-        if time_elapsed > frame_wait:
-            image = camera.frame
-            image = cv2.resize(image, movie_size)
-            cv2.imshow("Drone Video Feed", image)
-            cv2.waitKey(1)
-            movie.write(image)
-            time_prev = time_curr
-            frame_counter += 1
-            if frame_counter % movie_fps == 0:
-                print(f"FRAME: {frame_counter} @ {time_elapsed}")
-        cv2.waitKey(5)
-
-    print("Finished!")
\ No newline at end of file
+    return image
+
+
+def record(drone, fps, duration=10.0, path='drone_capture.avi', size=(360, 240), drop='oldest',
+           headless=None, encoder='process'):
+    """
+    Records a movie from the drone's camera and shows it in a window while
+    it records. Capturing, resizing and encoding run on their own threads
+    (see Camera.Recorder), so a slow encoder drops frames instead of making
+    the movie stutter, and the encoder runs in its own process so it does not
+    slow down the drone's commands. Press ESCAPE in the window to stop early.
+
+    Arguments
+        drone:    djitellopy Tello object
+        fps:      Frame rate of the movie
+        duration: Seconds to record, or None to record until ESCAPE
+        path:     Movie file to write
+        size:     (width, height) of the movie
+        drop:     What to do with frames a stage can't keep up with, see
+                  Camera.Recorder.DROP_POLICIES
+        headless: True to record without a window, None for HEADLESS
+        encoder:  'process' or 'thread', see Camera.Recorder.RecordingPipeline
+    """
+    headless = HEADLESS if headless is None else headless
+    pipeline = RecordingPipeline(frame_ring(drone), path, fps, duration, size, drop=drop,
+                                 encoder=encoder)
+
+    print(f"Recording movie at {fps} FPS or 1/{1 / fps:.3f}s")
+
+    # The window has to be updated from this thread, so we show the newest
+    # resized frame while the pipeline does the real work in the background.
+    pipeline.start()
+    if headless:
+        try:
+            pipeline.join()
+        except KeyboardInterrupt:
+            pipeline.stop()
+    else:
+        cv2.namedWindow("Drone Video Feed")
+        shown = None
+        while pipeline.running:
+            image = pipeline.latest
+            if image is not None and image is not shown:
+                cv2.imshow("Drone Video Feed", image)
+                shown = image
+            if cv2.waitKey(max(int(500 / fps), 1)) & 0xFF == 27:
+                pipeline.stop()
+    pipeline.join()
+
+    if pipeline.error is not None:
+        raise pipeline.error
+    print(pipeline.report())
+    print("Finished!")
+    return pipeline
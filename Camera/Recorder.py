@@ -0,0 +1,390 @@
+import math
+import multiprocessing
+import queue
+import threading
+import time
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+from djitellopy import Tello
+
+
+# What a full queue does with a new frame: 'oldest' throws away the oldest
+# queued frame to make room (the default, keeps the video close to real time),
+# 'newest' throws away the new frame and 'block' waits for room.
+DROP_POLICIES = ('oldest', 'newest', 'block')
+
+# Put on a queue after the last frame to shut down the stages behind it.
+END_OF_STREAM = None
+
+
+class StageStats:
+    """
+    Frame counters for one stage of a RecordingPipeline. The time spent on
+    each frame also goes to histogram, a Util.Metrics.Histogram, if given.
+    """
+
+    def __init__(self, name, histogram=None):
+        self.name = name
+        self.histogram = histogram
+        self.frames = 0
+        self.dropped = 0
+        self.busy = 0.0
+        self.started = None
+        self.finished = None
+
+    def record(self, busy):
+        """ Counts one finished frame that took busy seconds of work. """
+        self.frames += 1
+        self.busy += busy
+        if self.histogram is not None:
+            self.histogram.observe(busy)
+
+    @property
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.monotonic()) - self.started
+
+    @property
+    def fps(self):
+        """ Frames this stage finished per second of wall time. """
+        return self.frames / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def load(self):
+        """ Fraction of the wall time this stage spent working on frames. """
+        return self.busy / self.elapsed if self.elapsed > 0 else 0.0
+
+    def __repr__(self):
+        return (f"{self.name}: {self.frames} frames, {self.fps:.1f} fps, "
+                f"{self.dropped} dropped, {self.load:.0%} busy")
+
+
+class FrameQueue:
+    """ A bounded queue between two stages that applies a drop policy. """
+
+    def __init__(self, maxsize, drop, stats):
+        if drop not in DROP_POLICIES:
+            raise ValueError(f"drop must be one of {DROP_POLICIES}, not {drop!r}")
+        self.queue = queue.Queue(maxsize)
+        self.drop = drop
+        self.stats = stats
+
+    def put(self, item):
+        """ Queues item, dropping a frame if the queue is full. """
+        if self.drop == 'block' or item is END_OF_STREAM:
+            self.queue.put(item)
+            return
+        while True:
+            try:
+                self.queue.put_nowait(item)
+                return
+            except queue.Full:
+                pass
+            if self.drop == 'newest':
+                self.stats.dropped += 1
+                return
+            try:
+                self.queue.get_nowait()
+                self.stats.dropped += 1
+            except queue.Empty:
+                pass
+
+    def get(self):
+        return self.queue.get()
+
+
+def encode_frames(memory_name, shape, path, codec, fps, filled, free, ready):
+    """
+    Runs in the encoder process: writes every slot number that arrives on
+    filled to the movie and hands the slot back on free. None ends the movie.
+    """
+    memory = shared_memory.SharedMemory(name=memory_name)
+    try:
+        frames = np.ndarray((len(memory.buf) // math.prod(shape),) + shape, dtype=np.uint8,
+                            buffer=memory.buf)
+        movie = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*codec), fps,
+                                (shape[1], shape[0]), True)
+        if not movie.isOpened():
+            raise RuntimeError(f"Can't open {path} for writing")
+        ready.set()
+        while True:
+            slot = filled.get()
+            if slot is None:
+                break
+            movie.write(frames[slot])
+            free.put(slot)
+        movie.release()
+        del frames
+    finally:
+        memory.close()
+
+
+class EncoderProcess:
+    """
+    A cv2.VideoWriter that encodes in a separate process, so encoding does
+    not hold the GIL that the drone's command and telemetry threads need.
+    Frames go through a few slots of shared memory; only slot numbers are
+    pickled. write() blocks while every slot is waiting to be encoded.
+
+    The encoder process is started with 'spawn', which imports the main
+    script again: scripts that record must keep their top level code under
+    if __name__ == '__main__'.
+    """
+
+    def __init__(self, path, codec, fps, size, slots=4, timeout=10.0):
+        """
+        Arguments
+            path:    Movie file to write
+            codec:   FourCC of the video codec
+            fps:     Frame rate of the movie
+            size:    (width, height) of the movie
+            slots:   Frames of shared memory
+            timeout: Seconds to wait for the encoder process to start
+        """
+        self.shape = (size[1], size[0], 3)
+        self.memory = shared_memory.SharedMemory(create=True, size=slots * math.prod(self.shape))
+        self.frames = np.ndarray((slots,) + self.shape, dtype=np.uint8, buffer=self.memory.buf)
+        context = multiprocessing.get_context('spawn')
+        self.filled = context.Queue()
+        self.free = context.Queue()
+        for slot in range(slots):
+            self.free.put(slot)
+        ready = context.Event()
+        self.process = context.Process(target=encode_frames, name="recording-encoder", daemon=True,
+                                       args=(self.memory.name, self.shape, path, codec, fps,
+                                             self.filled, self.free, ready))
+        self.process.start()
+        # Starting Python and OpenCV takes a moment; wait so no frames pile up
+        deadline = time.monotonic() + timeout
+        while not ready.wait(0.1):
+            if not self.process.is_alive() or time.monotonic() > deadline:
+                self.process.kill()
+                self.release()
+                raise RuntimeError(f"The encoder process did not start ({self.process.exitcode})")
+
+    def write(self, image):
+        """ Copies image into a free slot and queues it for encoding. """
+        while True:
+            try:
+                slot = self.free.get(timeout=1.0)
+                break
+            except queue.Empty:
+                if not self.process.is_alive():
+                    raise RuntimeError(f"The encoder process exited ({self.process.exitcode})")
+        np.copyto(self.frames[slot], image)
+        self.filled.put(slot)
+
+    def release(self):
+        """ Waits for the queued frames to be encoded and frees the memory. """
+        if self.process.is_alive():
+            self.filled.put(None)
+        self.process.join()
+        del self.frames
+        self.memory.close()
+        self.memory.unlink()
+
+
+class RecordingPipeline:
+    """
+    Records the drone's video in three stages, each on its own thread:
+
+        capture -> resize -> encode
+
+    The capture stage runs on a deadline schedule: frame i is taken from the
+    FrameRing at start + i / fps, whatever the other stages are doing, so the
+    output plays back at real-life speed. Deadlines that pass while the
+    capture stage is late are skipped and counted as dropped. The stages are
+    connected by bounded queues; when a later stage falls behind the queue in
+    front of it drops frames according to the drop policy instead of slowing
+    down the stages before it. The encoder repeats the previous frame for
+    every frame that was dropped on the way, so the movie stays in sync.
+    By default the encoding itself happens in an EncoderProcess.
+
+        pipeline = RecordingPipeline(frame_ring(drone), duration=30).start()
+        ...
+        pipeline.stop()
+        print(pipeline.report())
+    """
+
+    def __init__(self, ring, path='drone_capture.avi', fps=30, duration=10.0, size=(360, 240),
+                 codec='mp4v', queue_size=4, drop='oldest', encoder='process', overlay=None,
+                 metrics=None):
+        """
+        Arguments
+            ring:       FrameRing with the drone's decoded video
+            path:       Movie file to write
+            fps:        Frame rate of the movie
+            duration:   Seconds to record, or None to record until stop()
+            size:       (width, height) of the movie
+            codec:      FourCC of the video codec
+            queue_size: Frames each queue holds before it starts dropping
+            drop:       'oldest', 'newest' or 'block', see DROP_POLICIES
+            encoder:    'process' to encode in an EncoderProcess, 'thread' to
+                        encode on the encoder stage's thread
+            overlay:    Something with a draw(image) method, such as a
+                        Camera.Overlay.TelemetryOverlay, that stamps every
+                        resized frame
+            metrics:    A Util.Metrics.Metrics to time each stage's work on
+                        every frame in, as frame_seconds{stage=...}
+        """
+        if encoder not in ('process', 'thread'):
+            raise ValueError(f"encoder must be 'process' or 'thread', not {encoder!r}")
+        self.ring = ring
+        self.path = path
+        self.fps = fps
+        self.duration = duration
+        self.size = tuple(size)
+        self.codec = codec
+        self.encoder = encoder
+        self.overlay = overlay
+        self.capture_stats, self.resize_stats, self.encode_stats = (
+            StageStats(stage, None if metrics is None else
+                       metrics.histogram("frame_seconds", "Work per video frame", stage=stage))
+            for stage in ('capture', 'resize', 'encode'))
+        self.resize_queue = FrameQueue(queue_size, drop, self.capture_stats)
+        self.encode_queue = FrameQueue(queue_size, drop, self.resize_stats)
+        self.repeated = 0
+        self.torn = 0
+        self.latest = None
+        self.error = None
+        self.stopping = threading.Event()
+        self.threads = []
+        self.movie = None
+
+    @property
+    def running(self):
+        return any(thread.is_alive() for thread in self.threads)
+
+    @property
+    def stats(self):
+        return [self.capture_stats, self.resize_stats, self.encode_stats]
+
+    def start(self):
+        """ Opens the movie and starts the three stages. Returns self. """
+        if self.encoder == 'process':
+            self.movie = EncoderProcess(self.path, self.codec, self.fps, self.size)
+        else:
+            self.movie = cv2.VideoWriter(self.path, cv2.VideoWriter_fourcc(*self.codec), self.fps,
+                                         self.size, True)
+        for name, target in (('capture', self.capture), ('resize', self.resize),
+                             ('encode', self.encode)):
+            thread = threading.Thread(target=target, name=f"recording-{name}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def stop(self):
+        """ Ends the recording early. The queued frames are still written. """
+        self.stopping.set()
+
+    def join(self, timeout=None):
+        """ Waits until the movie file is finished. Returns True if it is. """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in self.threads:
+            thread.join(None if deadline is None else max(deadline - time.monotonic(), 0))
+        return not self.running
+
+    def capture(self):
+        """ Capture stage: takes the newest frame from the ring at each deadline. """
+        stats = self.capture_stats
+        try:
+            frame = self.ring.wait(timeout=Tello.FRAME_GRAB_TIMEOUT)
+            if frame is None:
+                raise RuntimeError('No video frames arrived from the drone')
+            period = 1 / self.fps
+            total = None if self.duration is None else round(self.duration * self.fps)
+            stats.started = time.monotonic()
+            index = 0
+            while (total is None or index < total) and not self.stopping.is_set():
+                deadline = stats.started + index * period
+                delay = deadline - time.monotonic()
+                if delay > 0 and self.stopping.wait(delay):
+                    break
+                missed = int((time.monotonic() - deadline) / period)
+                if missed:
+                    stats.dropped += missed
+                    index += missed
+                    if total is not None and index >= total:
+                        break
+                begin = time.monotonic()
+                frame = self.ring.get() or frame
+                self.resize_queue.put((index, frame))
+                stats.record(time.monotonic() - begin)
+                index += 1
+        except Exception as excp:
+            self.error = excp
+        finally:
+            stats.finished = time.monotonic()
+            self.resize_queue.put(END_OF_STREAM)
+
+    def resize(self):
+        """ Resize stage: scales each captured frame to the movie size and stamps it. """
+        stats = self.resize_stats
+        stats.started = time.monotonic()
+        try:
+            while True:
+                item = self.resize_queue.get()
+                if item is END_OF_STREAM:
+                    break
+                begin = time.monotonic()
+                index, frame = item
+                image = cv2.resize(frame.image, self.size)
+                # The frame is a view into the ring; if the decoder reused its
+                # buffer while we were reading it the image may be torn.
+                if not self.ring.valid(frame):
+                    self.torn += 1
+                    stats.dropped += 1
+                    continue
+                if self.overlay is not None:
+                    self.overlay.draw(image)
+                self.latest = image
+                self.encode_queue.put((index, image))
+                stats.record(time.monotonic() - begin)
+        except Exception as excp:
+            self.error = excp
+            self.drain(self.resize_queue)
+        finally:
+            stats.finished = time.monotonic()
+            self.encode_queue.put(END_OF_STREAM)
+
+    def encode(self):
+        """ Encoder stage: writes frames in order, repeating one for every gap. """
+        stats = self.encode_stats
+        stats.started = time.monotonic()
+        movie = self.movie
+        try:
+            previous, written = None, 0
+            while True:
+                item = self.encode_queue.get()
+                if item is END_OF_STREAM:
+                    break
+                begin = time.monotonic()
+                index, image = item
+                if previous is not None:
+                    for _ in range(index - written):
+                        movie.write(previous)
+                        self.repeated += 1
+                movie.write(image)
+                previous, written = image, index + 1
+                stats.record(time.monotonic() - begin)
+        except Exception as excp:
+            self.error = excp
+            self.drain(self.encode_queue)
+        finally:
+            movie.release()
+            stats.finished = time.monotonic()
+
+    def drain(self, frames):
+        """ Throws away queued frames so the stage in front never blocks. """
+        self.stop()
+        while frames.get() is not END_OF_STREAM:
+            pass
+
+    def report(self):
+        """ Per-stage throughput and drop counters, one stage per line. """
+        lines = [repr(stats) for stats in self.stats]
+        lines.append(f"{self.repeated} frames repeated to fill gaps, {self.torn} torn frames")
+        return "\n".join(lines)
@@ -0,0 +1,214 @@
+import queue
+import threading
+import time
+from collections import deque, namedtuple
+
+import cv2
+
+from Camera.Recorder import StageStats
+
+
+# One ArUco marker in a frame: its id, its four corners as a 4x2 array and
+# its (x, y) center, in pixels of the full size frame.
+Marker = namedtuple("Marker", "id corners center")
+
+# The markers of one frame. seq and arrived are the frame's FrameRing sequence
+# number and arrival time, detected is when the markers were found; both
+# times are on the time.monotonic() clock.
+Detections = namedtuple("Detections", "seq arrived detected markers")
+
+
+class VisionStage:
+    """
+    Finds ArUco markers in the drone's video on background threads, so the
+    loop that shows the video and flies the drone never waits for them.
+
+    A dispatcher thread waits until a worker is idle, then takes the newest
+    frame from the FrameRing, scales it down and turns it gray once, and
+    hands it to that worker. Every worker has its own ArucoDetector and at
+    most one frame at a time; frames that arrive while they are all busy are
+    skipped instead of queued, so a result is never behind by more than the
+    detection itself.
+
+    Results go to the listeners as Detections. Workers can finish out of
+    order, so a result for an older frame than the last one published is
+    dropped. A detector or listener that raises doesn't stop its worker;
+    the exception is kept in error and shown by report().
+
+        vision = VisionStage(frame_ring(drone)).start()
+        vision.add_listener(lambda detections: print(detections.markers))
+        ...
+        vision.stop()
+        print(vision.report())
+    """
+
+    def __init__(self, ring, workers=2, scale=0.5, dictionary=cv2.aruco.DICT_4X4_50,
+                 metrics=None):
+        """
+        Arguments
+            ring:       FrameRing with the drone's decoded video
+            workers:    Number of detector threads
+            scale:      Factor the frames are scaled by before detection;
+                        markers must stay about 20 pixels wide
+            dictionary: The cv2.aruco dictionary the markers are from
+            metrics:    A Util.Metrics.Metrics to time the downscale and the
+                        detection of every frame in, as frame_seconds{stage=...},
+                        and the time from frame arrival to result in
+                        vision_latency_seconds
+        """
+        self.ring = ring
+        self.workers = workers
+        self.scale = scale
+        self.dictionary = dictionary
+        self.downscale_stats, self.detect_stats = (
+            StageStats(stage, None if metrics is None else
+                       metrics.histogram("frame_seconds", "Work per video frame", stage=stage))
+            for stage in ('downscale', 'detect'))
+        self.latency = None
+        if metrics is not None:
+            self.latency = metrics.histogram("vision_latency_seconds",
+                                             "Frame arrival to detected markers")
+        self.latencies = deque(maxlen=1000)
+        self.idle = queue.Queue()
+        self.listeners = []
+        self.latest = None
+        self.published = 0
+        self.skipped = 0
+        self.stale = 0
+        self.torn = 0
+        self.error = None
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.threads = []
+
+    def add_listener(self, listener):
+        """ Calls listener(detections) from a worker thread for every new result. """
+        self.listeners.append(listener)
+
+    @property
+    def running(self):
+        return any(thread.is_alive() for thread in self.threads)
+
+    def start(self):
+        """ Starts the dispatcher and the workers. Returns self. """
+        inboxes = [queue.Queue(maxsize=1) for _ in range(self.workers)]
+        self.threads = [threading.Thread(target=self.detect, args=(inbox,), daemon=True,
+                                         name=f"vision-detect-{number}")
+                        for number, inbox in enumerate(inboxes)]
+        self.threads.append(threading.Thread(target=self.dispatch, args=(inboxes,), daemon=True,
+                                             name="vision-dispatch"))
+        self.downscale_stats.started = self.detect_stats.started = time.monotonic()
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        """ Stops the threads and waits for them. Returns True if they all finished. """
+        self.stopping.set()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in self.threads:
+            thread.join(None if deadline is None else max(deadline - time.monotonic(), 0))
+        self.downscale_stats.finished = self.detect_stats.finished = time.monotonic()
+        return not self.running
+
+    def dispatch(self, inboxes):
+        """ Dispatcher thread: gives the newest frame to the next idle worker. """
+        stats = self.downscale_stats
+        seq = -1
+        try:
+            while not self.stopping.is_set():
+                try:
+                    inbox = self.idle.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                frame = None
+                while frame is None and not self.stopping.is_set() and not self.ring.closed:
+                    frame = self.ring.wait(seq, timeout=0.1)
+                if frame is None:
+                    break
+                if seq >= 0:
+                    self.skipped += frame.seq - seq - 1
+                seq = frame.seq
+                begin = time.monotonic()
+                small = cv2.resize(frame.image, None, fx=self.scale, fy=self.scale,
+                                   interpolation=cv2.INTER_AREA)
+                # The frame is a view into the ring; if the decoder reused its
+                # buffer while we were reading it the image may be torn.
+                if not self.ring.valid(frame):
+                    self.torn += 1
+                    stats.dropped += 1
+                    self.idle.put(inbox)
+                    continue
+                inbox.put((frame.seq, frame.timestamp, cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)))
+                stats.record(time.monotonic() - begin)
+        except Exception as excp:
+            self.error = excp
+        finally:
+            self.stopping.set()
+            for inbox in inboxes:
+                # Only this thread fills the inboxes, so once the waiting
+                # frame is thrown away there is room for the None
+                try:
+                    inbox.get_nowait()
+                except queue.Empty:
+                    pass
+                inbox.put_nowait(None)
+
+    def detect(self, inbox):
+        """ Worker thread: finds the markers in one gray frame at a time. """
+        stats = self.detect_stats
+        detector = cv2.aruco.ArucoDetector(cv2.aruco.getPredefinedDictionary(self.dictionary),
+                                           cv2.aruco.DetectorParameters())
+        self.idle.put(inbox)
+        while True:
+            item = inbox.get()
+            if item is None:
+                break
+            seq, arrived, gray = item
+            begin = time.monotonic()
+            try:
+                corners, ids, _ = detector.detectMarkers(gray)
+            except Exception as excp:
+                self.error = excp
+                corners, ids = (), None
+            markers = []
+            if ids is not None:
+                for marker_id, points in zip(ids.flatten(), corners):
+                    points = points.reshape(4, 2) / self.scale
+                    center = points.mean(axis=0)
+                    markers.append(Marker(int(marker_id), points, (float(center[0]), float(center[1]))))
+            detected = time.monotonic()
+            stats.record(detected - begin)
+            self.idle.put(inbox)
+            self.publish(Detections(seq, arrived, detected, markers))
+
+    def publish(self, detections):
+        with self.lock:
+            if self.latest is not None and detections.seq <= self.latest.seq:
+                self.stale += 1
+                return
+            self.latest = detections
+            self.published += 1
+        latency = detections.detected - detections.arrived
+        self.latencies.append(latency)
+        if self.latency is not None:
+            self.latency.observe(latency)
+        for listener in self.listeners:
+            try:
+                listener(detections)
+            except Exception as excp:
+                self.error = excp
+
+    def report(self):
+        """ Throughput, latency and skipped frames, one stage per line. """
+        latencies = sorted(self.latencies)
+        lines = [repr(self.downscale_stats), repr(self.detect_stats)]
+        if latencies:
+            lines.append(f"{self.published} results, frame arrival to result "
+                         f"p50 {latencies[len(latencies) // 2] * 1000:.1f} ms, "
+                         f"max {latencies[-1] * 1000:.1f} ms")
+        lines.append(f"{self.skipped} frames skipped while the workers were busy, "
+                     f"{self.stale} stale results, {self.torn} torn frames")
+        if self.error is not None:
+            lines.append(f"last error: {self.error!r}")
+        return "\n".join(lines)
@@ -0,0 +1,421 @@
+import math
+import multiprocessing
+import queue
+import threading
+import time
+from collections import deque, namedtuple
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+from Camera.Recorder import StageStats
+
+
+# Width in pixels the frames are scaled to before the flow, unless a scale
+# is given. Enough features for the flow, little enough CPU for 30 FPS.
+FLOW_WIDTH = 240
+
+# Horizontal field of view of the Tello's downward camera in degrees, used
+# for the focal length when none is given. It is an estimate; pass focal=
+# from a calibration of your drone for accurate distances.
+DOWNWARD_FOV = 60.0
+
+# One visual odometry update. seq and timestamp are the frame's FrameRing
+# sequence number and arrival time, (x, y) the integrated position in cm in
+# the HeadsUpTello frame and tracked the number of features the flow
+# followed into this frame.
+OdometryFix = namedtuple("OdometryFix", "seq timestamp x y tracked")
+
+
+def track_flow(memory_name, shape, filled, free, results, ready, max_points, min_points):
+    """
+    Runs in the odometry process: for every slot number that arrives on
+    filled, follows the features of the previous frame into this one with
+    pyramidal Lucas-Kanade and puts (seq, du, dv, tracked, seconds) on
+    results, the median feature motion in pixels. The slot goes back on
+    free as soon as the frame is copied out. A frame marked as a restart,
+    e.g. the first from the other camera, is not compared with the one
+    before it. None ends the process.
+    """
+    # One core is all the process gets; OpenCV's own threads would fight
+    # the drone's threads for it
+    cv2.setNumThreads(1)
+    memory = shared_memory.SharedMemory(name=memory_name)
+    try:
+        frames = np.ndarray((len(memory.buf) // math.prod(shape),) + shape, dtype=np.uint8,
+                            buffer=memory.buf)
+        previous, points = None, None
+        ready.set()
+        while True:
+            item = filled.get()
+            if item is None:
+                break
+            slot, seq, restart = item
+            gray = frames[slot].copy()
+            free.put(slot)
+            if restart:
+                previous, points = None, None
+            begin = time.perf_counter()
+            du = dv = 0.0
+            tracked = 0
+            if previous is not None:
+                if points is None or len(points) < min_points:
+                    points = cv2.goodFeaturesToTrack(previous, max_points, 0.01, 7)
+                if points is not None:
+                    moved, status, _ = cv2.calcOpticalFlowPyrLK(previous, gray, points, None,
+                                                                winSize=(15, 15), maxLevel=2)
+                    good = status.ravel() == 1
+                    tracked = int(good.sum())
+                    if tracked:
+                        flow = (moved[good] - points[good]).reshape(-1, 2)
+                        du, dv = (float(value) for value in np.median(flow, axis=0))
+                    # Keep following the features that are still in view
+                    inside = good & np.all((moved.reshape(-1, 2) >= 0) &
+                                           (moved.reshape(-1, 2) < (shape[1], shape[0])), axis=1)
+                    points = moved[inside].reshape(-1, 1, 2)
+            previous = gray
+            results.put((seq, du, dv, tracked, time.perf_counter() - begin))
+        del frames
+    finally:
+        memory.close()
+
+
+# ------------------------ BEGIN VisualOdometry CLASS ---------------------------
+
+class VisualOdometry:
+    """
+    Measures how far the drone moved from the video of a downward looking
+    camera. Sparse optical flow runs in a process of its own, so it doesn't
+    compete for the GIL with the command and telemetry threads; frames reach
+    it scaled down and gray through a few slots of shared memory, and only
+    slot numbers and the results are pickled.
+
+    The median feature motion in pixels becomes cm with the ToF height from
+    the state stream: a pixel covers tof / focal cm of floor. The motion is
+    turned from the body frame into the HeadsUpTello frame with the heading
+    and added up into a position, starting at start. When a frame arrives
+    while every slot is waiting, the feeder skips it; the flow is then
+    measured across the gap.
+
+    The video must come from the downward camera, see
+    HeadsUpTello.start_visual_odometry(); the forward camera's flow doesn't
+    measure the drone's motion over the floor. The image's up is the
+    drone's forward and its right the drone's right, the way Sim.tello_sim
+    draws the floor.
+
+    A turn swings the floor around the image center, which the median flow
+    would take for a sideways move. While the heading changes, and for
+    turn_settle seconds after, the flow is not added up; the drone hovers
+    in place while it turns, so little is lost. The frames of a turn before
+    the state stream shows the new yaw, about a tenth of a second, are still
+    counted.
+
+    A listener, a state packet or a frame that raises doesn't stop the
+    odometry; the exception is kept in error and shown by report(). If the
+    odometry process dies, error says so and no more fixes come.
+
+    The odometry process is started with 'spawn', like the recording
+    EncoderProcess: scripts that use it must keep their top level code
+    under if __name__ == '__main__'.
+
+        odometry = VisualOdometry(frame_ring(drone), drone.telemetry).start()
+        ...
+        print(odometry.fix(), odometry.report())
+        odometry.stop()
+    """
+
+    def __init__(self, ring, telemetry, start=(0.0, 0.0), heading=None, scale=None, focal=None,
+                 fov=DOWNWARD_FOV, slots=3, max_points=80, min_points=12, turn_threshold=3.0,
+                 turn_settle=0.3, metrics=None, timeout=10.0):
+        """
+        Arguments
+            ring:       FrameRing with the drone's decoded video
+            telemetry:  The drone's Util.Telemetry, for the ToF height
+            start:      (x, y) in cm where the drone is now
+            heading:    Function of a state dict that returns the heading in
+                        degrees in the HeadsUpTello frame; the raw yaw if None
+            scale:      Factor the first frame is scaled by before the
+                        flow, or None to scale it to FLOW_WIDTH pixels wide;
+                        later frames are scaled to the same size
+            focal:      Focal length of the camera in pixels of the video
+                        frames, or None to work it out from fov
+            fov:        Horizontal field of view of the camera in degrees
+            slots:      Frames of shared memory
+            max_points: Features to follow
+            min_points: Fewer tracked features than this look for new ones,
+                        and a frame with fewer is not trusted
+            turn_threshold: Degrees the heading has to change to count as
+                        a turn; smaller wobbles of the yaw are ignored
+            turn_settle: Seconds after a turn before the flow is added up
+                        again
+            metrics:    A Util.Metrics.Metrics to time the downscale and the
+                        flow of every frame in, as frame_seconds{stage=...}
+            timeout:    Seconds to wait for the odometry process to start
+        """
+        self.ring = ring
+        self.telemetry = telemetry
+        self.heading = heading or (lambda state: state['yaw'])
+        self.scale = scale
+        self.focal = focal
+        self.fov = fov
+        self.slots = slots
+        self.max_points = max_points
+        self.min_points = min_points
+        self.turn_threshold = turn_threshold
+        self.turn_settle = turn_settle
+        self.timeout = timeout
+        self.x, self.y = (float(value) for value in start)
+        self.latest = None
+        self.lost = 0
+        self.skipped = 0
+        self.turning = 0
+        self.error = None
+        self.died = False
+        self.turn_heading = None
+        self.turned = -math.inf
+        self.listeners = []
+        self.latencies = deque(maxlen=1000)
+        self.downscale_stats, self.flow_stats = (
+            StageStats(stage, None if metrics is None else
+                       metrics.histogram("frame_seconds", "Work per video frame", stage=stage))
+            for stage in ('downscale', 'flow'))
+        self.lock = threading.Lock()
+        self.updated = threading.Condition()
+        self.arrivals = {}
+        self.stopping = threading.Event()
+        self.threads = []
+        self.process = None
+        self.memory = None
+
+    def add_listener(self, listener):
+        """ Calls listener(fix) with every OdometryFix, from the odometry thread. """
+        self.listeners.append(listener)
+
+    def start(self, since=None):
+        """
+        Starts the odometry process and the threads that talk to it. Frames
+        that arrived before the time.monotonic() time since, e.g. from before
+        a camera switch, are left out. Returns self.
+        """
+        self.since = -math.inf if since is None else since
+        deadline = time.monotonic() + self.timeout
+        frame = self.ring.wait(timeout=self.timeout)
+        while frame is not None and frame.timestamp <= self.since:
+            frame = self.ring.wait(frame.seq, timeout=max(deadline - time.monotonic(), 0))
+        if frame is None:
+            raise RuntimeError('No video frames arrived from the drone')
+        height, width = frame.image.shape[:2]
+        if self.scale is None:
+            self.scale = min(FLOW_WIDTH / width, 1.0)
+        self.shape = (round(height * self.scale), round(width * self.scale))
+        self.memory = shared_memory.SharedMemory(create=True,
+                                                 size=self.slots * math.prod(self.shape))
+        self.frames = np.ndarray((self.slots,) + self.shape, dtype=np.uint8, buffer=self.memory.buf)
+        context = multiprocessing.get_context('spawn')
+        self.filled = context.Queue()
+        self.free = context.Queue()
+        self.results = context.Queue()
+        for slot in range(self.slots):
+            self.free.put(slot)
+        ready = context.Event()
+        self.process = context.Process(target=track_flow, name="visual-odometry", daemon=True,
+                                       args=(self.memory.name, self.shape, self.filled, self.free,
+                                             self.results, ready, self.max_points,
+                                             self.min_points))
+        self.process.start()
+        deadline = time.monotonic() + self.timeout
+        while not ready.wait(0.1):
+            if not self.process.is_alive() or time.monotonic() > deadline:
+                self.process.kill()
+                self.release()
+                raise RuntimeError(f"The odometry process did not start ({self.process.exitcode})")
+        self.downscale_stats.started = self.flow_stats.started = time.monotonic()
+        for name, target in (('feed', self.feed), ('fuse', self.fuse)):
+            thread = threading.Thread(target=target, name=f"odometry-{name}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def stop(self):
+        """ Stops the threads and the process and frees the shared memory. """
+        self.stopping.set()
+        for thread in self.threads:
+            thread.join()
+        self.downscale_stats.finished = self.flow_stats.finished = time.monotonic()
+        self.release()
+
+    def release(self):
+        if self.process is not None and self.process.is_alive():
+            self.filled.put(None)
+            self.process.join(self.timeout)
+        if self.memory is not None:
+            del self.frames
+            self.memory.close()
+            self.memory.unlink()
+            self.memory = None
+
+    def process_alive(self):
+        """ False, with error set, once the odometry process has died. """
+        if self.process.is_alive():
+            return True
+        if not self.stopping.is_set() and not self.died:
+            self.died = True
+            self.error = RuntimeError(f"The odometry process exited ({self.process.exitcode})")
+        return False
+
+    def feed(self):
+        """ Feeder thread: scales the newest frame into a free slot. """
+        stats = self.downscale_stats
+        seq = -1
+        size = (self.shape[1], self.shape[0])
+        source = None
+        while not self.stopping.is_set() and self.process_alive():
+            frame = self.ring.wait(seq, timeout=0.1)
+            if frame is None:
+                if self.ring.closed:
+                    break
+                continue
+            if seq >= 0:
+                self.skipped += frame.seq - seq - 1
+            seq = frame.seq
+            if frame.timestamp <= self.since:
+                continue
+            try:
+                slot = self.free.get_nowait()
+            except queue.Empty:
+                self.skipped += 1
+                continue
+            begin = time.monotonic()
+            try:
+                small = cv2.resize(frame.image, size, interpolation=cv2.INTER_AREA)
+                if small.ndim == 2:
+                    self.frames[slot] = small
+                else:
+                    cv2.cvtColor(small, cv2.COLOR_BGR2GRAY, dst=self.frames[slot])
+            except Exception as excp:
+                self.error = excp
+                self.free.put(slot)
+                continue
+            # The frame is a view into the ring; if the decoder reused its
+            # buffer while we were reading it the image may be torn.
+            if not self.ring.valid(frame):
+                stats.dropped += 1
+                self.free.put(slot)
+                continue
+            # A new frame size means the stream switched cameras
+            restart = source is not None and frame.image.shape[:2] != source
+            source = frame.image.shape[:2]
+            with self.lock:
+                self.arrivals[seq] = (frame.timestamp, source[1])
+            self.filled.put((slot, seq, restart))
+            stats.record(time.monotonic() - begin)
+
+    def flow_focal(self, width):
+        """ Focal length in pixels of the scaled frames, for video frames width pixels wide. """
+        if self.focal is not None:
+            return self.focal * self.shape[1] / width
+        return self.shape[1] / 2 / math.tan(math.radians(self.fov) / 2)
+
+    def turning_at(self, heading, now):
+        """ True while the heading changes, and for turn_settle seconds after. """
+        if self.turn_heading is None:
+            self.turn_heading = heading
+        elif abs((heading - self.turn_heading + 180) % 360 - 180) >= self.turn_threshold:
+            self.turn_heading = heading
+            self.turned = now
+        return now - self.turned < self.turn_settle
+
+    def fuse(self):
+        """ Odometry thread: turns the pixel flow into cm and adds it up. """
+        while not self.stopping.is_set():
+            try:
+                seq, du, dv, tracked, seconds = self.results.get(timeout=0.1)
+            except queue.Empty:
+                if not self.process_alive():
+                    break
+                continue
+            try:
+                self.add_flow(seq, du, dv, tracked, seconds)
+            except Exception as excp:
+                self.error = excp
+
+    def add_flow(self, seq, du, dv, tracked, seconds):
+        """ Adds one frame's flow to the position and publishes the fix. """
+        self.flow_stats.record(seconds)
+        with self.lock:
+            arrived, width = self.arrivals.pop(seq, (time.monotonic(), self.shape[1]))
+        state, _ = self.telemetry.snapshot()
+        heading = self.heading(state)
+        turning = self.turning_at(heading, arrived)
+        forward = left = 0.0
+        if tracked < self.min_points:
+            if self.latest is not None:
+                self.lost += 1
+        elif turning:
+            self.turning += 1
+        else:
+            # Features move down the image as the drone flies forward
+            cm = state['tof'] / self.flow_focal(width)
+            forward, left = dv * cm, du * cm
+        theta = math.radians(heading)
+        with self.lock:
+            self.x += forward * math.cos(theta) + left * math.sin(theta)
+            self.y += -forward * math.sin(theta) + left * math.cos(theta)
+            fix = OdometryFix(seq, arrived, self.x, self.y, tracked)
+        with self.updated:
+            self.latest = fix
+            self.updated.notify_all()
+        self.latencies.append(time.monotonic() - arrived)
+        for listener in self.listeners:
+            try:
+                listener(fix)
+            except Exception as excp:
+                self.error = excp
+
+    def fix(self, max_age=0.5):
+        """
+        Returns the newest OdometryFix if its frame is at most max_age
+        seconds old and the flow was tracking, else None.
+        """
+        fix = self.latest
+        if fix is None or time.monotonic() - fix.timestamp > max_age:
+            return None
+        if fix.tracked < self.min_points:
+            return None
+        return fix
+
+    def wait(self, after, timeout=0.5):
+        """
+        Waits for the fix of a frame that arrived after the time.monotonic()
+        time after, so it shows where the drone is now rather than where it
+        was while the last command was flying. Returns it, or None on
+        timeout or when the flow isn't tracking.
+        """
+        with self.updated:
+            self.updated.wait_for(lambda: self.latest is not None and self.latest.timestamp > after,
+                                  timeout)
+        fix = self.latest
+        if fix is None or fix.timestamp <= after or fix.tracked < self.min_points:
+            return None
+        return fix
+
+    def set_position(self, x, y):
+        """ Moves the integrated position, e.g. after a better fix from elsewhere. """
+        with self.lock:
+            self.x, self.y = float(x), float(y)
+
+    def report(self):
+        """ Throughput, latency and lost frames, one stage per line. """
+        latencies = sorted(self.latencies)
+        lines = [repr(self.downscale_stats), repr(self.flow_stats)]
+        if latencies:
+            lines.append(f"frame arrival to fix p50 {latencies[len(latencies) // 2] * 1000:.1f} ms, "
+                         f"max {latencies[-1] * 1000:.1f} ms")
+        lines.append(f"{self.skipped} frames skipped, {self.lost} with too few features, "
+                     f"{self.turning} while turning")
+        if self.error is not None:
+            lines.append(f"last error: {self.error!r}")
+        return "\n".join(lines)
+
+# ------------------------ END OF VisualOdometry CLASS --------------------------
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+Replays a recorded flight (see Util.FlightRecorder) against a simulated drone
+that gives the recorded answers, after the recorded latencies, and streams
+the recorded state packets. Then compares the replay with the recording, or
+two recordings with each other: command counts, flight time and latency.
+
+Without --mission the recorded commands are sent again at their recorded
+times. With --mission a function that takes a HeadsUpTello object flies
+instead, so a mission from two versions of the code can be compared on the
+same drone behaviour.
+
+    % python3 -m Sim.replay flights/square
+    % python3 -m Sim.replay flights/square --speed 10
+    % python3 -m Sim.replay flights/square --mission Bench.command_latency:mission_square
+    % python3 -m Sim.replay flights/square --compare flights/square_v2
+"""
+
+import argparse
+import difflib
+import importlib
+import logging
+import math
+import tempfile
+import time
+from collections import Counter, defaultdict, deque
+
+from djitellopy import Tello
+
+from Bench.common import percentile, print_table
+from Sim.tello_sim import SIM_HOST, TelloSimulator, loopback_tello
+from Src.headsupflight import HeadsUpTello
+from Util.FlightRecorder import load_flight
+from Util.Telemetry import FIELDS
+
+
+# ------------------------- BEGIN ReplaySimulator CLASS -------------------------
+
+class ReplaySimulator(TelloSimulator):
+    """
+    A TelloSimulator that plays back a recorded flight. Each command gets
+    the answer the drone gave to the same command text in the recording,
+    in recorded order, after the recorded latency. Every command also goes
+    to the normal simulator, whose answer is used when the recording has
+    none; leave time_scale at 0 so it doesn't add flight time.
+
+    The recorded state packets are streamed on the recorded schedule,
+    starting when the 'command' handshake arrives, and the last one repeats
+    after the recording ends. speed > 1 plays faster than real time; the
+    schedule and the latencies are divided by it.
+
+    The recorded latencies were measured by djitellopy, which polls for an
+    answer every 100 ms, so they include up to one poll period. The
+    simulator answers poll seconds earlier than recorded, plus margin, so
+    the client sees the recorded latency again.
+    """
+
+    def __init__(self, flight, speed=1.0, poll=0.1, margin=0.02, **options):
+        """
+        Arguments
+            flight:  Util.FlightRecorder.Flight to play back
+            speed:   How many times faster than real time to play
+            poll:    The client's polling period included in the latencies
+            margin:  Seconds short of a whole poll to answer
+            options: TelloSimulator arguments
+        """
+        super().__init__(**options)
+        self.flight = flight
+        # TelloSimulator.speed is the drone's cm/s
+        self.replay_speed = speed
+        self.poll = poll
+        self.margin = margin
+        self.answers = defaultdict(deque)
+        commands = flight.commands
+        for command, response, latency in zip(commands['command'], commands['response'],
+                                              commands['latency']):
+            self.answers[command.decode()].append((response.decode(), float(latency)))
+        self.origin = float(commands['sent'][0]) if len(commands['sent']) else 0.0
+        self.clock_start = None
+        self.replayed = 0
+        self.simulated = 0
+
+    def respond(self, command):
+        """ Returns the recorded answer, once its latency has passed. """
+        if self.clock_start is None:
+            self.clock_start = time.monotonic()
+        text = command.strip()
+        if text == "command":
+            self.sdk_mode = True
+        # The simulator keeps flying along, so a command that isn't in the
+        # recording finds the drone in the air after a replayed takeoff
+        simulated = super().respond(command)
+        answers = self.answers.get(text)
+        if not answers:
+            self.simulated += 1
+            return simulated
+        response, latency = answers.popleft()
+        self.replayed += 1
+        self.stopped.wait(max(latency / self.replay_speed - self.poll + self.margin, 0))
+        return response
+
+    def recorded_packet(self, row):
+        """ Formats one recorded state row the way the drone does. """
+        fields = []
+        for name in FIELDS:
+            value = row[name]
+            if math.isnan(value):
+                continue
+            if name in Tello.FLOAT_STATE_FIELDS:
+                fields.append(f"{name}:{value:.2f}")
+            else:
+                fields.append(f"{name}:{int(round(value))}")
+        return "mid:-1;x:-100;y:-100;z:-100;mpry:0,0,0;" + ";".join(fields) + ";\r\n"
+
+    def state_loop(self):
+        """ Streams the recorded state packets on the recorded schedule. """
+        state = self.flight.state
+        rows = [dict(zip(FIELDS, values)) for values in zip(*(state[name] for name in FIELDS))]
+        due = (state['t'] - self.origin) / self.replay_speed
+        index = 0
+        period = 1 / self.state_rate
+        while not self.stopped.is_set():
+            if not self.sdk_mode or self.client is None or self.clock_start is None:
+                self.stopped.wait(0.01)
+                continue
+            elapsed = time.monotonic() - self.clock_start
+            if index < len(rows) and due[index] > elapsed:
+                self.stopped.wait(due[index] - elapsed)
+                continue
+            # Skip packets that were due while nobody listened
+            while index + 1 < len(rows) and due[index + 1] <= elapsed:
+                index += 1
+            if rows:
+                packet = self.recorded_packet(rows[index]).encode("ascii")
+                try:
+                    self.socket.sendto(packet, (self.client[0], self.state_port))
+                except OSError:
+                    break
+            if index + 1 < len(rows):
+                index += 1
+            else:
+                self.stopped.wait(period)
+
+# ------------------------- END OF ReplaySimulator CLASS -------------------------
+
+
+def resend(drone, flight, skip, speed=1.0):
+    """
+    Sends the recorded commands after the first skip ones again, each at
+    its recorded time from the first one, divided by speed.
+    """
+    commands = flight.commands
+    if len(commands['command']) <= skip:
+        return
+    origin = commands['sent'][skip]
+    start = time.monotonic()
+    for command, sent in zip(commands['command'][skip:], commands['sent'][skip:]):
+        time.sleep(max(start + (sent - origin) / speed - time.monotonic(), 0))
+        drone.drone.send_command_with_return(command.decode())
+
+
+def replay(flight, out, mission=None, speed=1.0, host=SIM_HOST):
+    """
+    Replays a flight against a ReplaySimulator through a new HeadsUpTello
+    object that records to the directory out. mission(drone) flies, or the
+    recorded commands are sent again when it is None. Returns the replayed
+    flight, loaded from out.
+    """
+    meta = flight.meta
+    with ReplaySimulator(flight, speed, host=host):
+        Tello.LOGGER.setLevel(logging.WARNING)
+        drone = HeadsUpTello(loopback_tello(host), meta.get('minBat', 0), meta.get('mission'),
+                             debug_level=logging.WARNING, flight_record=out)
+        try:
+            if mission is None:
+                # The constructor already sent the handshake again
+                resend(drone, flight, drone.channel.sent, speed)
+            else:
+                mission(drone)
+        finally:
+            drone.disconnect()
+    return load_flight(out)
+
+
+def summary(flight):
+    """ Returns a dict of the numbers compare() reports for one flight. """
+    commands = flight.commands
+    sent, latency = commands['sent'], commands['latency']
+    duration = float(sent[-1] + latency[-1] - sent[0]) if len(sent) else 0.0
+    return {
+        "commands": len(sent),
+        "duration s": duration,
+        "latency s": float(latency.sum()),
+        "p50 ms": percentile(latency.tolist(), 50) * 1000,
+        "p99 ms": percentile(latency.tolist(), 99) * 1000,
+        "state packets": len(flight.state['t']),
+    }
+
+
+def compare(a, b):
+    """
+    Compares two flights. Returns (rows, changes): rows of [name, a, b, b - a]
+    for the totals and the count of every command word, and the commands that
+    were added, removed or replaced, as difflib opcodes with their text.
+    """
+    rows = []
+    first, second = summary(a), summary(b)
+    for name in first:
+        rows.append([name, first[name], second[name], second[name] - first[name]])
+    words_a = Counter(command.split()[0] for command in a.commands['command'].astype(str))
+    words_b = Counter(command.split()[0] for command in b.commands['command'].astype(str))
+    for word in sorted(words_a.keys() | words_b.keys()):
+        rows.append([f"  {word}", words_a[word], words_b[word], words_b[word] - words_a[word]])
+
+    commands_a = a.commands['command'].astype(str).tolist()
+    commands_b = b.commands['command'].astype(str).tolist()
+    matcher = difflib.SequenceMatcher(a=commands_a, b=commands_b, autojunk=False)
+    changes = [(tag, commands_a[i1:i2], commands_b[j1:j2])
+               for tag, i1, i2, j1, j2 in matcher.get_opcodes() if tag != 'equal']
+
+    # How far the matching commands drifted apart in time
+    drift = []
+    for i, j, size in matcher.get_matching_blocks():
+        for k in range(size):
+            offset_a = a.commands['sent'][i + k] - a.commands['sent'][0]
+            offset_b = b.commands['sent'][j + k] - b.commands['sent'][0]
+            drift.append(abs(float(offset_b - offset_a)))
+    rows.append(["drift p50 ms", "", f"{percentile(drift, 50) * 1000:.1f}", ""])
+    rows.append(["drift max ms", "", f"{percentile(drift, 100) * 1000:.1f}", ""])
+    return rows, changes
+
+
+def print_comparison(rows, changes, names=("recorded", "replayed")):
+    cells = [[name] + [f"{value:.3f}" if isinstance(value, float) else value for value in values]
+             for name, *values in rows]
+    print_table(["", names[0], names[1], "difference"], cells)
+    for tag, removed, added in changes:
+        print(f"{tag}: {removed} -> {added}")
+
+
+def load_mission(name):
+    """ Imports 'module:function'. """
+    module, function = name.split(":")
+    return getattr(importlib.import_module(module), function)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("flight", help="directory of a recorded flight")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="times faster than real time to replay")
+    parser.add_argument("--mission", help="module:function to fly instead of the recorded commands")
+    parser.add_argument("--out", help="directory to record the replay to")
+    parser.add_argument("--compare", help="compare with this recorded flight instead of replaying")
+    args = parser.parse_args()
+
+    recorded = load_flight(args.flight)
+    if args.compare:
+        rows, changes = compare(recorded, load_flight(args.compare))
+        print_comparison(rows, changes, (args.flight, args.compare))
+        return
+    out = args.out or tempfile.mkdtemp(prefix="replay_")
+    mission = load_mission(args.mission) if args.mission else None
+    replayed = replay(recorded, out, mission, args.speed)
+    rows, changes = compare(recorded, replayed)
+    if args.speed != 1:
+        print(f"Replayed {args.speed:g} times faster than real time; times are not scaled back.")
+    print_comparison(rows, changes)
+    print(f"Replay recorded to {out}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,513 @@
+import math
+import random
+import socket
+import threading
+import time
+from collections import namedtuple
+
+from djitellopy import Tello
+from djitellopy import tello as tello_module
+
+
+# Address the simulator answers on by default. The djitellopy client binds its
+# own command socket to 0.0.0.0:8889, so a simulator on the same computer can't
+# share 127.0.0.1:8889 with it. Any other loopback address works on Linux and
+# keeps the drone's real port numbers. See loopback_tello() below.
+SIM_HOST = "127.0.0.2"
+
+# One entry per SDK command the simulator answered.
+SimCommand = namedtuple("SimCommand", "command response received replied")
+
+# A straight-line motion between two poses (x, y, z, yaw) that started at t0.
+Motion = namedtuple("Motion", "start end t0 duration")
+
+
+# ------------------------- BEGIN TelloSimulator CLASS --------------------------
+
+class TelloSimulator():
+    """
+    A local stand-in for a RoboMaster TT drone that speaks the Tello SDK over
+    UDP. It listens for commands on the command port, streams state packets to
+    the client's state port (8890) and, if asked to, streams synthetic H.264
+    video to the client's video port (11111).
+
+    Positions use the takeoff frame: x is forward, y is left and z is up, all in
+    cm. Yaw is in degrees and grows clockwise, like the real drone reports it.
+    """
+
+    def __init__(self, host=SIM_HOST, port=Tello.CONTROL_UDP_PORT,
+                 state_port=Tello.STATE_UDP_PORT, video_port=Tello.VS_UDP_PORT,
+                 time_scale=0.0, latency=0.0, state_rate=10, speed=100,
+                 yaw_rate=90, settle=0.5, baro=120.0, battery=100, video=False,
+                 video_size=(960, 720), video_fps=30, loss=0.0, seed=None):
+        """
+        Arguments
+            host:       Address to answer commands on
+            port:       Command port, 8889 on the real drone
+            state_port: Client port that receives state packets
+            video_port: Client port that receives the video stream
+            time_scale: 1.0 flies in real time, 0.0 answers motions instantly
+            latency:    One-way link delay in seconds added to every command
+            state_rate: State packets per second
+            speed:      Horizontal speed in cm/s (changed with 'speed x')
+            yaw_rate:   Rotation rate in degrees per second
+            settle:     Hover time in seconds after each motion completes
+            baro:       Barometer reading on the ground in meters
+            battery:    Starting battery percentage
+            video:      Stream synthetic H.264 video after 'streamon'
+            loss:       Chance that a command, or its answer, is lost on
+                        the way; state packets always arrive
+            seed:       Seed for the losses, to lose the same ones again
+        """
+        self.address = (host, port)
+        self.state_port = state_port
+        self.video_port = video_port
+        self.time_scale = time_scale
+        self.latency = latency
+        self.state_rate = state_rate
+        self.speed = speed
+        self.yaw_rate = yaw_rate
+        self.settle = settle
+        self.ground_baro = baro
+        self.battery = battery
+        self.video = video
+        self.video_size = video_size
+        self.video_fps = video_fps
+        self.loss = loss
+        self.random = random.Random(seed)
+        self.lost = 0
+
+        self.client = None
+        self.sdk_mode = False
+        self.stream_on = False
+        self.downward = False
+        self.flying = False
+        self.motors_on = False
+        self.commands = []
+        self.pose = (0.0, 0.0, 0.0, 0.0)
+        self.motion = None
+        self.flight_time = 0.0
+        self.lock = threading.Lock()
+
+        self.handlers = {
+            "command": self.on_command,
+            "motoron": self.on_motoron,
+            "motoroff": self.on_motoroff,
+            "keepalive": self.on_ok,
+            "takeoff": self.on_takeoff,
+            "land": self.on_land,
+            "emergency": self.on_land,
+            "streamon": self.on_streamon,
+            "streamoff": self.on_streamoff,
+            "downvision": self.on_downvision,
+            "up": self.on_move,
+            "down": self.on_move,
+            "left": self.on_move,
+            "right": self.on_move,
+            "forward": self.on_move,
+            "back": self.on_move,
+            "cw": self.on_rotate,
+            "ccw": self.on_rotate,
+            "go": self.on_go,
+            "curve": self.on_curve,
+            "speed": self.on_speed,
+            "port": self.on_port,
+            "EXT": self.on_ext,
+        }
+        self.queries = {
+            "battery?": lambda: f"{int(self.get_battery())}",
+            "baro?": lambda: f"{int(self.get_baro())}",
+            "height?": lambda: f"{int(self.get_pose()[2] / 10)}dm",
+            "tof?": lambda: f"{int(self.get_tof() * 10)}mm",
+            "temp?": lambda: "62~65C",
+            "speed?": lambda: f"{self.speed}",
+            "time?": lambda: f"{int(self.get_flight_time())}s",
+            "attitude?": lambda: f"pitch:0;roll:0;yaw:{int(self.get_yaw())};",
+            "wifi?": lambda: "90",
+            "sdk?": lambda: "30",
+            "sn?": lambda: "0TQZSIMULATOR",
+        }
+
+        self.stopped = threading.Event()
+        self.socket = None
+        self.threads = []
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        """ Binds the command socket and starts the simulator threads. """
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(self.address)
+        self.socket.settimeout(0.1)
+        self.stopped.clear()
+        self.threads = [threading.Thread(target=self.command_loop, daemon=True),
+                        threading.Thread(target=self.state_loop, daemon=True)]
+        if self.video:
+            self.threads.append(threading.Thread(target=self.video_loop, daemon=True))
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        """ Stops the simulator threads and closes the command socket. """
+        self.stopped.set()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
+
+    def reset_flight(self):
+        """ Puts the drone back on the ground at the origin. """
+        self.stopped.clear()
+        self.flying = False
+        self.motion = None
+        self.pose = (0.0, 0.0, 0.0, 0.0)
+        self.flight_time = 0.0
+
+    def reset_log(self):
+        """ Forgets every recorded command, returning the old log. """
+        with self.lock:
+            commands, self.commands = self.commands, []
+        return commands
+
+    # ------------------------------ Physics --------------------------------
+
+    def get_pose(self, now=None):
+        """ Returns the current (x, y, z, yaw), interpolating any motion. """
+        motion = self.motion
+        if motion is None:
+            return self.pose
+        now = time.monotonic() if now is None else now
+        if motion.duration <= 0:
+            return motion.end
+        fraction = min(max((now - motion.t0) / motion.duration, 0.0), 1.0)
+        return tuple(a + (b - a) * fraction for a, b in zip(motion.start, motion.end))
+
+    def get_velocity(self, now=None):
+        """ Returns the current (vx, vy, vz) in cm/s in the takeoff frame. """
+        motion = self.motion
+        now = time.monotonic() if now is None else now
+        if motion is None or motion.duration <= 0 or not motion.t0 <= now < motion.t0 + motion.duration:
+            return 0.0, 0.0, 0.0
+        return tuple((b - a) / motion.duration for a, b in zip(motion.start[:3], motion.end[:3]))
+
+    def get_yaw(self):
+        """ Returns the yaw wrapped to -180..180 like the drone reports it. """
+        return (self.get_pose()[3] + 180) % 360 - 180
+
+    def get_baro(self):
+        """ Returns the barometer reading in meters. """
+        return self.ground_baro + self.get_pose()[2] / 100
+
+    def get_tof(self):
+        """ Returns the downward time-of-flight distance in cm. """
+        return self.get_pose()[2] + 10
+
+    def get_flight_time(self):
+        """ Returns the seconds of drone time spent flying maneuvers. """
+        return self.flight_time
+
+    def get_battery(self):
+        """ Drains roughly one percent for every 15 seconds of flight. """
+        return max(self.battery - self.get_flight_time() / 15, 0)
+
+    def fly(self, end, duration):
+        """
+        Flies from the current pose to the end pose over duration seconds of
+        drone time. Blocks for the scaled time, like the drone does before it
+        answers 'ok'.
+        """
+        start = self.get_pose()
+        self.flight_time += duration + self.settle
+        scaled = duration * self.time_scale
+        self.motion = Motion(start, end, time.monotonic(), scaled)
+        if scaled > 0:
+            self.stopped.wait(scaled + self.settle * self.time_scale)
+        self.pose = end
+        self.motion = None
+
+    def offset(self, forward, left, up):
+        """ Converts a body-frame offset to a takeoff-frame end pose. """
+        x, y, z, yaw = self.pose
+        heading = math.radians(yaw)
+        dx = forward * math.cos(heading) + left * math.sin(heading)
+        dy = -forward * math.sin(heading) + left * math.cos(heading)
+        return x + dx, y + dy, z + up, yaw
+
+    # --------------------------- Command handlers ---------------------------
+
+    def on_ok(self, args):
+        return "ok"
+
+    def on_command(self, args):
+        self.sdk_mode = True
+        return "ok"
+
+    def on_motoron(self, args):
+        self.motors_on = True
+        return "ok"
+
+    def on_motoroff(self, args):
+        self.motors_on = False
+        return "ok"
+
+    def on_takeoff(self, args):
+        if self.flying:
+            return "error"
+        self.flying = True
+        x, y, z, yaw = self.pose
+        self.fly((x, y, 80.0, yaw), 80 / 50)
+        return "ok"
+
+    def on_land(self, args):
+        if not self.flying:
+            return "error"
+        x, y, z, yaw = self.pose
+        self.fly((x, y, 0.0, yaw), z / 50)
+        self.flying = False
+        return "ok"
+
+    def on_streamon(self, args):
+        self.stream_on = True
+        return "ok"
+
+    def on_streamoff(self, args):
+        self.stream_on = False
+        return "ok"
+
+    def on_downvision(self, args):
+        if len(args) != 2 or args[1] not in ("0", "1"):
+            return "error"
+        self.downward = args[1] == "1"
+        return "ok"
+
+    def on_move(self, args):
+        direction, distance = args[0], parse_number(args[1])
+        if not self.flying or distance is None or not 20 <= distance <= 500:
+            return "error"
+        offsets = {"forward": (distance, 0, 0), "back": (-distance, 0, 0),
+                   "left": (0, distance, 0), "right": (0, -distance, 0),
+                   "up": (0, 0, distance), "down": (0, 0, -distance)}
+        self.fly(self.offset(*offsets[direction]), distance / self.speed)
+        return "ok"
+
+    def on_rotate(self, args):
+        degrees = parse_number(args[1])
+        if not self.flying or degrees is None or not 1 <= degrees <= 3600:
+            return "error"
+        sign = 1 if args[0] == "cw" else -1
+        x, y, z, yaw = self.pose
+        self.fly((x, y, z, yaw + sign * degrees), degrees / self.yaw_rate)
+        return "ok"
+
+    def on_go(self, args):
+        values = [parse_number(value) for value in args[1:5]]
+        if not self.flying or len(values) != 4 or None in values:
+            return "error"
+        x, y, z, speed = values
+        if not all(-500 <= v <= 500 for v in (x, y, z)) or not 10 <= speed <= 100:
+            return "error"
+        if all(-20 < v < 20 for v in (x, y, z)):
+            return "error"
+        self.fly(self.offset(x, y, z), math.dist((0, 0, 0), (x, y, z)) / speed)
+        return "ok"
+
+    def on_curve(self, args):
+        values = [parse_number(value) for value in args[1:8]]
+        if not self.flying or len(values) != 7 or None in values:
+            return "error"
+        x1, y1, z1, x2, y2, z2, speed = values
+        if not all(-500 <= v <= 500 for v in values[:6]) or not 10 <= speed <= 60:
+            return "error"
+        # The drone flies an arc; the chord through the middle point is close
+        # enough for timing and leaves the drone at the right place.
+        length = math.dist((0, 0, 0), (x1, y1, z1)) + math.dist((x1, y1, z1), (x2, y2, z2))
+        self.fly(self.offset(x2, y2, z2), length / speed)
+        return "ok"
+
+    def on_speed(self, args):
+        speed = parse_number(args[1])
+        if speed is None or not 10 <= speed <= 100:
+            return "error"
+        self.speed = speed
+        return "ok"
+
+    def on_port(self, args):
+        state_port, video_port = parse_number(args[1]), parse_number(args[2])
+        if state_port is None or video_port is None:
+            return "error"
+        self.state_port, self.video_port = int(state_port), int(video_port)
+        return "ok"
+
+    def on_ext(self, args):
+        if len(args) > 1 and args[1] == "led":
+            return "led ok"
+        if len(args) > 1 and args[1] == "mled":
+            return "matrix ok"
+        return "ok"
+
+    def respond(self, command):
+        """ Returns the SDK response for one command string. """
+        command = command.strip()
+        if command in self.queries:
+            return self.queries[command]()
+        args = command.split()
+        if not args or args[0] not in self.handlers:
+            return "unknown command: " + command
+        if not self.sdk_mode and args[0] != "command":
+            return "error"
+        return self.handlers[args[0]](args)
+
+    # ------------------------------- Threads --------------------------------
+
+    def command_loop(self):
+        """ Answers commands one at a time, in the order they arrive. """
+        while not self.stopped.is_set():
+            try:
+                data, client = self.socket.recvfrom(1024)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            received = time.monotonic()
+            self.client = client
+            command = data.decode("utf-8", errors="replace")
+            if self.loss and self.random.random() < self.loss:
+                self.lost += 1
+                continue
+            if self.latency:
+                time.sleep(self.latency)
+            if command.strip() == "emergency":
+                self.handlers["emergency"]([command])
+                response = None
+            else:
+                response = self.respond(command)
+            if response is not None and self.loss and self.random.random() < self.loss:
+                self.lost += 1
+            elif response is not None:
+                if self.latency:
+                    time.sleep(self.latency)
+                self.socket.sendto(response.encode("utf-8"), client)
+            with self.lock:
+                self.commands.append(SimCommand(command, response, received, time.monotonic()))
+
+    def state_packet(self):
+        """ Formats the current state the way the drone does. """
+        x, y, z, yaw = self.get_pose()
+        vx, vy, vz = self.get_velocity()
+        yaw = (yaw + 180) % 360 - 180
+        # The drone reports velocities in dm/s.
+        return (f"mid:-1;x:-100;y:-100;z:-100;mpry:0,0,0;pitch:0;roll:0;yaw:{int(round(yaw))};"
+                f"vgx:{int(round(vx / 10))};vgy:{int(round(vy / 10))};vgz:{int(round(vz / 10))};"
+                f"templ:62;temph:65;tof:{int(z + 10)};h:{int(z)};bat:{int(self.get_battery())};"
+                f"baro:{self.ground_baro + z / 100:.2f};time:{int(self.get_flight_time())};"
+                f"agx:0.00;agy:0.00;agz:-1000.00;\r\n")
+
+    def state_loop(self):
+        """ Streams state packets to the client once it entered SDK mode. """
+        period = 1 / self.state_rate
+        deadline = time.monotonic()
+        while not self.stopped.is_set():
+            deadline += period
+            if self.sdk_mode and self.client is not None:
+                try:
+                    packet = self.state_packet().encode("ascii")
+                    self.socket.sendto(packet, (self.client[0], self.state_port))
+                except OSError:
+                    break
+            self.stopped.wait(max(deadline - time.monotonic(), 0))
+
+    def render_frame(self, texture, frame_number):
+        """
+        Renders the downward view of a textured floor after 'downvision 1'.
+        The texture pans with the simulated position so optical flow has
+        something to track. The forward camera sees the same texture
+        standing still, as if the drone faced a wall.
+        """
+        width, height = self.video_size
+        x, y, z, yaw = self.get_pose() if self.downward else (0.0, 0.0, 0.0, 0.0)
+        rows, cols = texture.shape[:2]
+        top = int(-x) % (rows - height)
+        left = int(-y) % (cols - width)
+        image = texture[top:top + height, left:left + width].copy()
+        image[:8, :(frame_number % width)] = 255
+        return image
+
+    def video_loop(self):
+        """ Encodes synthetic frames as raw H.264 and sends them like the drone. """
+        import av
+        import numpy as np
+        from fractions import Fraction
+
+        width, height = self.video_size
+        rng = np.random.default_rng(0)
+        texture = rng.integers(0, 255, (height // 16, width // 16, 1), np.uint8)
+        texture = np.repeat(np.repeat(texture, 16, axis=0), 16, axis=1).repeat(3, axis=2)
+        # Two by two copies, so the view wraps around without a seam
+        texture = np.tile(texture, (2, 2, 1))
+        encoder = None
+        frame_number = 0
+        period = 1 / self.video_fps
+        deadline = time.monotonic()
+        sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sender.bind((self.address[0], 0))
+        while not self.stopped.is_set():
+            deadline += period
+            if self.stream_on and self.client is not None:
+                if encoder is None:
+                    encoder = av.CodecContext.create("h264", "w")
+                    encoder.width, encoder.height = width, height
+                    encoder.pix_fmt = "yuv420p"
+                    encoder.time_base = Fraction(1, self.video_fps)
+                    encoder.framerate = self.video_fps
+                    # A key frame every second, so a decoder that starts
+                    # listening after 'streamon' locks on quickly
+                    encoder.gop_size = self.video_fps
+                    encoder.options = {"tune": "zerolatency", "preset": "ultrafast"}
+                frame = av.VideoFrame.from_ndarray(self.render_frame(texture, frame_number), format="bgr24")
+                frame.pts = frame_number
+                frame_number += 1
+                for packet in encoder.encode(frame):
+                    payload = bytes(packet)
+                    # The drone splits the stream into 1460 byte datagrams.
+                    for start in range(0, len(payload), 1460):
+                        sender.sendto(payload[start:start + 1460], (self.client[0], self.video_port))
+            elif encoder is not None:
+                encoder = None
+            self.stopped.wait(max(deadline - time.monotonic(), 0))
+        sender.close()
+
+# ------------------------- END OF TelloSimulator CLASS -------------------------
+
+
+def parse_number(text):
+    """ Parses an SDK argument, returning None if it isn't a number. """
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+
+def loopback_tello(host=SIM_HOST):
+    """
+    Returns a djitellopy Tello object that talks to a TelloSimulator on this
+    computer. The real library binds its command socket to port 8889, the
+    same port the simulator answers on, so we bind it to a free port instead
+    before the first Tello object is created. Everything else, including the
+    state listener on 8890, is the unmodified library.
+    """
+    if not tello_module.threads_initialized:
+        client_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        client_socket.bind(("", 0))
+        tello_module.client_socket = client_socket
+        threading.Thread(target=Tello.udp_response_receiver, daemon=True).start()
+        threading.Thread(target=Tello.udp_state_receiver, daemon=True).start()
+        tello_module.threads_initialized = True
+    return Tello(host)
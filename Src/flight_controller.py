@@ -3,12 +3,11 @@
 # Standard python modules
 import logging
 import json
-import cv2, time
+import argparse, time
 # Custom modules for the drones
 from djitellopy import Tello
 from Src.headsupflight import HeadsUpTello
 from Util import Utility
-import Camera
 
 
 # -------------------------------------------------------------------------------
@@ -37,7 +36,7 @@ class Flight():
 
     # ----------------------------------currentHeight
 
-    def __init__(self):
+    def __init__(self, lazy_connect=False):
 
         mission_obj = {'ceiling': 500, 'floor': 50}
         # mission_obj = {'ceiling':150, 'floor':100}
@@ -47,7 +46,8 @@ class Flight():
         # Connect to the DJI RoboMaster drone using a HeadsUpTello object
         # Try passing logging.INFO and see how your output changesy
         self.my_robomaster = Tello()
-        self.drone = HeadsUpTello(self.my_robomaster, 0,  None, None,logging.INFO)
+        self.drone = HeadsUpTello(self.my_robomaster, 0,  None, None,logging.INFO,
+                                  lazy_connect=lazy_connect)
         self.inAir = False
 
     def read_json(self):
@@ -72,25 +72,45 @@ class Flight():
         print(f"Battery: {Utility.get_battery(self.my_robomaster)}%")
         print(f"Temp °F: {Utility.get_temperature(self.my_robomaster)}")
 
-        self.drone.take_video()
+        # The video records in the background while the drone flies; landing
+        # stops it and finishes the movie file
+        self.drone.start_recording(duration=10)
 
         self.drone.takeoff()
 
         time.sleep(10)
-        self.drone.close()
+        self.drone.land()
+        self.drone.disconnect()
 
         return
 
     def controller(self):
-        self.drone.streamon()
-        frame_read = self.drone.get_frame_read()
+        # OpenCV and the camera modules take a while to import and only the
+        # controller needs them
+        import cv2
+        import Camera.Photo
+        frame_ring = Camera.Photo.frame_ring(self.my_robomaster)
+        # Markers are found on worker threads; the loop only draws the
+        # newest ones, so detection never holds up the video or the keys
+        self.drone.start_vision()
 
         self.drone.takeoff()
 
+        last_seq = -1
         while True:
 
-            img = frame_read.frame
-            cv2.imshow("drone", img)
+            # Only redraw when a new frame arrived; the view is not copied
+            # unless there are markers to draw on it
+            frame = frame_ring.wait(last_seq, timeout=0.05)
+            if frame is not None:
+                last_seq = frame.seq
+                image = frame.image
+                detections = self.drone.detections
+                if detections is not None and detections.markers and last_seq - detections.seq < 15:
+                    image = image.copy()
+                    for marker in detections.markers:
+                        cv2.polylines(image, [marker.corners.astype(int)], True, (0, 255, 0), 2)
+                cv2.imshow("drone", image)
 
             key = cv2.waitKey(1) & 0xff
             if key == 27:  # ESC
@@ -121,27 +141,18 @@ class Flight():
         # Turn the top LED bright green and show our logo on the matrix display
 
         self.drone.matrix_pattern(self.huf_logo2, 'b')
-        r = 0
-        g = 200
-        b = 50
-        self.drone.top_led_color(r, g, b)
 
-        # Slowly dim the top LED without changing the LED matrix
-        # The loop runs 100 times with a 0.05 second delay => 5 seconds
-        # These colors don't exactly match up to true RGB colors
-        for i in range(10):
-            g -= 20
-            b -= 5
+        # Slowly dim the top LED without changing the LED matrix. The effects
+        # play in the background; we only wait for them before turning the
+        # matrix off. These colors don't exactly match up to true RGB colors
+        self.drone.fade_top_led((0, 0, 0), 10, start=(0, 200, 50))
 
-            self.drone.top_led_color(r, g, b)
-            time.sleep(1)
-
-        # Turn off the LED matrix and make the top LED red for two seconds
-        self.drone.top_led_color(200, 10, 10)
-        time.sleep(2)
+        # Then make the top LED red for two seconds and turn it off
+        self.drone.top_led.hold((200, 10, 10), 2, append=True)
+        self.drone.top_led.hold((0, 0, 0), append=True)
+        self.drone.top_led.wait(timeout=15)
 
         self.drone.matrix_off()
-        self.drone.top_led_off()
 
 
 # -------------------------------------------------------------------------------
@@ -149,8 +160,12 @@ class Flight():
 # -------------------------------------------------------------------------------
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lazy-connect", action="store_true",
+                        help="read the barometer baseline at the first height check")
+    args = parser.parse_args()
     try:
-        flight = Flight()
+        flight = Flight(lazy_connect=args.lazy_connect)
         flight.mission()
         print(f"Mission completed")
     except Exception as excp:
@@ -0,0 +1,207 @@
+import logging
+import math
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from djitellopy import Tello
+
+from Src.headsupflight import HeadsUpTello
+
+
+class FleetError(Exception):
+    """
+    Raised when a command failed on some drones. errors maps the index of
+    each drone that failed to its exception, results holds every drone's
+    result, None for the ones that failed.
+    """
+
+    def __init__(self, errors, results):
+        self.errors = errors
+        self.results = results
+        failed = ", ".join(f"drone {index}: {excp}" for index, excp in errors.items())
+        super().__init__(f"{len(errors)} of {len(results)} drones failed: {failed}")
+
+
+# ------------------------- BEGIN HeadsUpFleet CLASS ----------------------------
+
+class HeadsUpFleet():
+    """
+    Flies several drones from one program. Each drone is a HeadsUpTello with
+    its own address, command channel, log and telemetry cache, and has one
+    worker thread of its own. A command for the fleet is handed to every
+    worker at once, so the drones fly in parallel while each one still gets
+    its commands in order.
+
+        fleet = HeadsUpFleet.connect(["192.168.10.11", "192.168.10.12"], 20, mission)
+        fleet.takeoff()
+        fleet.each('move_forward', 100)
+        fleet.fly([square, circle])     # one script per drone
+        fleet.land()
+        print(fleet.latency_report())
+        fleet.disconnect()
+
+    Scripts given to fly() run side by side and call fleet.sync() where every
+    drone has to arrive before any of them goes on, e.g. to start a formation
+    move at the same moment.
+
+    djitellopy tells drones apart by their IP address, so every drone needs
+    its own address; the simulators of Bench.fleet use 127.0.0.2, .3, ...
+    """
+
+    def __init__(self, drones):
+        """
+        Arguments
+            drones: Connected HeadsUpTello objects
+        """
+        self.drones = list(drones)
+        self.workers = [ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"fleet-{index}")
+                        for index in range(len(self.drones))]
+        self.barrier = threading.Barrier(len(self.drones))
+        self.latencies = [[] for _ in self.drones]
+        for drone, latencies in zip(self.drones, self.latencies):
+            drone.channel.add_listener(
+                lambda command, response, sent, latency, latencies=latencies:
+                latencies.append(latency))
+
+    @classmethod
+    def connect(cls, hosts, minBat, mission_obj=None, make_tello=Tello,
+                debug_level=logging.WARNING, **options):
+        """
+        Connects to a drone at every host at the same time and returns the
+        fleet. Drone i logs to fleet_<i>.log. If a drone can't connect, the
+        others are disconnected again and the error is raised.
+
+        Arguments
+            hosts:      IP address of every drone
+            make_tello: Called with a host to build its djitellopy object
+            options:    Further HeadsUpTello arguments
+        """
+        def connect_one(index, tello):
+            return HeadsUpTello(tello, minBat, mission_obj, debug_level=debug_level,
+                                name=f"fleet_{index}", **options)
+
+        # The first djitellopy object starts the shared receiver threads, so
+        # the objects are made one after another and only connect in parallel
+        tellos = [make_tello(host) for host in hosts]
+        with ThreadPoolExecutor(max_workers=len(hosts)) as executor:
+            futures = [executor.submit(connect_one, index, tello)
+                       for index, tello in enumerate(tellos)]
+            wait(futures)
+        failed = [future.exception() for future in futures if future.exception() is not None]
+        if failed:
+            for future in futures:
+                if future.exception() is None:
+                    future.result().disconnect()
+            raise failed[0]
+        return cls([future.result() for future in futures])
+
+    def __len__(self):
+        return len(self.drones)
+
+    def __getitem__(self, index):
+        return self.drones[index]
+
+    # ---------------------------- Dispatching -------------------------------
+
+    def submit(self, index, function, *args, **kwargs):
+        """ Queues function(drone, *args) on one drone's worker. Returns a Future. """
+        return self.workers[index].submit(function, self.drones[index], *args, **kwargs)
+
+    def dispatch(self, command, *args, **kwargs):
+        """
+        Starts a HeadsUpTello method, by name, or function(drone, ...) on every
+        drone. Returns a Future for each drone without waiting.
+        """
+        function = command if callable(command) else getattr(HeadsUpTello, command)
+        return [self.submit(index, function, *args, **kwargs) for index in range(len(self.drones))]
+
+    def gather(self, futures):
+        """ Waits for a Future of every drone and returns their results. """
+        wait(futures)
+        results = [None if future.exception() else future.result() for future in futures]
+        errors = {index: future.exception() for index, future in enumerate(futures)
+                  if future.exception() is not None}
+        if errors:
+            raise FleetError(errors, results)
+        return results
+
+    def each(self, command, *args, **kwargs):
+        """ Runs a command on every drone in parallel and returns their results. """
+        return self.gather(self.dispatch(command, *args, **kwargs))
+
+    def fly(self, scripts):
+        """
+        Runs script(drone, fleet) for every drone, the first script on the
+        first drone and so on, side by side. Returns their results.
+        """
+        if len(scripts) != len(self.drones):
+            raise ValueError(f"{len(scripts)} scripts for {len(self.drones)} drones")
+        self.barrier.reset()
+        return self.gather([self.submit(index, self.run_script, script)
+                            for index, script in enumerate(scripts)])
+
+    def run_script(self, drone, script):
+        """ Runs one script of fly(), breaking the barrier if it fails. """
+        try:
+            return script(drone, self)
+        except Exception:
+            self.barrier.abort()
+            raise
+
+    def sync(self, timeout=None):
+        """
+        Called by every script of fly(): blocks until all drones got here,
+        then lets them go at once. A script that fails breaks the barrier, so
+        the others raise threading.BrokenBarrierError instead of waiting.
+        """
+        return self.barrier.wait(timeout)
+
+    # ---------------------------- Fleet commands ----------------------------
+
+    def takeoff(self):
+        return self.each('takeoff')
+
+    def land(self):
+        return self.each('land')
+
+    def emergency(self):
+        """ Stops every motor right away, without waiting for the workers. """
+        self.barrier.abort()
+        for drone in self.drones:
+            drone.drone.emergency()
+
+    def disconnect(self):
+        """ Disconnects every drone and stops the workers. """
+        self.barrier.abort()
+        try:
+            self.each('disconnect')
+        finally:
+            for worker in self.workers:
+                worker.shutdown(wait=True)
+
+    # ------------------------------ Reporting -------------------------------
+
+    def latency_report(self, reset=False):
+        """
+        Returns one dict per drone with the command count and the p50, p99
+        and largest command latency in ms, measured on each drone's channel.
+        """
+        report = []
+        for drone, latencies in zip(self.drones, self.latencies):
+            ordered = sorted(latencies)
+            report.append({'host': drone.drone.address[0], 'commands': len(ordered),
+                           'p50_ms': nearest_rank(ordered, 50) * 1000,
+                           'p99_ms': nearest_rank(ordered, 99) * 1000,
+                           'max_ms': nearest_rank(ordered, 100) * 1000})
+            if reset:
+                latencies.clear()
+        return report
+
+# ------------------------- END OF HeadsUpFleet CLASS ---------------------------
+
+
+def nearest_rank(ordered, pct):
+    """ The pct percentile of a sorted list, or 0 when it is empty. """
+    if not ordered:
+        return 0.0
+    return ordered[max(math.ceil(pct / 100 * len(ordered)), 1) - 1]
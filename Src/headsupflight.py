@@ -1,10 +1,24 @@
-import math
 import logging
-import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
+
+from djitellopy import Tello
+from djitellopy.tello import TelloException
 
-import Camera.Photo
 from Util import Log
 from Util import Utility
+from Util.CommandChannel import CommandChannel
+from Util.CommandOptimizer import AXES, CommandOptimizer, split_move
+from Util.CommandPolicy import CommandPolicy, command_kind
+from Util.FlightRecorder import FlightRecorder
+from Util.Geofence import Geofence, mission_limit
+from Util.LedMatrix import LedMatrix, MatrixSequencer
+from Util.PoseEstimator import PoseEstimator
+from Util.TopLed import TopLed
+from Util.Telemetry import Telemetry
+from Src.mission_compiler import (HeadingPlanner, bearing, compile_mission, plan_altitude,
+                                  shortest_turn, to_body, to_world)
 
 
 # ------------------------- BEGIN HeadsUpTello CLASS ----------------------------
@@ -15,7 +29,9 @@ class HeadsUpTello():
     Drone. Inherits from the djitellopy.Tello class.
     """
 
-    def __init__(self, drone_baseobject, minBat, mission_obj=None, tether=None, debug_level=logging.INFO):
+    def __init__(self, drone_baseobject, minBat, mission_obj=None, tether=None, debug_level=logging.INFO,
+                 telemetry_max_age=0.5, geofence=None, flight_record=None, name=None,
+                 lazy_connect=False, command_policy=None, metrics=None):
         """
         Constuctor that establishes a connection with the drone. Pass in a new
         djitellopy Tello object give your HeadsUpTello object its wings.
@@ -26,6 +42,30 @@ class HeadsUpTello():
                               logging.INFO shows every command and response 
                               logging.WARN will only show problems
                               There are other possibilities, see logging module
+            telemetry_max_age: Seconds a cached state value may be old before
+                              a getter queries the drone directly
+            geofence:         A Util.Geofence object. By default the fence is
+                              the tether around home plus the mission's floor
+                              and ceiling
+            flight_record:    Directory to record every state packet and
+                              command of the flight to, see
+                              Util.FlightRecorder.load_flight()
+            name:             Name of this drone's log and log file, for
+                              flying several drones from one program
+            lazy_connect:     Read the barometer baseline at takeoff, or the
+                              first time a barometer height is needed,
+                              instead of while connecting
+            command_policy:   A Util.CommandPolicy that sets the command
+                              timeouts and handles lost answers. By default
+                              one that learns the timeouts from this
+                              drone's round trips; False keeps djitellopy's
+                              fixed timeouts and retries
+            metrics:          A Util.Metrics.Metrics to time the commands,
+                              telemetry reads, log calls and camera frames
+                              in, see instrument()
+
+        The camera modules (OpenCV, PyAV) are only imported by the first
+        camera call, so a flight without video starts faster.
         """
 
         # HeadsUpTello class uses the design principal of composition (has-a)
@@ -35,26 +75,66 @@ class HeadsUpTello():
 
         # ___________Drone Objects_______________
         self.drone = drone_baseobject
+        self.channel = CommandChannel.of(self.drone)
+        self.optimizer = CommandOptimizer.of(self.drone)
+        self.optimizer.add_listener(self.flying_held_moves)
+        self.held_origin = None
+        self.matrix = LedMatrix.of(self.drone)
+        self.matrix_sequencer = MatrixSequencer(self.matrix)
+        self.top_led = TopLed.of(self.drone)
+        self.telemetry = Telemetry(self.drone, telemetry_max_age)
+        self.pose_estimator = PoseEstimator(self.telemetry)
+        self.recorder = None
+        if flight_record is not None:
+            self.recorder = FlightRecorder(flight_record, {'minBat': minBat, 'mission': mission_obj})
+            self.recorder.attach(self.telemetry, self.channel)
         self.inAir = False
         self.mission_obj = mission_obj
         self.useBar = True
+        self.groundBaro = None
         self.homeX = 0
         self.homeY = 0
         self.homeZ = 0
-        self.currentX = 0
-        self.currentY = 0
-        self.currentRotation = 0
         self.homeRotation = 0
         self.minBatteryLevel = minBat
         self.tether = tether
+        if geofence is None:
+            geofence = Geofence.from_mission(mission_obj, (self.homeX, self.homeY), tether)
+        self.geofence = geofence
+        self.recordings = []
+        self.snapshots = []
+        self.camera_executor = None
+        self.vision = None
+        self.detections = None
+        self.odometry = None
 
-        self.logger = Log.Log("Test", "tie", 120, 10, "lilTieLog", logging.INFO)
+        self.connected = False
+        self.name = name
+        if name is None:
+            self.logger = Log.Log("Test", "tie", 120, 10, "lilTieLog", debug_level)
+        else:
+            self.logger = Log.Log(name, name, 120, 10, name, debug_level)
+        self.optimizer.logger = self.logger
+        if command_policy is None:
+            command_policy = CommandPolicy(self.telemetry, logger=self.logger)
+        self.command_policy = command_policy or None
+        if self.command_policy is not None:
+            self.command_policy.attach(self.channel)
+        self.metrics = None
+        if metrics is not None:
+            self.instrument(metrics)
         try:
-            self.drone.connect()
+            # The motors start while the state stream gets going, instead of
+            # after djitellopy has polled for the first packet
+            streaming = self.telemetry.attach()
+            self.drone.connect(wait_for_state=not streaming)
             self.logger.info("****Connected to ")
             self.connected = True
             self.idle()
-            self.barHeight = Utility.get_barometer(self.drone)
+            if streaming and not self.telemetry.wait_for_packet(timeout=1.0):
+                raise TelloException('Did not receive a state packet from the Tello')
+            if not lazy_connect:
+                self.groundBaro = self.get_barometer()
         except Exception as excp:
             self.logger.error(f"ERROR: could not connect to Trello Drone: {excp}")
             self.logger.critical(f" => Did you pass in a valid drone base object?")
@@ -68,87 +148,214 @@ class HeadsUpTello():
 
     def __del__(self):
         """ Destructor that gracefully closes the connection to the drone. """
-        if self.connected:
+        if getattr(self, 'connected', False):
             self.disconnect()
-        exit(0)
         return
 
     def disconnect(self):
         """ Gracefully close the connection with the drone. """
+        self.finish_camera()
+        self.stop_vision()
+        self.stop_visual_odometry()
+        self.matrix_sequencer.stop()
+        self.top_led.close()
+        if self.camera_executor is not None:
+            self.camera_executor.shutdown(wait=True)
+            self.camera_executor = None
+        if getattr(self.drone, 'frame_grabber', None) is not None:
+            import Camera.Photo
+            Camera.Photo.stop_video(self.drone)
         self.drone.end()
+        if self.recorder is not None:
+            self.recorder.close()
         self.connected = False
         print(f"Drone connection closed gracefully")
         return
 
+    @property
+    def barHeight(self):
+        """ The barometer on the ground in cm, read the first time it is needed. """
+        return self.ground_barometer()
+
+    def ground_barometer(self, query=True):
+        """
+        Returns barHeight, reading it the first time. With query=False and
+        nothing cached it returns None instead of asking the drone.
+        """
+        if self.groundBaro is None:
+            self.groundBaro = self.get_barometer(query=query)
+        return self.groundBaro
+
+    @barHeight.setter
+    def barHeight(self, value):
+        self.groundBaro = value
+
+    # The drone's position and heading come from the pose estimator, which
+    # integrates the state stream. Assigning them re-references the estimate.
+
+    @property
+    def currentX(self):
+        return self.pose_estimator.position()[0]
+
+    @currentX.setter
+    def currentX(self, value):
+        self.pose_estimator.set_position(x=value)
+
+    @property
+    def currentY(self):
+        return self.pose_estimator.position()[1]
+
+    @currentY.setter
+    def currentY(self, value):
+        self.pose_estimator.set_position(y=value)
+
+    @property
+    def currentRotation(self):
+        return self.pose_estimator.heading()
+
+    @currentRotation.setter
+    def currentRotation(self, value):
+        self.pose_estimator.set_heading(value)
+
+    def get_pose(self):
+        """ Returns the estimated Pose (x, y, z, heading, timestamp). """
+        return self.pose_estimator.pose()
+
+    def body_target(self, forward, left):
+        """
+        Returns the (x, y) the drone ends up at after moving forward and left
+        from where it is now, given the way it is facing.
+        """
+        dx, dy, _ = to_world((forward, left, 0), self.currentRotation)
+        return self.currentX + dx, self.currentY + dy
+
+    def tracked_move(self, direction, amount, dx, dy):
+        """ Sends a horizontal move and tells the pose estimator about it. """
+        if self.optimizer.batching:
+            # The move may be held back and merged with the next one, so the
+            # estimate jumps to where it ends; see flying_held_moves()
+            self.move(direction, amount)
+            if self.held_origin is None:
+                self.held_origin = (self.currentX, self.currentY)
+            self.pose_estimator.set_position(self.currentX + dx, self.currentY + dy)
+            return
+        self.pose_estimator.begin_motion()
+        self.move(direction, amount)
+        self.pose_estimator.end_motion(dx, dy)
+
+    @contextmanager
+    def flying_held_moves(self, commands):
+        """
+        CommandOptimizer listener around sending held moves. The drone is
+        still where the first of them started, so the estimate goes back
+        there while the state stream follows the real motion.
+        """
+        if self.held_origin is None:
+            yield
+            return
+        (x, y), self.held_origin = self.held_origin, None
+        planned_x, planned_y = self.currentX, self.currentY
+        self.pose_estimator.set_position(x, y)
+        self.pose_estimator.begin_motion()
+        yield
+        self.pose_estimator.end_motion(planned_x - x, planned_y - y)
+
+    @contextmanager
+    def batch(self):
+        """
+        Runs the SDK commands of a with block through the CommandOptimizer:
+        back-to-back moves are merged, moves that cancel out are dropped and
+        LED commands that change nothing are left out. Logs how many round
+        trips that saved.
+
+            with drone.batch():
+                mission(drone)
+        """
+        outermost = not self.optimizer.batching
+        if outermost:
+            self.optimizer.reset()
+        try:
+            with self.optimizer.batch():
+                yield self.optimizer
+        except BaseException:
+            # The held moves were dropped, so the drone is still where they began
+            if outermost and self.held_origin is not None:
+                self.pose_estimator.set_position(*self.held_origin)
+                self.held_origin = None
+            raise
+        if outermost:
+            report = self.optimizer.report()
+            self.logger.info("Command optimizer saved %s of %s round trips "
+                             "(%s merged, %s cancelled, %s LED repeats)", report['saved'],
+                             report['received'], report['merged'], report['cancelled'],
+                             report['deduplicated'])
+
     def takeoff(self):
         """Lifts the drone off the ground by sending the takeoff command. Timeout was added to not error."""
         if Utility:
             self.logger.info("Drone is taking off.")
-            self.logger.info(f"current height: {Utility.get_Height(self.drone, self.useBar, self.barHeight)}")
+            # The barometer baseline has to be read on the ground
+            self.ground_barometer()
+            self.logger.info(f"current height: {self.get_height()}")
             self.drone.takeoff()
+            self.telemetry.invalidate()
             self.inAir = True
 
     def land(self):
         """Lands the drone by sending the drone the land command"""
         self.logger.info("Drone is landing.")
         self.drone.land()
+        self.telemetry.invalidate()
         self.inAir = False
+        self.finish_camera()
 
     def move(self, direction, cm):
-        """Moves the drone"""
+        """Moves the drone, in as few legal moves as it takes, see split_move()"""
         # self.logger.info(f"Moving drone {direction} {cm} cm")
-        while (cm > 500):
-            self.drone.send_control_command(f"{direction} {cm / 2}")
-            cm = cm / 2
-        self.drone.send_control_command(f"{direction} {cm}")
+        axis, sign = AXES[direction]
+        for command in split_move(axis, sign * cm):
+            self.drone.send_control_command(command)
+        self.telemetry.invalidate()
+
+    def change_altitude(self, amount, height=None, floor=None, ceiling=None):
+        """
+        Climbs amount cm, or descends for a negative amount, without leaving
+        the mission's floor and ceiling. Reads the height once, from the
+        telemetry cache, unless it is passed in, sends at most one command
+        and returns the height the drone should be at afterwards. A change
+        of less than 20 cm is left out, see plan_altitude().
+        """
+        if floor is None:
+            floor = mission_limit(self.mission_obj, 'floor')
+        if ceiling is None:
+            ceiling = mission_limit(self.mission_obj, 'ceiling')
+        if height is None:
+            height = self.get_height()
+        step = plan_altitude(height, amount, floor, ceiling)
+        self.logger.debug("height: %s || floor: %s || ceiling: %s", height, floor, ceiling)
+        if step.command is None:
+            self.logger.info("Staying at %s cm, %s cm is less than 20 cm away", height, step.target)
+            return step.height
+        if step.target != height + amount:
+            self.logger.warning("Moving %s would leave the envelope, flying to %s cm", amount, step.target)
+        self.logger.info("Flying from %s cm to %s cm: %s", height, step.height, step.command)
+        self.drone.send_control_command(step.command)
+        self.telemetry.invalidate()
+        return step.height
 
     def fly_up(self, moveAmount=0):
         """
-        Moves drone up by the user specified amount.
-        """
-        ceilingHeight = self.mission_obj["ceiling"]
-        currentHeight = Utility.get_Height(self.drone)
-        self.logger.info(f"trying to move up {moveAmount}")
-        self.logger.debug(f"ceiling height: {ceilingHeight}")
-        self.logger.debug(f"current height: {currentHeight}")
-        if currentHeight > ceilingHeight:
-            self.logger.warning(f"I am higher than the ceiling {ceilingHeight}, Going down...")
-            moveAmount = currentHeight - ceilingHeight
-            self.move_down(int(moveAmount))
-        elif currentHeight == ceilingHeight:
-            return
-        elif currentHeight + moveAmount > ceilingHeight:
-            self.logger.warning(f"Moving {moveAmount} will put me higher than ceiling height...")
-            moveAmount = ceilingHeight - currentHeight
-            self.logger.info(f"New move amount is {moveAmount}")
-            self.move_up(int(moveAmount))
-        else:
-            self.logger.debug(f"moving: {moveAmount}")
-            self.move_up(int(moveAmount))
-        self.logger.debug(f"New currentheight: {Utility.get_Height(self.drone, self.useBar)}")
+        Moves drone up by the user specified amount, no higher than the
+        ceiling. Returns the predicted height.
+        """
+        return self.change_altitude(moveAmount)
 
     def checkMoveDown(self, moveAmount, currentHeight, floorHeight):
         """
-        Checks that the move amount is valid
-        :param moveAmount: the amount to move
-        :return:
+        Moves the drone down by moveAmount from currentHeight, no lower than
+        floorHeight. Returns the predicted height.
         """
-        Utility.printHeight(self.drone, self.logger, self.mission_obj)
-        if currentHeight < floorHeight:
-            self.logger.warning(f"I am lower than the floor {floorHeight}, Going up...")
-            moveAmount = floorHeight - currentHeight
-            self.move_up(int(moveAmount))
-        elif currentHeight == floorHeight:
-            return
-        elif currentHeight - moveAmount < floorHeight:
-            self.logger.warning(f"Moving {moveAmount} will put me lower than floor height...")
-            moveAmount = currentHeight - floorHeight
-            self.logger.info(f"New move amount is {moveAmount}")
-            self.move_down(int(moveAmount))
-        else:
-            self.logger.debug(f"moving: {moveAmount}")
-            self.move_down(int(moveAmount))
-        self.logger.debug(f"New currentheight: {Utility.get_Height(self.drone, self.useBar)}")
+        return self.change_altitude(-moveAmount, currentHeight, floorHeight)
 
     def move_up(self, amount):
         """
@@ -157,13 +364,14 @@ class HeadsUpTello():
         # if Utility.check_battery(self.drone, self.minBatteryLevel, self.logger):
         if amount < 20:
             self.logger.warning("Going to move down 30 then up 30 since move amount was {amount}")
-            self.logger.info(f"Moving down {amount} cm.")
+            self.logger.info("Moving down %s cm.", amount)
             self.drone.move_down(amount + 20)
-            self.logger.info(f"Moving up {amount} cm.")
+            self.logger.info("Moving up %s cm.", amount)
             self.drone.move_up(amount + 20)
         else:
-            self.logger.info(f"Moving up {amount} cm.")
+            self.logger.info("Moving up %s cm.", amount)
             self.drone.move_up(amount)
+        self.telemetry.invalidate()
 
     def move_down(self, amount):
         """
@@ -173,13 +381,14 @@ class HeadsUpTello():
         # if Utility.check_battery(self.drone, self.minBatteryLevel, self.logger):
         if amount < 20:
             self.logger.warning(f"Going to move up 30 then down 30 since move amount was {amount}")
-            self.logger.info(f"Moving up {amount} cm.")
+            self.logger.info("Moving up %s cm.", amount)
             self.drone.move_up(amount + 20)
-            self.logger.info(f"Moving down {amount} cm.")
+            self.logger.info("Moving down %s cm.", amount)
             self.drone.move_down(amount + 20)
         else:
-            self.logger.info(f"Moving down {amount} cm.")
+            self.logger.info("Moving down %s cm.", amount)
             self.drone.move_down(amount)
+        self.telemetry.invalidate()
 
     def move_right(self, amount):
         """
@@ -188,10 +397,10 @@ class HeadsUpTello():
         :return:
         """
         # if Utility.check_battery(self.drone, self.minBatteryLevel, self.logger):
-        if (self.tether_distance('right', self.currentX, self.currentY - amount)):
-            self.logger.info(f"Moving right {amount} cm.")
-            self.move('right', amount)
-            self.currentY -= amount
+        x, y = self.body_target(0, -amount)
+        if (self.tether_distance('right', x, y)):
+            self.logger.info("Moving right %s cm.", amount)
+            self.tracked_move('right', amount, x - self.currentX, y - self.currentY)
 
     def move_left(self, amount):
         """
@@ -200,10 +409,10 @@ class HeadsUpTello():
         :return:
         """
         # if Utility.check_battery(self.drone, self.minBatteryLevel, self.logger):
-        if self.tether_distance('left', self.currentX, self.currentY + amount):
-            self.logger.info(f"Moving left {amount} cm.")
-            self.move('left', amount)
-            self.currentY += amount
+        x, y = self.body_target(0, amount)
+        if self.tether_distance('left', x, y):
+            self.logger.info("Moving left %s cm.", amount)
+            self.tracked_move('left', amount, x - self.currentX, y - self.currentY)
 
     def move_forward(self, amount):
         """
@@ -212,10 +421,10 @@ class HeadsUpTello():
         :return:
         """
         # if Utility.check_battery(self.drone, self.minBatteryLevel, self.logger):
-        if self.tether_distance('forward', self.currentX + amount, self.currentY):
-            self.logger.info(f"Moving forward {amount} cm.")
-            self.move('forward', amount)
-            self.currentX += amount
+        x, y = self.body_target(amount, 0)
+        if self.tether_distance('forward', x, y):
+            self.logger.info("Moving forward %s cm.", amount)
+            self.tracked_move('forward', amount, x - self.currentX, y - self.currentY)
 
     def move_back(self, amount):
         """
@@ -224,15 +433,17 @@ class HeadsUpTello():
         :return:
         """
         # if Utility.check_battery(self.drone, self.minBatteryLevel, self.logger):
-        if (self.tether_distance('back', self.currentX - amount, self.currentY)):
-            self.logger.info(f"Moving back {amount} cm.")
-            self.move('back', amount)
-            self.currentX -= amount
+        x, y = self.body_target(-amount, 0)
+        if (self.tether_distance('back', x, y)):
+            self.logger.info("Moving back %s cm.", amount)
+            self.tracked_move('back', amount, x - self.currentX, y - self.currentY)
 
-    def goToPosition(self, x, y):
+    def goToPosition(self, x, y, correct=True):
         """
         Custom go to position method. Checks if the new move amount is negative or positive
-        this will then dictate the direction to go.
+        this will then dictate the direction to go. With visual odometry running the
+        position is corrected before the moves and, if correct is set, checked again after
+        them; a miss of 20 cm or more is flown once more.
 
         param: X, x-coordinate to go too.
         param: Y, y-coordinate to go too.
@@ -240,8 +451,13 @@ class HeadsUpTello():
         return: none
         """
         self.logger.info(f"Going to position {x},{y} : X, Y, Z")
-        newX = x - self.currentX
-        newY = y - self.currentY
+        self.correct_position()
+        # Moves are relative to the way the drone is facing
+        newX, newY, _ = to_body((x - self.currentX, y - self.currentY, 0), self.currentRotation)
+        # The drone can't fly less than 20 cm, so leave small errors alone
+        # instead of paying for a detour
+        newX = round(newX) if abs(newX) >= 20 else 0
+        newY = round(newY) if abs(newY) >= 20 else 0
         if newY < 0:
             self.move_right(abs(newY))
         elif newY > 0:
@@ -252,14 +468,34 @@ class HeadsUpTello():
         elif newX > 0:
             self.move_forward(newX)
 
-    def go_to_point_rotation(self, x, y):
+        if correct and self.odometry is not None and (newX or newY):
+            self.goToPosition(x, y, correct=False)
+
+    def go_to_point_rotation(self, x, y, sideways=False):
+        """
+        Turns the shortest way to face the point (x, y) and flies straight to
+        it. With sideways=True it flies there without turning instead when
+        that is quicker, see HeadingPlanner.
+        """
+        planner = self.heading_planner(sideways)
+        planner.fly(x - self.currentX, y - self.currentY)
+        self.fly_heading_plan(planner)
+
+    def heading_planner(self, sideways=False):
+        """ A HeadingPlanner that starts from the way the drone faces now. """
+        return HeadingPlanner(self.currentRotation, sideways=sideways)
+
+    def fly_heading_plan(self, planner):
         """
-        Goes to a point with rotation
+        Flies the turns and moves of a HeadingPlanner through the rotate and
+        move methods, so the tether and the pose estimator see every one.
         """
-        self.rotate_to_bearing(self.getRotateAmount(x, y))
-        self.move_forward(Utility.get_c(self.currentX, self.currentY, x, y))
-        self.currentX = x
-        self.currentY = y
+        methods = {'cw': self.rotate_cw, 'ccw': self.rotate_ccw,
+                   'forward': self.move_forward, 'back': self.move_back,
+                   'left': self.move_left, 'right': self.move_right}
+        for step in planner:
+            self.logger.info("Heading %s: %s %s", round(step.heading), step.direction, step.amount)
+            methods[step.direction](step.amount)
 
     def rotate_ccw(self, degrees):
         """
@@ -268,6 +504,7 @@ class HeadsUpTello():
         # if Utility.check_battery(self.drone, self.minBatteryLevel, self.logger):
         # self.drone.rotate_counter_clockwise(degrees)
         self.drone.rotate_counter_clockwise(degrees)
+        self.telemetry.invalidate()
 
     def rotate_cw(self, degrees):
         """
@@ -276,66 +513,241 @@ class HeadsUpTello():
         # if Utility.check_battery(self.drone, self.minBatteryLevel, self.logger):
         # self.drone.rotate_clockwise(degrees)
         self.drone.rotate_clockwise(degrees)
+        self.telemetry.invalidate()
 
-    def goHome(self, directFlight):
+    def goHome(self, directFlight, sideways=False):
         """
         Takes the drone home by using a custom go to specific position method.
+        With visual odometry running the position is corrected on the way,
+        see goToPosition().
         """
-        self.fly_to_coordinates(self.homeX, self.homeY, directFlight)
+        self.correct_position()
+        self.fly_to_coordinates(self.homeX, self.homeY, directFlight, sideways)
+        if directFlight and self.odometry is not None:
+            self.goToPosition(self.homeX, self.homeY, correct=False)
+
+    def start_visual_odometry(self, **options):
+        """
+        Switches the video to the downward camera and starts measuring the
+        drone's motion over the floor from it, in a process of its own.
+        Returns the Camera.VisualOdometry. It starts from the current
+        position; from then on goToPosition() and goHome() correct the
+        position with it. stop_visual_odometry() switches back to the
+        forward camera.
+
+        Arguments
+            options: VisualOdometry arguments (scale, focal, fov, slots...)
+        """
+        if self.odometry is None:
+            import Camera.Photo
+            from Camera.VisualOdometry import VisualOdometry
+            options.setdefault('metrics', self.metrics)
+            ring = Camera.Photo.frame_ring(self.drone)
+            self.drone.set_video_direction(Tello.CAMERA_DOWNWARD)
+            try:
+                self.odometry = VisualOdometry(ring, self.telemetry,
+                                               (self.currentX, self.currentY),
+                                               self.odometry_heading,
+                                               **options).start(since=time.monotonic())
+            except Exception:
+                self.drone.set_video_direction(Tello.CAMERA_FORWARD)
+                raise
+            self.logger.info("Tracking the position with visual odometry")
+        return self.odometry
+
+    def odometry_heading(self, state):
+        """ The heading of a state packet, the way currentRotation counts it. """
+        return state['yaw'] - (self.pose_estimator.heading_offset or 0)
+
+    def correct_position(self, weight=0.8):
+        """
+        Pulls the position estimate weight of the way to where the visual
+        odometry sees the drone, from a frame taken after this call. Returns
+        True if it did, False without odometry or when it lost track.
+        """
+        if self.odometry is None:
+            return False
+        # Held moves have to be flown before the camera can see where they went
+        self.optimizer.flush()
+        fix = self.odometry.wait(time.monotonic())
+        if self.odometry.error is not None:
+            self.logger.warning(f"Visual odometry error: {self.odometry.error!r}")
+        if fix is None:
+            self.logger.warning("Visual odometry has no fix, keeping the position estimate")
+            return False
+        x = self.currentX + weight * (fix.x - self.currentX)
+        y = self.currentY + weight * (fix.y - self.currentY)
+        self.logger.debug("Correcting the position from %.0f,%.0f to %.0f,%.0f",
+                          self.currentX, self.currentY, x, y)
+        self.pose_estimator.set_position(x, y)
+        return True
+
+    def stop_visual_odometry(self):
+        """ Stops the visual odometry process and switches back to the forward camera. """
+        if self.odometry is not None:
+            self.odometry.stop()
+            self.logger.info(f"Visual odometry: {self.odometry.report()}")
+            self.odometry = None
+            try:
+                self.drone.set_video_direction(Tello.CAMERA_FORWARD)
+            except (TelloException, OSError) as excp:
+                self.logger.warning(f"Could not switch back to the forward camera: {excp}")
 
     def getRotateAmount(self, x, y):
         """
-        Rotates the drone to the exact point. This means the front of the drone will now face that point.
+        Returns the turn in degrees, clockwise if positive, that makes the
+        front of the drone face the point (x, y) the shortest way round.
         """
-        myradians = math.atan2(x - self.currentX, y - self.currentY)
-        mydegrees = abs(int(math.degrees(myradians)))
-        return mydegrees
+        return round(shortest_turn(self.currentRotation, bearing(x - self.currentX, y - self.currentY)))
 
     def rotate_to_bearing(self, degrees):
         """
-        Rotates the drone to a specific bearing by finding the shortest rotation path given the amount of degrees.
+        Rotates the drone to face the bearing degrees clockwise from the x
+        axis, the shortest way round from where it faces now. Turns of less
+        than HeadingPlanner's threshold are left out.
         """
-        ccwRotation = int(degrees)
-        cwRotation = 360 - int(degrees)
-        if ccwRotation > cwRotation:
-            self.rotate_cw(cwRotation)
-        else:
-            self.rotate_ccw(ccwRotation)
+        planner = self.heading_planner()
+        planner.turn_to(degrees)
+        self.fly_heading_plan(planner)
 
     def newHome(self):
         """
         Sets new home coords for the drone.
         """
-        self.homeX, self.homeY, self.homeZ = self.currentX, self.currentY, Utility.get_Height(self.drone, self.useBar)
+        self.homeX, self.homeY, self.homeZ = self.currentX, self.currentY, self.get_height()
+        self.geofence.recenter(self.homeX, self.homeY)
 
-    def fly_to_coordinates(self, x, y, direct_flight=False):
+    def fly_to_coordinates(self, x, y, direct_flight=False, sideways=False):
         """
-        Fly the drone to a specific coordinate and decide if you want direct flight.
+        Fly the drone to a specific coordinate and decide if you want direct
+        flight. sideways lets direct flight skip the turn when it is quicker.
         """
         if direct_flight:
-            self.go_to_point_rotation(x, y)
+            self.go_to_point_rotation(x, y, sideways)
         else:
             self.goToPosition(x, y)
 
+    def plan_waypoints(self, waypoints, **options):
+        """
+        Compiles (x, y, z) waypoints into the fewest 'go' and 'curve' commands
+        from the drone's current position, without sending anything. See
+        mission_compiler.compile_mission() for the options.
+        """
+        start = (self.currentX, self.currentY, self.get_height())
+        plan = compile_mission(waypoints, start, self.currentRotation, **options)
+        self.logger.info(f"Mission plan: {plan.summary()}")
+        for waypoint in plan.skipped:
+            self.logger.warning(f"Skipping waypoint {waypoint}, it is less than 20 cm away.")
+        return plan
+
+    def check_plan(self, plan):
+        """
+        Checks a compiled mission plan against the geofence, sampling along
+        every leg. Returns True if the whole trajectory stays inside.
+        """
+        check = self.geofence.check_plan(plan)
+        if not check.ok:
+            first = check.violations[0].round().astype(int).tolist()
+            self.logger.error(f"Mission leaves the geofence at {first}: "
+                              f"{len(check.violations)} of {check.samples} sampled points, "
+                              f"commands {check.commands.tolist()}")
+        return check.ok
+
+    def fly_plan(self, plan):
+        """
+        Sends the commands of a compiled mission plan in order and keeps the
+        drone's position up to date after each one. Nothing is sent if any
+        part of the plan leaves the geofence. Returns True if it was flown.
+        """
+        if not self.check_plan(plan):
+            return False
+        for command in plan:
+            self.logger.info(f"Flying {command.kind} to {command.end}: {command.text}")
+            self.pose_estimator.begin_motion()
+            self.drone.send_control_command(command.text)
+            self.telemetry.invalidate()
+            self.pose_estimator.end_motion(command.end[0] - command.start[0],
+                                           command.end[1] - command.start[1])
+        return True
+
+    def fly_waypoints(self, waypoints, **options):
+        """ Compiles and flies a list of (x, y, z) waypoints. """
+        plan = self.plan_waypoints(waypoints, **options)
+        self.fly_plan(plan)
+        return plan
+
     def tether_distance(self, direction, newX, newY):
         """
-        Checks if the drone is within the tether distance.
+        Checks if the drone stays inside the geofence after a horizontal move.
         """
-        self.logger.info(f"Checking if {newX} and {newY} are within boundaries.")
-        directions = {'forward', 'backward', 'left', 'right'}
+        directions = {'forward', 'back', 'left', 'right'}
         if not direction in directions:
             self.logger.info(f"No direction given.")
             return False
-        else:
-            if (self.tether == None):
-                self.logger.info(f"No Tether Distance")
-                return True
-            elif Utility.isInTether(self.homeX, self.homeY, self.tether, newX, newY):
-                self.logger.info(f"{newX} and {newY} are within radius of {self.tether}.")
-                return True
-            else:
-                self.logger.info(f"{newX} and {newY} are not within a radius of {self.tether}.")
-                return False
+        if self.geofence.contains_point(newX, newY):
+            return True
+        self.logger.warning(f"{newX} and {newY} are outside the geofence.")
+        return False
+
+    def get_height(self, max_age=None, query=True):
+        """
+        Returns the drone's height in cm from the telemetry cache, using the
+        barometer relative to takeoff when useBar is set. With query=False a
+        stale cache returns None instead of asking the drone.
+        """
+        # A held move has to be flown before the height means anything
+        self.optimizer.flush()
+        if not self.useBar:
+            return self.telemetry.get_height(False, 0, max_age, query)
+        baseline = self.ground_barometer(query)
+        if baseline is None:
+            return None
+        return self.telemetry.get_height(True, baseline, max_age, query)
+
+    def get_barometer(self, max_age=None, query=True):
+        """ Returns the drone's barometer reading in cm from the telemetry cache. """
+        return self.telemetry.get_barometer(max_age, query)
+
+    def get_battery(self, max_age=None, query=True):
+        """ Returns the drone's battery level as a percent from the telemetry cache. """
+        return self.telemetry.get_battery(max_age, query)
+
+    def get_temperature(self, max_age=None, query=True):
+        """ Returns the drone's internal temperature from the telemetry cache. """
+        return self.telemetry.get_temperature(max_age, query)
+
+    def instrument(self, metrics):
+        """
+        Times this drone's SDK commands, telemetry reads and queries, log
+        calls and log writes, and the camera's frame steps in a
+        Util.Metrics.Metrics object, labelled with the drone's name. The
+        Utility functions, which every drone shares, are timed as well.
+        """
+        self.metrics = metrics
+        # The camera modules only get the Tello object
+        self.drone.metrics = metrics
+        drone = self.name or "tello"
+        kinds = {}
+
+        def observe_command(command, response, sent, latency):
+            kind = command_kind(command)
+            histogram = kinds.get(kind)
+            if histogram is None:
+                histogram = kinds[kind] = metrics.histogram(
+                    "command_seconds", "SDK command round trips", drone=drone, kind=kind)
+            histogram.observe(latency)
+
+        self.channel.add_listener(observe_command)
+        for call in ('read', 'query'):
+            metrics.wrap(self.telemetry, call, "telemetry_seconds",
+                         "Telemetry cache reads and state queries", drone=drone, call=call)
+        for level in ('debug', 'info', 'warning', 'error', 'critical'):
+            metrics.wrap(self.logger, level, "log_call_seconds",
+                         "Time the caller spends in a log call", drone=drone, level=level)
+        for name, handler in zip(('file', 'console'), self.logger.handlers):
+            metrics.wrap(handler, 'handle', "log_write_seconds",
+                         "Log writes on the listener thread", drone=drone, handler=name)
+        Utility.instrument(metrics)
 
     def idle(self):
         """
@@ -343,19 +755,170 @@ class HeadsUpTello():
         """
         self.drone.turn_motor_on()
 
+    # The top LED methods return right away; the Util.TopLed timer sends the
+    # colors whenever no flight command is in flight. Pass append=True to
+    # play an effect after the ones already queued.
+
+    def top_led_color(self, red, green, blue):
+        """ Turns the top LED to a color, replacing any effect that is playing. """
+        return self.top_led.set(red, green, blue)
+
+    def top_led_off(self):
+        return self.top_led.off()
+
+    def fade_top_led(self, color, duration, start=None, append=False):
+        """ Fades the top LED from start, or its current color, to color. """
+        return self.top_led.fade(color, duration, start, append)
+
+    def blink_top_led(self, color, period=1.0, count=None, append=False):
+        """ Blinks the top LED count times, or until the next effect. """
+        return self.top_led.blink(color, period, count, append=append)
+
+    def pulse_top_led(self, color, period=2.0, count=None, append=False):
+        """ Breathes the top LED up to color and back down every period seconds. """
+        return self.top_led.pulse(color, period, count, append)
+
+    def matrix_pattern(self, flattened_pattern, color='b'):
+        """
+        Shows a dji_matrix pattern, or a Util.LedMatrix.MatrixFrame, on the
+        LED matrix. Stops any animation that is playing.
+        """
+        self.matrix_sequencer.stop()
+        self.matrix.show(flattened_pattern, color)
+
+    def matrix_off(self):
+        """ Turns the LED matrix off. Stops any animation that is playing. """
+        self.matrix_sequencer.stop()
+        self.matrix.off()
+
+    def play_matrix(self, frames, rate=5, loop=False):
+        """
+        Plays a list of MatrixFrames (see Util.LedMatrix.countdown() and
+        scroll_digits()) on the LED matrix in the background. Returns the
+        MatrixSequencer; call its wait() or stop().
+        """
+        return self.matrix_sequencer.play(frames, rate, loop)
+
     def take_photo(self):
         """
-        Takes a photo using the Tello camera
+        Takes a photo using the Tello camera. This counts down and waits for
+        the photo's window to close; use snapshot() during a flight.
         """
-        thread = threading.Thread(target=Camera.Photo.take_photo, args=(self.drone))
-        thread.start()
-        thread.join()
+        import Camera.Photo
+        self.optimizer.flush()
+        return Camera.Photo.take_photo(self.drone)
 
-    def take_video(self):
+    def take_video(self, duration=10):
         """
-        Takes a video using the Tello camera
+        Takes a video using the Tello camera. Returns right away; the video
+        records while the drone flies, see start_recording().
+        """
+        return self.start_recording(duration=duration)
+
+    def start_recording(self, path='drone_capture.avi', fps=30, duration=None, **options):
         """
-        thread = threading.Thread(target=Camera.Photo.record, args=(self.drone, 30))
-        thread.start()
-        thread.join()
+        Starts recording a movie in the background and returns the
+        Camera.Recorder.RecordingPipeline that records it, which is also the
+        handle to pass to stop_recording(). Flight commands carry on while it
+        records. Recordings that are still running when the drone lands or
+        disconnects are stopped and their files finished.
+
+        Arguments
+            path:     Movie file to write
+            fps:      Frame rate of the movie
+            duration: Seconds to record, or None to record until stopped
+            options:  More RecordingPipeline arguments (size, drop, encoder...)
+        """
+        import Camera.Photo
+        from Camera.Recorder import RecordingPipeline
+        options.setdefault('metrics', self.metrics)
+        recording = RecordingPipeline(Camera.Photo.frame_ring(self.drone), path, fps, duration,
+                                      **options).start()
+        self.recordings.append(recording)
+        self.logger.info(f"Recording video to {path}")
+        return recording
+
+    def stop_recording(self, recording=None, timeout=None):
+        """
+        Stops a recording, or every recording if none is given, and waits
+        until the movie files are written. Returns True if they all finished.
+        """
+        recordings = list(self.recordings) if recording is None else [recording]
+        for each in recordings:
+            each.stop()
+        finished = True
+        for each in recordings:
+            finished = each.join(timeout) and finished
+            if each.error is not None:
+                self.logger.error(f"Recording {each.path} failed: {each.error}")
+            self.logger.info(f"Recorded {each.path}: {each.encode_stats}")
+        self.recordings = [each for each in self.recordings if each.running]
+        return finished
+
+    def snapshot(self, path=None, stamp=True):
+        """
+        Grabs the next video frame in the background. Returns a Future whose
+        result() is the BGR image, also saved to path if one is given.
+        """
+        # Turning the stream on is an SDK command, so it has to happen here
+        # and not on the camera thread while another command is in flight
+        import Camera.Photo
+        self.optimizer.flush()
+        Camera.Photo.frame_ring(self.drone)
+        if self.camera_executor is None:
+            self.camera_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tello-camera")
+        future = self.camera_executor.submit(Camera.Photo.snapshot, self.drone, path, stamp)
+        self.snapshots = [each for each in self.snapshots if not each.done()] + [future]
+        return future
+
+    def start_vision(self, **options):
+        """
+        Starts finding ArUco markers in the video in the background and
+        returns the Camera.Vision.VisionStage. The newest Detections are in
+        self.detections; see find_marker().
+
+        Arguments
+            options: VisionStage arguments (workers, scale, dictionary...)
+        """
+        if self.vision is None:
+            import Camera.Photo
+            from Camera.Vision import VisionStage
+            options.setdefault('metrics', self.metrics)
+            self.vision = VisionStage(Camera.Photo.frame_ring(self.drone), **options)
+            self.vision.add_listener(self.on_detections)
+            self.vision.start()
+            self.logger.info("Looking for markers in the video")
+        return self.vision
+
+    def on_detections(self, detections):
+        """ VisionStage listener, called from a vision worker thread. """
+        self.detections = detections
+
+    def find_marker(self, marker_id=None, max_age=0.5):
+        """
+        Returns the Marker with marker_id, or the first marker, in the newest
+        detections if their frame is at most max_age seconds old; else None.
+        """
+        detections = self.detections
+        if detections is None or time.monotonic() - detections.arrived > max_age:
+            return None
+        for marker in detections.markers:
+            if marker_id is None or marker.id == marker_id:
+                return marker
+        return None
+
+    def stop_vision(self):
+        """ Stops looking for markers. """
+        if self.vision is not None:
+            self.vision.stop()
+            self.logger.info(f"Marker detection: {self.vision.report()}")
+            self.vision = None
+
+    def finish_camera(self, timeout=None):
+        """ Stops every recording and waits for the snapshots still being taken. """
+        if self.recordings:
+            self.stop_recording(timeout=timeout)
+        if self.snapshots:
+            wait(self.snapshots, timeout)
+            self.snapshots = []
 # ------------------------- END OF HeadsUpTello CLASS ---------------------------
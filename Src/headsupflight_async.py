@@ -0,0 +1,251 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+
+
+# ---------------------- BEGIN AsyncHeadsUpTello CLASS --------------------------
+
+class AsyncHeadsUpTello():
+    """
+    An asyncio front end for a HeadsUpTello object. Every SDK command is put on
+    one ordered queue and sent by a single worker thread, so the drone still
+    sees one command at a time, but the event loop is free while a command is
+    in flight. Command methods return an asyncio Future right away: await it to
+    wait for the drone's answer, or queue several commands and await the last.
+
+        async with AsyncHeadsUpTello(HeadsUpTello(Tello(), 20)) as drone:
+            await drone.takeoff()
+            drone.move_forward(100)
+            drone.top_led_color(0, 255, 0)
+            await drone.move_left(100)
+            print(await drone.get_height())
+            await drone.land()
+
+    Cancelling a queued command's Future removes it from the queue. A command
+    that is already in flight can't be called back from the drone; cancelling
+    it only stops anyone from waiting on the answer.
+    """
+
+    def __init__(self, drone, cancel_on_error=True):
+        """
+        Arguments
+            drone:           A connected HeadsUpTello object
+            cancel_on_error: Cancel every queued command when one fails, since
+                             the moves after it were planned from a position
+                             the drone never reached
+        """
+        self.drone = drone
+        self.cancel_on_error = cancel_on_error
+        self.queue = None
+        self.pending = []
+        self.current = None
+        self.worker = None
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tello-commands")
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def start(self):
+        """ Starts the command worker on the running event loop. """
+        if self.worker is None:
+            self.queue = asyncio.Queue()
+            self.worker = asyncio.get_running_loop().create_task(self.run_commands())
+
+    async def close(self):
+        """ Waits for the queued commands to finish and stops the worker. """
+        if self.worker is None:
+            return
+        await self.drain()
+        self.worker.cancel()
+        try:
+            await self.worker
+        except asyncio.CancelledError:
+            pass
+        self.worker = None
+        self.executor.shutdown(wait=True)
+
+    async def drain(self):
+        """ Waits until every queued command has been answered or cancelled. """
+        if self.queue is not None:
+            await self.queue.join()
+
+    def submit(self, function, *args, **kwargs):
+        """
+        Queues a blocking call that talks to the drone and returns a Future
+        for its result. Calls run one at a time in the order they were queued.
+        """
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append(future)
+        self.queue.put_nowait((future, functools.partial(function, *args, **kwargs)))
+        return future
+
+    def cancel_pending(self):
+        """ Cancels every command that has not been sent yet. Returns how many. """
+        cancelled = 0
+        for future in self.pending:
+            if future is not self.current and future.cancel():
+                cancelled += 1
+        self.pending = [self.current] if self.current is not None else []
+        return cancelled
+
+    async def run_commands(self):
+        """ Worker task: sends queued commands one after another. """
+        loop = asyncio.get_running_loop()
+        while True:
+            future, call = await self.queue.get()
+            try:
+                if future.cancelled():
+                    continue
+                self.current = future
+                try:
+                    result = await loop.run_in_executor(self.executor, call)
+                except Exception as excp:
+                    if not future.done():
+                        future.set_exception(excp)
+                    if self.cancel_on_error:
+                        self.drone.logger.error(f"Cancelling queued commands after: {excp}")
+                        self.cancel_pending()
+                else:
+                    if not future.done():
+                        future.set_result(result)
+            finally:
+                if future in self.pending:
+                    self.pending.remove(future)
+                self.current = None
+                self.queue.task_done()
+
+    # ------------------------- Movement commands ----------------------------
+
+    def takeoff(self):
+        return self.submit(self.drone.takeoff)
+
+    def land(self):
+        return self.submit(self.drone.land)
+
+    def move_up(self, amount):
+        return self.submit(self.drone.move_up, amount)
+
+    def move_down(self, amount):
+        return self.submit(self.drone.move_down, amount)
+
+    def move_left(self, amount):
+        return self.submit(self.drone.move_left, amount)
+
+    def move_right(self, amount):
+        return self.submit(self.drone.move_right, amount)
+
+    def move_forward(self, amount):
+        return self.submit(self.drone.move_forward, amount)
+
+    def move_back(self, amount):
+        return self.submit(self.drone.move_back, amount)
+
+    def rotate_cw(self, degrees):
+        return self.submit(self.drone.rotate_cw, degrees)
+
+    def rotate_ccw(self, degrees):
+        return self.submit(self.drone.rotate_ccw, degrees)
+
+    def fly_to_coordinates(self, x, y, direct_flight=False, sideways=False):
+        return self.submit(self.drone.fly_to_coordinates, x, y, direct_flight, sideways)
+
+    def goHome(self, directFlight=False, sideways=False):
+        return self.submit(self.drone.goHome, directFlight, sideways)
+
+    def emergency(self):
+        """
+        Cancels everything that is queued and stops the motors right away. The
+        drone does not answer 'emergency', so it skips the queue.
+        """
+        self.cancel_pending()
+        self.drone.drone.emergency()
+
+    # ----------------------------- LED commands -----------------------------
+
+    # The top LED goes through the drone's Util.TopLed, so a color set here
+    # replaces the effect that is playing instead of being painted over by it.
+    # Queued so that a color or effect starts after the moves before it.
+
+    def top_led_color(self, red, green, blue):
+        return self.submit(self.drone.top_led_color, red, green, blue)
+
+    def top_led_off(self):
+        return self.submit(self.drone.top_led_off)
+
+    def fade_top_led(self, color, duration, start=None, append=False):
+        return self.submit(self.drone.fade_top_led, color, duration, start, append)
+
+    def blink_top_led(self, color, period=1.0, count=None, append=False):
+        return self.submit(self.drone.blink_top_led, color, period, count, append)
+
+    def pulse_top_led(self, color, period=2.0, count=None, append=False):
+        return self.submit(self.drone.pulse_top_led, color, period, count, append)
+
+    def matrix_pattern(self, flattened_pattern, color='b'):
+        return self.submit(self.drone.matrix_pattern, flattened_pattern, color)
+
+    def matrix_off(self):
+        return self.submit(self.drone.matrix_off)
+
+    def play_matrix(self, frames, rate=5, loop=False):
+        return self.submit(self.drone.play_matrix, frames, rate, loop)
+
+    # -------------------------------- Camera --------------------------------
+
+    def start_recording(self, path='drone_capture.avi', fps=30, duration=None, **options):
+        """ Queued because the first recording turns the video stream on. """
+        return self.submit(self.drone.start_recording, path, fps, duration, **options)
+
+    def stop_recording(self, recording=None):
+        return self.submit(self.drone.stop_recording, recording)
+
+    def start_vision(self, **options):
+        """ Queued because it may turn the video stream on. """
+        return self.submit(self.drone.start_vision, **options)
+
+    def find_marker(self, marker_id=None, max_age=0.5):
+        """ Reads the newest detections; nothing is sent to the drone. """
+        return self.drone.find_marker(marker_id, max_age)
+
+    def start_visual_odometry(self, **options):
+        """ Queued because it may turn the video stream on. """
+        return self.submit(self.drone.start_visual_odometry, **options)
+
+    async def snapshot(self, path=None, stamp=True):
+        """ Returns the next video frame as a BGR image. """
+        future = await self.submit(self.drone.snapshot, path, stamp)
+        return await asyncio.wrap_future(future)
+
+    # ------------------------------- Telemetry ------------------------------
+
+    async def read(self, getter):
+        """
+        Reads a telemetry value from the cache without waiting for the command
+        queue. Only when the cache is stale is a query queued behind the
+        commands already in flight, because the drone's answers are matched to
+        commands in the order they were sent.
+        """
+        value = await asyncio.to_thread(getter, query=False)
+        if value is None:
+            value = await self.submit(getter)
+        return value
+
+    async def get_height(self):
+        return await self.read(self.drone.get_height)
+
+    async def get_barometer(self):
+        return await self.read(self.drone.get_barometer)
+
+    async def get_battery(self):
+        return await self.read(self.drone.get_battery)
+
+    async def get_temperature(self):
+        return await self.read(self.drone.get_temperature)
+
+# ---------------------- END OF AsyncHeadsUpTello CLASS -------------------------
@@ -0,0 +1,418 @@
+import math
+from collections import namedtuple
+
+
+# SDK limits for the 'go' and 'curve' commands.
+MIN_MOVE = 20
+MAX_MOVE = 500
+MIN_RADIUS = 50
+MAX_RADIUS = 1000
+GO_SPEEDS = (10, 100)
+CURVE_SPEEDS = (10, 60)
+MIN_TURN = 1
+
+# One SDK command of a compiled mission. start, via and end are (x, y, z)
+# positions in the HeadsUpTello frame (x forward, y left, z up, in cm); via is
+# None for a straight 'go'. duration includes the hover after the command.
+PlannedCommand = namedtuple("PlannedCommand", "text kind start via end speed duration")
+
+# What plan_altitude() decided: the SDK command to send, or None, the height
+# in cm the drone is predicted to end at and the clamped height it aimed for.
+AltitudeStep = namedtuple("AltitudeStep", "command height target")
+
+# One command of a HeadingPlanner: direction is the SDK word ('cw', 'ccw',
+# 'forward', 'back', 'left' or 'right'), amount is in degrees or cm, heading
+# is where the drone faces afterwards and duration includes the hover.
+HeadingStep = namedtuple("HeadingStep", "direction amount heading duration")
+
+
+class MissionPlan:
+    """
+    The result of compile_mission(): the SDK commands to send, in order, plus
+    the predictions we can make before anything is sent to the drone.
+    """
+
+    def __init__(self, commands, waypoints, skipped, legacy_commands, legacy_time):
+        self.commands = commands
+        self.waypoints = waypoints
+        self.skipped = skipped
+        self.legacy_commands = legacy_commands
+        self.legacy_time = legacy_time
+
+    @property
+    def command_count(self):
+        return len(self.commands)
+
+    @property
+    def predicted_time(self):
+        """ Predicted seconds of flight, including the hover after each command. """
+        return sum(command.duration for command in self.commands)
+
+    @property
+    def end(self):
+        return self.commands[-1].end if self.commands else None
+
+    def summary(self):
+        """ One line that compares the plan with axis-by-axis moves. """
+        return (f"{self.command_count} commands, {self.predicted_time:.1f}s predicted "
+                f"(axis-by-axis: {self.legacy_commands} commands, {self.legacy_time:.1f}s)")
+
+    def __iter__(self):
+        return iter(self.commands)
+
+
+def to_body(delta, heading):
+    """
+    Turns an (x, y, z) offset in the HeadsUpTello frame into the drone's body
+    frame for a drone facing heading degrees clockwise from the x axis.
+    """
+    dx, dy, dz = delta
+    theta = math.radians(heading)
+    forward = dx * math.cos(theta) - dy * math.sin(theta)
+    left = dx * math.sin(theta) + dy * math.cos(theta)
+    return forward, left, dz
+
+
+def to_world(delta, heading):
+    """ The inverse of to_body(). """
+    forward, left, dz = delta
+    theta = math.radians(heading)
+    dx = forward * math.cos(theta) + left * math.sin(theta)
+    dy = -forward * math.sin(theta) + left * math.cos(theta)
+    return dx, dy, dz
+
+
+def bearing(dx, dy):
+    """
+    The heading, in degrees clockwise from the x axis (0-360), that a drone
+    has to face to fly the HeadsUpTello frame offset (dx, dy) forwards.
+    """
+    return math.degrees(math.atan2(-dy, dx)) % 360
+
+
+def shortest_turn(heading, target):
+    """
+    The signed turn in degrees (-180 to 180, clockwise positive) that takes
+    a drone facing heading to facing target.
+    """
+    return (target - heading + 180) % 360 - 180
+
+
+def is_reachable(offset):
+    """ The SDK rejects offsets where every axis is within 20 cm. """
+    return any(abs(value) >= MIN_MOVE for value in offset)
+
+
+def arc_radius(p1, p2):
+    """
+    Returns the radius of the circle through the origin, p1 and p2, or
+    infinity if the three points are on a line.
+    """
+    a, b = math.dist((0, 0, 0), p1), math.dist((0, 0, 0), p2)
+    c = math.dist(p1, p2)
+    cross = (p1[1] * p2[2] - p1[2] * p2[1],
+             p1[2] * p2[0] - p1[0] * p2[2],
+             p1[0] * p2[1] - p1[1] * p2[0])
+    area2 = math.dist((0, 0, 0), cross)
+    if area2 < 1e-9:
+        return math.inf
+    return a * b * c / (2 * area2)
+
+
+def arc_length(p1, p2):
+    """ Length of the arc from the origin through p1 to p2. """
+    radius = arc_radius(p1, p2)
+    u = [-v for v in p1]
+    w = [b - a for a, b in zip(p1, p2)]
+    cosine = sum(i * j for i, j in zip(u, w)) / (math.dist((0, 0, 0), u) * math.dist((0, 0, 0), w))
+    angle_at_p1 = math.acos(min(max(cosine, -1.0), 1.0))
+    return radius * (2 * math.pi - 2 * angle_at_p1)
+
+
+def can_curve(p1, p2):
+    """ True if 'curve' can fly from the origin through p1 to p2. """
+    if not all(abs(value) <= MAX_MOVE for value in p1 + p2):
+        return False
+    if not is_reachable(p1) or not is_reachable(p2):
+        return False
+    return MIN_RADIUS <= arc_radius(p1, p2) <= MAX_RADIUS
+
+
+def go_pieces(offset):
+    """ Number of equal 'go' commands needed to fly a straight offset. """
+    return max(math.ceil(max(abs(value) for value in offset) / MAX_MOVE), 1)
+
+
+def legacy_moves(distance):
+    """
+    Number of commands HeadsUpTello.move() sends for one axis: it halves
+    anything over 500 cm, and move_up/move_down detour for less than 20 cm.
+    """
+    distance = abs(distance)
+    if distance == 0:
+        return 0
+    if distance < MIN_MOVE:
+        return 2
+    count = 1
+    while distance > MAX_MOVE:
+        distance /= 2
+        count += 1
+    return count
+
+
+def plan_altitude(height, change, floor=None, ceiling=None, forward=0, left=0, speed=100):
+    """
+    Vertical envelope controller: works out from one height reading where a
+    climb of change cm (negative to descend) should end, kept between floor
+    and ceiling, and the one command that flies there. Nothing needs to be
+    read again afterwards; the returned height is the prediction.
+
+    The drone can't fly less than 20 cm, so a smaller change is left out.
+    Outside the envelope that would leave the drone where it must not be,
+    so it moves 20 cm back in instead if that doesn't cross the other side.
+    One command flies at most 500 cm.
+
+    Arguments
+        height:        Current height in cm
+        change:        cm to climb, or to descend if negative
+        floor:         Lowest allowed height in cm, or None
+        ceiling:       Highest allowed height in cm, or None
+        forward, left: A body frame offset in cm to fly in the same 'go'
+                       command, which then also carries the height change
+        speed:         'go' speed in cm/s (10-100)
+    """
+    def inside(z):
+        return (floor is None or z >= floor) and (ceiling is None or z <= ceiling)
+
+    target = height + change
+    if ceiling is not None:
+        target = min(target, ceiling)
+    if floor is not None:
+        target = max(target, floor)
+    dz = max(min(round(target - height), MAX_MOVE), -MAX_MOVE)
+
+    offset = (round(forward), round(left), dz)
+    if offset[0] or offset[1]:
+        # The horizontal part makes 'go' legal however small dz is
+        if not is_reachable(offset):
+            return AltitudeStep(None, height, target)
+        speed = min(max(int(speed), GO_SPEEDS[0]), GO_SPEEDS[1])
+        return AltitudeStep(f"go {offset[0]} {offset[1]} {dz} {speed}", height + dz, target)
+
+    if abs(dz) < MIN_MOVE:
+        step = MIN_MOVE if dz > 0 else -MIN_MOVE
+        dz = step if dz and not inside(height) and inside(height + step) else 0
+    if dz == 0:
+        return AltitudeStep(None, height, target)
+    command = f"up {dz}" if dz > 0 else f"down {-dz}"
+    return AltitudeStep(command, height + dz, target)
+
+
+# ------------------------ BEGIN HeadingPlanner CLASS ---------------------------
+
+class HeadingPlanner:
+    """
+    Plans turns and horizontal legs from the drone's absolute heading, so
+    every turn is the shortest way round from where the drone really faces
+    instead of a fixed angle from wherever the last turn left it.
+
+    Turns are held back until a move needs them, so consecutive turns are
+    flown as one 'cw' or 'ccw' command, and a total turn of less than
+    threshold degrees is left out. With sideways=True a leg may also be
+    flown without turning, as forward/back and left/right moves, whenever
+    that is predicted to take less time than turning to face it.
+
+        planner = HeadingPlanner(drone.currentRotation, sideways=True)
+        planner.turn_to(90)
+        planner.fly(100, -50)
+        for step in planner: ...
+    """
+
+    def __init__(self, heading=0, threshold=5, sideways=False, speed=100, yaw_rate=90, settle=0.5):
+        """
+        Arguments
+            heading:   Degrees clockwise that the drone is turned from the x axis
+            threshold: Smallest turn in degrees worth flying
+            sideways:  Fly a leg without turning when that is quicker
+            speed:     Speed of plain moves in cm/s, to predict their time
+            yaw_rate:  Degrees per second the drone turns at
+            settle:    Seconds the drone hovers after each command
+        """
+        self.heading = heading % 360
+        self.target = self.heading
+        self.threshold = max(threshold, MIN_TURN)
+        self.sideways = sideways
+        self.speed = speed
+        self.yaw_rate = yaw_rate
+        self.settle = settle
+        self.steps = []
+
+    @property
+    def predicted_time(self):
+        """ Predicted seconds of flight, including the hover after each command. """
+        return sum(step.duration for step in self.steps)
+
+    def turn(self, degrees):
+        """ Turns degrees further, clockwise if positive. """
+        self.target = (self.target + degrees) % 360
+
+    def turn_to(self, heading):
+        """ Turns to face heading, the shortest way round. """
+        self.target = heading % 360
+
+    def turn_time(self, turn):
+        return abs(turn) / self.yaw_rate + self.settle if abs(turn) >= self.threshold else 0.0
+
+    def move_time(self, forward, left):
+        """ Seconds HeadsUpTello takes to move forward and left cm, see legacy_moves(). """
+        return sum(abs(v) / self.speed + legacy_moves(v) * self.settle
+                   for v in (forward, left) if abs(v) >= MIN_MOVE)
+
+    def flush(self):
+        """ Adds the turns held back so far as one command, if it is big enough. """
+        turn = round(shortest_turn(self.heading, self.target))
+        if abs(turn) >= self.threshold:
+            self.heading = (self.heading + turn) % 360
+            self.steps.append(HeadingStep("cw" if turn > 0 else "ccw", abs(turn), self.heading,
+                                          self.turn_time(turn)))
+        self.target = self.heading
+
+    def fly(self, dx, dy):
+        """
+        Flies the HeadsUpTello frame offset (dx, dy) in cm. A turn held back
+        is merged with the turn that faces the leg, or flown first when the
+        leg goes sideways. Returns the (dx, dy) that will really be flown,
+        which leaves out parts shorter than 20 cm.
+        """
+        distance = round(math.hypot(dx, dy))
+        if distance < MIN_MOVE:
+            return 0.0, 0.0
+        facing = bearing(dx, dy)
+        face_time = self.turn_time(shortest_turn(self.heading, facing)) + self.move_time(distance, 0)
+        forward, left, _ = [round(v) for v in to_body((dx, dy, 0), self.target)]
+        forward = forward if abs(forward) >= MIN_MOVE else 0
+        left = left if abs(left) >= MIN_MOVE else 0
+        side_time = (self.turn_time(shortest_turn(self.heading, self.target))
+                     + self.move_time(forward, left))
+        if not self.sideways or face_time < side_time:
+            self.target = facing
+            forward, left = distance, 0
+        self.flush()
+        for direction, amount in (("left" if left > 0 else "right", left),
+                                  ("forward" if forward > 0 else "back", forward)):
+            if amount:
+                self.steps.append(HeadingStep(direction, abs(amount), self.heading,
+                                              self.move_time(amount, 0)))
+        moved = to_world((forward, left, 0), self.heading)
+        return moved[0], moved[1]
+
+    def __iter__(self):
+        self.flush()
+        return iter(self.steps)
+
+# ------------------------ END OF HeadingPlanner CLASS --------------------------
+
+
+def compile_mission(waypoints, start=(0, 0, 0), heading=0, speed=100, curve_speed=60,
+                    allow_curves=True, settle=0.5, move_speed=100):
+    """
+    Compiles a list of (x, y, z) waypoints into the fewest 'go' and 'curve'
+    commands that visit them in order. Coordinates are in cm in the
+    HeadsUpTello frame; the drone keeps facing heading the whole time.
+
+    A waypoint closer than 20 cm on every axis can't be flown to on its own,
+    so it is skipped and the next leg starts from where the drone really is.
+
+    Arguments
+        waypoints:    List of (x, y, z) or (x, y) positions; 2D waypoints keep
+                      the previous height
+        start:        (x, y, z) position of the drone
+        heading:      Degrees clockwise that the drone is turned from the x axis
+        speed:        'go' speed in cm/s (10-100)
+        curve_speed:  'curve' speed in cm/s (10-60)
+        allow_curves: Fly two waypoints with one 'curve' where possible
+        settle:       Seconds the drone hovers after each command
+        move_speed:   Speed of plain moves, used to predict axis-by-axis time
+    """
+    speed = min(max(int(speed), GO_SPEEDS[0]), GO_SPEEDS[1])
+    curve_speed = min(max(int(curve_speed), CURVE_SPEEDS[0]), CURVE_SPEEDS[1])
+
+    # Body frame offsets are rounded to whole cm, so we track where the drone
+    # will actually be and drop the waypoints it can't be sent to.
+    points = [tuple(float(v) for v in start)]
+    kept, skipped = [], []
+    for waypoint in waypoints:
+        if len(waypoint) == 2:
+            waypoint = (waypoint[0], waypoint[1], points[-1][2])
+        offset = [round(v) for v in to_body([b - a for a, b in zip(points[-1], waypoint)], heading)]
+        if not is_reachable(offset):
+            skipped.append(tuple(waypoint))
+            continue
+        moved = to_world(offset, heading)
+        points.append(tuple(a + d for a, d in zip(points[-1], moved)))
+        kept.append(tuple(waypoint))
+
+    def body(i, j):
+        return tuple(round(v) for v in to_body([b - a for a, b in zip(points[i], points[j])], heading))
+
+    def go_cost(i):
+        offset = body(i, i + 1)
+        pieces = go_pieces(offset)
+        return pieces, math.dist((0, 0, 0), offset) / speed + pieces * settle
+
+    # best[i] is (commands, seconds) to fly from point i to the last point,
+    # choice[i] is how many points the first command of that plan covers. A
+    # curve has to beat the two straight legs it replaces on time as well,
+    # since curves fly slower than 'go'.
+    last = len(points) - 1
+    best = [(0, 0.0)] * (last + 1)
+    choice = [1] * (last + 1)
+    for i in range(last - 1, -1, -1):
+        pieces, seconds = go_cost(i)
+        best[i] = (pieces + best[i + 1][0], seconds + best[i + 1][1])
+        if allow_curves and i + 2 <= last:
+            p1, p2 = body(i, i + 1), body(i, i + 2)
+            if can_curve(p1, p2):
+                seconds = arc_length(p1, p2) / curve_speed + settle
+                straight = go_cost(i)[1] + go_cost(i + 1)[1]
+                option = (1 + best[i + 2][0], seconds + best[i + 2][1])
+                if option < best[i] and seconds <= straight:
+                    best[i], choice[i] = option, 2
+
+    commands = []
+    i = 0
+    while i < last:
+        if choice[i] == 2:
+            p1, p2 = body(i, i + 1), body(i, i + 2)
+            text = f"curve {p1[0]} {p1[1]} {p1[2]} {p2[0]} {p2[1]} {p2[2]} {curve_speed}"
+            duration = arc_length(p1, p2) / curve_speed + settle
+            commands.append(PlannedCommand(text, "curve", points[i], points[i + 1], points[i + 2],
+                                           curve_speed, duration))
+            i += 2
+            continue
+        offset = body(i, i + 1)
+        pieces = go_pieces(offset)
+        position = points[i]
+        done = (0, 0, 0)
+        for piece in range(1, pieces + 1):
+            # Cumulative rounding keeps the pieces summing to the exact offset.
+            target = tuple(round(v * piece / pieces) for v in offset)
+            step = tuple(b - a for a, b in zip(done, target))
+            end = tuple(a + d for a, d in zip(position, to_world(step, heading)))
+            text = f"go {step[0]} {step[1]} {step[2]} {speed}"
+            duration = math.dist((0, 0, 0), step) / speed + settle
+            commands.append(PlannedCommand(text, "go", position, None, end, speed, duration))
+            position, done = end, target
+        i += 1
+
+    # What goToPosition() plus up/down moves would have cost for the same legs.
+    legacy_commands = 0
+    legacy_time = 0.0
+    for a, b in zip(points, points[1:]):
+        for axis in range(3):
+            moves = legacy_moves(b[axis] - a[axis])
+            legacy_commands += moves
+            if moves:
+                legacy_time += abs(b[axis] - a[axis]) / move_speed + moves * settle
+
+    return MissionPlan(commands, kept, skipped, legacy_commands, legacy_time)
@@ -0,0 +1,107 @@
+import threading
+import time
+
+
+class CommandChannel:
+    """
+    Serializes the SDK commands sent to one drone. djitellopy matches each
+    answer to whichever command is waiting for one, so two threads that send
+    at the same time can swap their answers. The channel wraps the Tello
+    object's send_command_with_return() in a lock, which makes every command
+    from every thread (flight, telemetry queries, LED effects) take turns.
+
+    Background traffic that must never hold up a flight command uses
+    try_send(), which gives up instead of waiting when the channel is busy.
+
+    The drone needs a short break between commands. djitellopy waits for
+    it, but sleeps for the time that already passed instead of the time
+    that is left, so the channel does the waiting itself: each command goes
+    out spacing seconds after the previous answer at the earliest.
+
+    How long to wait for an answer, and what to do when none comes, is up
+    to djitellopy unless a Util.CommandPolicy is attached.
+    """
+
+    def __init__(self, drone):
+        """
+        Arguments
+            drone: A djitellopy.Tello (or compatible) object
+        """
+        self.drone = drone
+        self.lock = threading.RLock()
+        self.active = 0
+        self.sent = 0
+        self.last_answer = 0.0
+        self.listeners = []
+        self.policy = None
+        self.spacing = getattr(drone, 'TIME_BTW_COMMANDS', 0.0)
+
+    @classmethod
+    def of(cls, drone):
+        """ Returns the drone's channel, installing one the first time. """
+        channel = getattr(drone, 'command_channel', None)
+        if channel is None:
+            channel = cls(drone).install()
+        return channel
+
+    def install(self):
+        """ Routes the drone's commands through this channel. Returns self. """
+        send = self.drone.send_command_with_return
+        # Switch off djitellopy's own wait, for this drone only
+        self.drone.TIME_BTW_COMMANDS = 0.0
+
+        def send_in_turn(command, *args, **kwargs):
+            with self.lock:
+                self.active += 1
+                response = None
+                gap = self.last_answer + self.spacing - time.monotonic()
+                if gap > 0:
+                    time.sleep(gap)
+                sent = time.monotonic()
+                try:
+                    if self.policy is not None:
+                        response = self.policy.send(send, command, *args, **kwargs)
+                    else:
+                        response = send(command, *args, **kwargs)
+                    return response
+                finally:
+                    self.active -= 1
+                    self.sent += 1
+                    self.last_answer = time.monotonic()
+                    for listener in self.listeners:
+                        listener(command, response, sent, self.last_answer - sent)
+
+        self.drone.send_command_with_return = send_in_turn
+        self.drone.command_channel = self
+        return self
+
+    def add_listener(self, listener):
+        """
+        Calls listener(command, response, sent, latency) after every command,
+        from the sending thread and while the channel is still locked.
+        response is None if sending raised.
+        """
+        self.listeners.append(listener)
+
+    @property
+    def busy(self):
+        """ True while a command is waiting for its answer. """
+        return self.active > 0
+
+    def idle_for(self):
+        """ Seconds since the last answer, or 0 while a command is in flight. """
+        return 0.0 if self.busy else time.monotonic() - self.last_answer
+
+    def try_send(self, command, idle=0.0):
+        """
+        Sends a control command only if the channel has been idle for idle
+        seconds and nobody else is sending. Returns True once the drone
+        accepted it and None if it wasn't sent; a command the drone refuses
+        raises like send_control_command().
+        """
+        if self.idle_for() < idle or not self.lock.acquire(blocking=False):
+            return None
+        try:
+            return self.drone.send_control_command(command)
+        finally:
+            self.lock.release()
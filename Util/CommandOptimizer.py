@@ -0,0 +1,283 @@
+import contextlib
+import math
+import threading
+
+
+# SDK limits for one plain move.
+MIN_MOVE = 20
+MAX_MOVE = 500
+
+# Direction words of the plain moves, by axis. The first word moves in the
+# positive direction.
+AXES = {'forward': ('x', 1), 'back': ('x', -1),
+        'left': ('y', 1), 'right': ('y', -1),
+        'up': ('z', 1), 'down': ('z', -1)}
+WORDS = {('x', 1): 'forward', ('x', -1): 'back',
+         ('y', 1): 'left', ('y', -1): 'right',
+         ('z', 1): 'up', ('z', -1): 'down'}
+
+
+def parse_move(command):
+    """ Returns (axis, signed cm) of a plain move like 'back 50', or None. """
+    words = command.split()
+    if len(words) != 2 or words[0] not in AXES:
+        return None
+    try:
+        distance = float(words[1])
+    except ValueError:
+        return None
+    axis, sign = AXES[words[0]]
+    return axis, sign * distance
+
+
+def split_move(axis, distance):
+    """
+    The fewest legal moves that fly distance cm along axis ('x', 'y' or
+    'z'), as SDK commands. More than 500 cm is split into equal moves. Less
+    than 20 cm can't be flown in one move, so it overshoots by 20 cm and
+    comes back. Nothing is returned for 0.
+    """
+    distance = round(distance)
+    if distance == 0:
+        return []
+    sign = 1 if distance > 0 else -1
+    length = abs(distance)
+    if length < MIN_MOVE:
+        return [f"{WORDS[axis, sign]} {length + MIN_MOVE}", f"{WORDS[axis, -sign]} {MIN_MOVE}"]
+    pieces = math.ceil(length / MAX_MOVE)
+    # Cumulative rounding keeps the pieces summing to the exact distance
+    cuts = [round(length * piece / pieces) for piece in range(pieces + 1)]
+    return [f"{WORDS[axis, sign]} {b - a}" for a, b in zip(cuts, cuts[1:])]
+
+
+def led_key(command):
+    """ 'EXT led' or 'EXT mled' for a command that sets one of the LEDs, else None. """
+    words = command.split()
+    if len(words) >= 2 and words[0] == 'EXT' and words[1] in ('led', 'mled'):
+        return f"{words[0]} {words[1]}"
+    return None
+
+
+# ------------------------ BEGIN CommandOptimizer CLASS -------------------------
+
+class CommandOptimizer:
+    """
+    A peephole optimizer for the control commands a mission sends. Inside
+    batch(), plain moves are held back instead of going out one at a time:
+
+      - back-to-back moves along one axis become one move, so 'forward 100'
+        'forward 100' is sent as 'forward 200';
+      - moves that cancel out ('left 50' 'right 50') aren't sent at all;
+      - the total is split into the fewest moves the 20-500 cm limits allow;
+      - an LED or LED matrix command that shows what is already showing is
+        left out.
+
+    Anything else flushes the held move first and is sent in order, so
+    queries, 'go', turns, takeoff and land are ordering barriers. Code that
+    needs the drone to really be where the moves put it, like a photo or a
+    height read, calls flush(). A held move that the drone refuses raises
+    from the command that flushed it. When the with block raises, the held
+    move is dropped instead of flown.
+
+    Only the thread that opened the batch is optimized; background traffic
+    like the LED effects passes straight through.
+
+        optimizer = CommandOptimizer.of(tello)
+        with optimizer.batch():
+            fly(drone)
+        print(optimizer.report())
+    """
+
+    def __init__(self, send, logger=None):
+        """
+        Arguments
+            send:   Function that sends one control command, like
+                    djitellopy.Tello.send_control_command()
+            logger: A Util.Log.Log for moves a failed batch dropped
+        """
+        self.send = send
+        self.logger = logger
+        self.lock = threading.RLock()
+        self.owner = None
+        self.depth = 0
+        self.held = None
+        self.held_commands = 0
+        self.leds = {}
+        self.listeners = []
+        self.received = 0
+        self.sent = 0
+        self.merged = 0
+        self.cancelled = 0
+        self.deduplicated = 0
+        self.dropped = 0
+
+    @classmethod
+    def of(cls, drone):
+        """ Returns the drone's optimizer, installing one the first time. """
+        optimizer = getattr(drone, 'command_optimizer', None)
+        if optimizer is None:
+            optimizer = cls(drone.send_control_command).install(drone)
+        return optimizer
+
+    def install(self, drone):
+        """
+        Routes the drone's control commands through this optimizer and makes
+        its read commands and unanswered commands flush it. Returns self.
+        """
+        send_control_command = drone.send_control_command
+        send_read_command = drone.send_read_command
+        send_command_without_return = drone.send_command_without_return
+
+        def send_optimized(command, *args, **kwargs):
+            if not self.batching:
+                # Someone else changed the LEDs
+                self.leds.pop(led_key(command), None)
+                return send_control_command(command, *args, **kwargs)
+            return self.submit(command, *args, **kwargs)
+
+        def read_in_order(command):
+            if self.batching:
+                self.flush()
+            return send_read_command(command)
+
+        def send_in_order(command):
+            if self.batching:
+                if command == 'emergency':
+                    self.held = None
+                else:
+                    self.flush()
+            return send_command_without_return(command)
+
+        drone.send_control_command = send_optimized
+        drone.send_read_command = read_in_order
+        drone.send_command_without_return = send_in_order
+        drone.command_optimizer = self
+        return self
+
+    def add_listener(self, listener):
+        """
+        Adds a context manager factory that is entered around sending every
+        held move, as listener(commands); commands is empty when the held
+        moves cancelled out. HeadsUpTello uses it to keep its pose estimate
+        right while moves wait.
+        """
+        self.listeners.append(listener)
+
+    @property
+    def batching(self):
+        return self.depth > 0 and self.owner == threading.get_ident()
+
+    @contextlib.contextmanager
+    def batch(self):
+        """ Optimizes the control commands this thread sends in the with block. """
+        with self.lock:
+            if self.depth and self.owner != threading.get_ident():
+                raise RuntimeError("Another thread is batching commands")
+            self.owner = threading.get_ident()
+            self.depth += 1
+        try:
+            yield self
+        except BaseException:
+            # A failed check or an abort must not fly what it held back
+            if self.depth == 1:
+                self.discard()
+            raise
+        else:
+            if self.depth == 1:
+                self.flush()
+        finally:
+            with self.lock:
+                self.depth -= 1
+                if not self.depth:
+                    self.owner = None
+
+    # ------------------------------- Sending --------------------------------
+
+    def submit(self, command, *args, **kwargs):
+        """
+        Takes one control command from the batching thread. Returns True when
+        it was held back or left out, else the answer of sending it.
+        """
+        self.received += 1
+        move = parse_move(command)
+        if move is not None:
+            axis, distance = move
+            if self.held is not None and self.held[0] == axis:
+                self.held = (axis, self.held[1] + distance)
+                self.held_commands += 1
+                self.merged += 1
+            else:
+                self.flush()
+                self.held = move
+                self.held_commands = 1
+            return True
+        key = led_key(command)
+        if key is not None and self.leds.get(key) == command:
+            self.deduplicated += 1
+            return True
+        self.flush()
+        response = self.send(command, *args, **kwargs)
+        self.sent += 1
+        if key is not None:
+            self.leds[key] = command
+        elif command in ('reboot', 'command'):
+            # The drone forgets its LEDs
+            self.leds.clear()
+        return response
+
+    def flush(self):
+        """ Sends the held move, if the calling thread is batching and there is one. """
+        if self.held is None or not self.batching:
+            return
+        axis, distance = self.held
+        self.held = None
+        commands = split_move(axis, distance)
+        if not commands:
+            self.cancelled += self.held_commands
+        with contextlib.ExitStack() as stack:
+            for listener in self.listeners:
+                stack.enter_context(listener(commands))
+            for command in commands:
+                self.send(command)
+                self.sent += 1
+
+    def discard(self):
+        """ Drops the held move without flying it. Returns the commands it would have sent. """
+        if self.held is None:
+            return []
+        axis, distance = self.held
+        self.held = None
+        self.dropped += self.held_commands
+        commands = split_move(axis, distance)
+        if commands and self.logger is not None:
+            self.logger.warning("Dropped the held moves %s, the batch failed", ", ".join(commands))
+        return commands
+
+    # ------------------------------ Reporting -------------------------------
+
+    @property
+    def saved(self):
+        """ Round trips the optimizer didn't have to make. """
+        return self.received - self.sent - self.dropped
+
+    def reset(self):
+        """ Zeroes the counts, e.g. at the start of a mission. """
+        self.received = self.sent = self.merged = self.cancelled = self.deduplicated = 0
+        self.dropped = 0
+
+    def report(self):
+        return {'received': self.received, 'sent': self.sent, 'saved': self.saved,
+                'merged': self.merged, 'cancelled': self.cancelled,
+                'deduplicated': self.deduplicated, 'dropped': self.dropped}
+
+# ------------------------ END OF CommandOptimizer CLASS ------------------------
+
+
+def optimize(commands):
+    """ Runs a list of control commands through a CommandOptimizer and returns what it sends. """
+    sent = []
+    optimizer = CommandOptimizer(lambda command, *args, **kwargs: sent.append(command) or True)
+    with optimizer.batch():
+        for command in commands:
+            optimizer.submit(command)
+    return sent
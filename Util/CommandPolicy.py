@@ -0,0 +1,298 @@
+import bisect
+import math
+import re
+import threading
+import time
+from collections import deque
+
+from djitellopy.tello import Tello, TelloException
+
+
+# Command kinds that do the same thing when the drone gets them twice. A
+# lost answer to one of these is simply asked again.
+IDEMPOTENT = {'query', 'ext', 'control'}
+
+MOVES = {'up', 'down', 'left', 'right', 'forward', 'back', 'go', 'curve', 'flip'}
+
+
+def command_kind(command):
+    """ Sorts an SDK command into the kind its round trip times are kept for. """
+    words = command.split()
+    word = words[0] if words else ''
+    if command.strip().endswith('?'):
+        return 'query'
+    if word == 'EXT':
+        return 'ext'
+    if word in ('takeoff', 'land'):
+        return word
+    if word in MOVES:
+        return 'move'
+    if word in ('cw', 'ccw'):
+        return 'rotate'
+    return 'control'
+
+
+def command_units(command):
+    """
+    How much a command does: the distance of a move in cm, the angle of a
+    rotation in degrees, 1 for everything else. Moves take longer the
+    farther they go, so their times are kept per unit.
+    """
+    kind = command_kind(command)
+    if kind not in ('move', 'rotate'):
+        return 1.0
+    numbers = [abs(float(number)) for number in re.findall(r'-?\d+(?:\.\d+)?', command)]
+    if not numbers:
+        return 1.0
+    if command.startswith(('go', 'curve')):
+        # The last point, before the speed
+        return max(math.hypot(*numbers[-4:-1]), 1.0)
+    return max(numbers[0], 1.0)
+
+
+class RttHistogram:
+    """
+    The round trip times of the last window commands of one kind, counted in
+    logarithmic buckets between low and high seconds. When the window is
+    full the oldest time drops out, so the percentiles follow the link.
+    """
+
+    def __init__(self, window=200, low=0.001, high=60.0, steps=4):
+        """
+        Arguments
+            window: Number of recent times to keep
+            low:    Upper edge of the first bucket, in seconds
+            high:   Times above this land in one overflow bucket
+            steps:  Buckets per doubling of the time
+        """
+        self.edges = []
+        edge = low
+        while edge < high:
+            self.edges.append(edge)
+            edge *= 2 ** (1 / steps)
+        self.counts = [0] * (len(self.edges) + 1)
+        self.recent = deque(maxlen=window)
+
+    def __len__(self):
+        return len(self.recent)
+
+    def add(self, seconds):
+        if len(self.recent) == self.recent.maxlen:
+            self.counts[self.recent[0]] -= 1
+        bucket = bisect.bisect_left(self.edges, seconds)
+        self.recent.append(bucket)
+        self.counts[bucket] += 1
+
+    def percentile(self, pct):
+        """
+        Returns the upper edge of the bucket that holds the pct percentile,
+        infinity for the overflow bucket or 0 when there are no times.
+        """
+        if not self.recent:
+            return 0.0
+        rank = max(math.ceil(pct / 100 * len(self.recent)), 1)
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                break
+        return self.edges[bucket] if bucket < len(self.edges) else math.inf
+
+
+# ------------------------- BEGIN CommandPolicy CLASS ---------------------------
+
+class CommandPolicy:
+    """
+    Decides how long a CommandChannel waits for an answer and what happens
+    when none comes. djitellopy waits a fixed 7 seconds (20 for takeoff) and
+    then sends the command again, so a lost UDP answer either stalls the
+    flight or flies a move twice.
+
+    The policy keeps an RttHistogram for each kind of command (query, ext,
+    move, rotate, takeoff, land, control) and waits factor times their pct
+    percentile, rounded up to whole seconds because that is what djitellopy
+    takes, and never more than djitellopy would. Moves and rotations are
+    timed per cm or degree. Until a kind has min_samples times, djitellopy's
+    timeout is used.
+
+    When an answer doesn't come in time:
+      - queries, LED and other repeatable commands are sent again, up to
+        retries more times;
+      - a motion is checked against the state stream first. While the drone
+        is still moving the policy keeps listening for the late answer; if
+        the drone moved it counts as done, if it stayed put it is sent
+        again, and without a state stream it fails instead of risking a
+        second move.
+
+        policy = CommandPolicy(telemetry).attach(channel)
+        print(policy.report())
+    """
+
+    def __init__(self, telemetry=None, pct=99, factor=1.5, min_samples=10,
+                 retries=2, window=200, logger=None):
+        """
+        Arguments
+            telemetry:   The drone's Util.Telemetry, to see whether it moved
+            pct:         Percentile of the round trip times to wait for
+            factor:      How many times that percentile to wait
+            min_samples: Times a kind needs before its timeout is learned
+            retries:     How many times to send a command again
+            window:      Recent times each histogram keeps
+            logger:      A Util.Log.Log for lost answers
+        """
+        self.telemetry = telemetry
+        self.pct = pct
+        self.factor = factor
+        self.min_samples = min_samples
+        self.retries = retries
+        self.window = window
+        self.logger = logger
+        self.drone = None
+        self.histograms = {}
+        self.lost = {}
+        self.resent = 0
+        self.recovered = 0
+        self.failed = 0
+        # Speed in dm/s and turn in degrees per packet that count as moving
+        self.min_speed = 2
+        self.min_turn = 2
+        # Seconds without movement after which the drone has stopped
+        self.still = 0.3
+        self.last_motion = float('-inf')
+        self.last_yaw = None
+        self.lock = threading.Lock()
+
+    def attach(self, channel):
+        """ Makes a CommandChannel send through this policy. Returns self. """
+        self.drone = channel.drone
+        channel.policy = self
+        if self.telemetry is not None:
+            self.telemetry.add_listener(self.watch)
+        return self
+
+    def watch(self, state, timestamp):
+        """ Telemetry listener that notes when the drone was last seen moving. """
+        speed = max(abs(state.get(name, 0)) for name in ('vgx', 'vgy', 'vgz'))
+        yaw = state.get('yaw')
+        turned = False
+        if yaw is not None and self.last_yaw is not None:
+            turned = abs((yaw - self.last_yaw + 180) % 360 - 180) >= self.min_turn
+        self.last_yaw = yaw
+        if speed >= self.min_speed or turned:
+            self.last_motion = timestamp
+
+    # ------------------------------- Timeouts -------------------------------
+
+    def histogram(self, kind):
+        with self.lock:
+            if kind not in self.histograms:
+                self.histograms[kind] = RttHistogram(self.window)
+            return self.histograms[kind]
+
+    def timeout(self, command, default=Tello.RESPONSE_TIMEOUT):
+        """ Whole seconds to wait for the answer to command; default is djitellopy's. """
+        histogram = self.histogram(command_kind(command))
+        if len(histogram) < self.min_samples:
+            return default
+        learned = histogram.percentile(self.pct) * command_units(command) * self.factor
+        return min(max(math.ceil(learned), 1), default)
+
+    def record(self, command, seconds):
+        self.histogram(command_kind(command)).add(seconds / command_units(command))
+
+    # ------------------------------- Sending --------------------------------
+
+    def responses(self):
+        """ djitellopy's list of answers that arrived for this drone, if it has one. """
+        try:
+            return self.drone.get_own_udp_object()['responses']
+        except (AttributeError, KeyError):
+            return None
+
+    def send(self, send, command, timeout=Tello.RESPONSE_TIMEOUT):
+        """
+        Sends command with the channel's send function and returns the
+        answer. Raises TelloException when no answer came and sending again
+        isn't safe or didn't help.
+        """
+        kind = command_kind(command)
+        responses = self.responses()
+        for attempt in range(self.retries + 1):
+            # An answer that came too late belongs to an earlier attempt
+            if responses:
+                responses.clear()
+            wait = self.timeout(command, timeout)
+            before = self.telemetry.snapshot()[0] if self.telemetry is not None else None
+            sent = time.monotonic()
+            response = send(command, timeout=wait)
+            if not (isinstance(response, str) and response.startswith("Aborting command")):
+                self.record(command, time.monotonic() - sent)
+                return response
+            with self.lock:
+                self.lost[kind] = self.lost.get(kind, 0) + 1
+            if kind in IDEMPOTENT:
+                self.note("No answer to '%s' after %s s, sending it again", command, wait)
+                self.resent += 1
+                continue
+            if not self.stream_alive():
+                break
+            response = self.settle(command, sent, before, timeout)
+            if response is not None:
+                return response
+            self.note("No answer to '%s' and the drone didn't move, sending it again", command)
+            self.resent += 1
+        self.failed += 1
+        raise TelloException(f"No answer to '{command}' after {attempt + 1} tries")
+
+    def stream_alive(self):
+        return (self.telemetry is not None
+                and time.monotonic() - self.telemetry.last_packet < 1.0)
+
+    def settle(self, command, sent, before, timeout):
+        """
+        Called when a motion got no answer in time. Listens for the late
+        answer while the drone keeps moving, up to djitellopy's timeout.
+        Returns the answer, 'ok' if the drone moved without answering, or
+        None if it didn't move.
+        """
+        responses = self.responses()
+        deadline = sent + timeout
+        while time.monotonic() < deadline and time.monotonic() - self.last_motion < self.still:
+            if responses:
+                self.record(command, time.monotonic() - sent)
+                return responses.pop(0).decode('utf-8', errors='replace').rstrip('\r\n')
+            time.sleep(0.02)
+        if not self.moved(sent, before):
+            return None
+        self.recovered += 1
+        self.note("The answer to '%s' was lost but the drone moved, going on", command)
+        return 'ok'
+
+    def moved(self, sent, before):
+        """ True if the state stream shows the drone moving or turning since sent. """
+        if self.last_motion >= sent:
+            return True
+        after = self.telemetry.snapshot()[0]
+        turned = abs((after['yaw'] - before['yaw'] + 180) % 360 - 180)
+        return turned >= 5 or abs(after['h'] - before['h']) >= 10
+
+    def note(self, message, *args):
+        if self.logger is not None:
+            self.logger.warning(message, *args)
+
+    # ------------------------------ Reporting -------------------------------
+
+    def report(self):
+        """
+        Returns one dict per kind of command with its sample count, p50 and
+        p99 round trip in ms (per cm or degree for moves and rotations) and
+        how many answers were lost.
+        """
+        with self.lock:
+            kinds = sorted(self.histograms.keys() | self.lost.keys())
+        return [{'kind': kind, 'samples': len(self.histogram(kind)),
+                 'p50_ms': self.histogram(kind).percentile(50) * 1000,
+                 'p99_ms': self.histogram(kind).percentile(99) * 1000,
+                 'lost': self.lost.get(kind, 0)} for kind in kinds]
+
+# ------------------------- END OF CommandPolicy CLASS --------------------------
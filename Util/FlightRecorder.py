@@ -0,0 +1,196 @@
+import json
+import os
+import struct
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+
+import numpy as np
+
+from Util.Telemetry import FIELDS
+
+
+# File layout of a column file:
+#   HEADER bytes: MAGIC, the row count as a little endian uint64, the length
+#                 of a JSON description as a uint32 and the JSON itself
+#   blocks:       block_rows rows each, column after column, so one column of
+#                 a block is block_rows values in a row
+MAGIC = b"HUFCOL01"
+HEADER = 4096
+ROWS_AT = len(MAGIC)
+
+# Columns of the two tables of a flight. Times are time.monotonic() seconds.
+STATE_COLUMNS = [('t', 'f8')] + [(name, 'f4') for name in FIELDS]
+COMMAND_COLUMNS = [('sent', 'f8'), ('latency', 'f8'), ('command', 'S80'), ('response', 'S32')]
+
+# A flight as loaded by load_flight(): meta is the dict passed to the
+# recorder plus its start time, state and commands map column names to arrays
+Flight = namedtuple("Flight", "meta state commands")
+
+
+def block_dtype(columns, block_rows):
+    """ A NumPy record type that is one whole block of a column file. """
+    return np.dtype([(name, kind, (block_rows,)) for name, kind in columns])
+
+
+class ColumnFile:
+    """
+    An append-only table of fixed-width columns in a memory-mapped file.
+
+    Rows are written straight into the mapped pages and the row count in the
+    header is updated with every row, so the operating system gets the data
+    to disk even if the program dies. The file grows by whole blocks: when
+    the last block is full the file is made grow_blocks blocks longer and
+    mapped again.
+    """
+
+    def __init__(self, path, columns, block_rows=1024, grow_blocks=4, meta=None):
+        """
+        Arguments
+            path:        File to create; an existing file is overwritten
+            columns:     [(name, NumPy type), ...]
+            block_rows:  Rows per block
+            grow_blocks: Blocks to add each time the file is full
+            meta:        Dict saved in the header, e.g. a mission name
+        """
+        self.path = path
+        self.columns = [(name, np.dtype(kind).str) for name, kind in columns]
+        self.names = [name for name, _ in self.columns]
+        self.block_rows = block_rows
+        self.grow_blocks = grow_blocks
+        self.dtype = block_dtype(self.columns, block_rows)
+        description = json.dumps({'columns': self.columns, 'block_rows': block_rows,
+                                  'meta': meta or {}}, default=str).encode()
+        if len(description) > HEADER - ROWS_AT - 12:
+            raise ValueError(f"The description of {path} doesn't fit in its header")
+        with open(path, 'wb') as file:
+            file.write(MAGIC + struct.pack('<QI', 0, len(description)) + description)
+            file.truncate(HEADER)
+        self.rows = 0
+        self.blocks = None
+        self.count = np.memmap(path, dtype='<u8', mode='r+', offset=ROWS_AT, shape=(1,))
+        self.lock = threading.Lock()
+        self.grow()
+
+    def grow(self):
+        """ Makes the file grow_blocks blocks longer and maps it again. """
+        capacity = 0 if self.blocks is None else len(self.blocks)
+        if self.blocks is not None:
+            self.blocks.flush()
+        with open(self.path, 'r+b') as file:
+            file.truncate(HEADER + (capacity + self.grow_blocks) * self.dtype.itemsize)
+        self.blocks = np.memmap(self.path, dtype=self.dtype, mode='r+', offset=HEADER,
+                                shape=(capacity + self.grow_blocks,))
+        # Plain views of each column; slicing the memmap for every value is slow
+        self.views = [self.blocks[name].view(np.ndarray) for name in self.names]
+
+    def append(self, *values):
+        """ Adds one row, its values in column order. Ignored once closed. """
+        with self.lock:
+            if self.blocks is None:
+                return
+            block, i = divmod(self.rows, self.block_rows)
+            if block >= len(self.blocks):
+                self.grow()
+            for view, value in zip(self.views, values):
+                view[block, i] = value
+            self.rows += 1
+            self.count[0] = self.rows
+
+    def flush(self):
+        """ Asks the operating system to write the mapped pages to disk. """
+        with self.lock:
+            if self.blocks is not None:
+                self.blocks.flush()
+                self.count.flush()
+
+    def close(self):
+        """ Flushes and cuts the file down to the blocks that hold rows. """
+        with self.lock:
+            if self.blocks is None:
+                return
+            self.blocks.flush()
+            self.count.flush()
+            used = -(-self.rows // self.block_rows)
+            self.blocks = self.count = self.views = None
+            with open(self.path, 'r+b') as file:
+                file.truncate(HEADER + used * self.dtype.itemsize)
+
+
+def read_columns(path):
+    """
+    Loads a column file. Returns (meta, {column name: NumPy array}), each
+    array holding every row that was written.
+    """
+    with open(path, 'rb') as file:
+        header = file.read(HEADER)
+    if header[:ROWS_AT] != MAGIC:
+        raise ValueError(f"{path} is not a flight recorder file")
+    rows, length = struct.unpack_from('<QI', header, ROWS_AT)
+    description = json.loads(header[ROWS_AT + 12:ROWS_AT + 12 + length])
+    block_rows = description['block_rows']
+    dtype = block_dtype(description['columns'], block_rows)
+    used = -(-rows // block_rows)
+    blocks = np.fromfile(path, dtype=dtype, count=used, offset=HEADER)
+    columns = {name: blocks[name].reshape(-1)[:rows] for name, _ in description['columns']}
+    return description['meta'], columns
+
+
+def load_flight(path):
+    """ Loads a recorded flight, see FlightRecorder, as a Flight. """
+    meta, state = read_columns(os.path.join(path, 'state.col'))
+    _, commands = read_columns(os.path.join(path, 'commands.col'))
+    return Flight(meta, state, commands)
+
+
+class FlightRecorder:
+    """
+    Records a flight into a directory: every state packet into state.col and
+    every SDK command with its response and latency into commands.col. Both
+    are ColumnFiles, so a flight loads as NumPy arrays with one call:
+
+        flight = load_flight('flights/2024-05-01_1200')
+        flight.state['h'], flight.commands['latency']
+
+    Packets come from a Util.Telemetry listener and commands from a
+    Util.CommandChannel listener. The latency is the time the command took
+    once it had the channel, and responses are cut to 32 bytes.
+    """
+
+    def __init__(self, path, meta=None, block_rows=1024):
+        """
+        Arguments
+            path:       Directory to write the flight to, created if missing
+            meta:       Dict of facts about the flight to keep with it
+            block_rows: Rows the files grow by at a time
+        """
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        meta = dict(meta or {}, started=datetime.now().isoformat(), monotonic=time.monotonic())
+        self.state = ColumnFile(os.path.join(path, 'state.col'), STATE_COLUMNS, block_rows,
+                                meta=meta)
+        self.commands = ColumnFile(os.path.join(path, 'commands.col'), COMMAND_COLUMNS,
+                                   block_rows, meta=meta)
+
+    def attach(self, telemetry, channel):
+        """ Starts recording a Telemetry's packets and a CommandChannel's commands. """
+        telemetry.add_listener(self.record_state)
+        channel.add_listener(self.record_command)
+        return self
+
+    def record_state(self, state, timestamp):
+        self.state.append(timestamp, *(state.get(name, np.nan) for name in FIELDS))
+
+    def record_command(self, command, response, sent, latency):
+        response = '' if response is None else str(response)
+        self.commands.append(sent, latency, command.encode()[:80], response.encode()[:32])
+
+    def flush(self):
+        self.state.flush()
+        self.commands.flush()
+
+    def close(self):
+        """ Stops recording and trims the files. """
+        self.state.close()
+        self.commands.close()
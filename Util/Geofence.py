@@ -0,0 +1,168 @@
+from collections import namedtuple
+
+import numpy as np
+
+
+# Result of checking a trajectory. violations holds every sampled (x, y, z)
+# point outside the fence and commands the index of the segment it came from.
+FenceCheck = namedtuple("FenceCheck", "ok violations commands samples")
+
+
+def mission_limit(mission_obj, key):
+    """
+    Reads 'floor' or 'ceiling' from a mission object. mission_obj.json stores
+    them as one element lists, Flight uses plain numbers.
+    """
+    if not mission_obj or key not in mission_obj:
+        return None
+    value = mission_obj[key]
+    if isinstance(value, (list, tuple)):
+        value = value[0] if value else None
+    return value
+
+
+class Geofence:
+    """
+    A 3D fence made of any combination of a vertical cylinder around home, a
+    polygon and floor/ceiling heights. Positions are in cm in the HeadsUpTello
+    frame (x forward, y left, z up). All checks take arrays of points so a whole
+    trajectory is tested in one NumPy pass.
+    """
+
+    def __init__(self, floor=None, ceiling=None, center=(0, 0), radius=None, polygon=None,
+                 resolution=10):
+        """
+        Arguments
+            floor:      Lowest allowed height in cm, or None
+            ceiling:    Highest allowed height in cm, or None
+            center:     (x, y) center of the cylinder
+            radius:     Radius of the cylinder in cm, or None for no cylinder
+            polygon:    List of (x, y) corners the drone has to stay inside
+            resolution: Distance in cm between the points sampled on a path
+        """
+        self.floor = floor
+        self.ceiling = ceiling
+        self.center = np.asarray(center, dtype=float)
+        self.radius = radius
+        self.polygon = None if polygon is None else np.asarray(polygon, dtype=float)
+        self.resolution = resolution
+
+    @classmethod
+    def from_mission(cls, mission_obj, home=(0, 0), tether=None, polygon=None, resolution=10):
+        """ Builds the fence from a mission object and a tether around home. """
+        return cls(mission_limit(mission_obj, 'floor'), mission_limit(mission_obj, 'ceiling'),
+                   home, tether, polygon, resolution)
+
+    def recenter(self, x, y):
+        """ Moves the cylinder, e.g. when the drone gets a new home. """
+        self.center = np.asarray((x, y), dtype=float)
+
+    def contains(self, points):
+        """
+        Returns a boolean array that is True for every point inside the fence.
+        points is an (N, 2) or (N, 3) array; without a z column the floor and
+        ceiling are not checked.
+        """
+        points = np.atleast_2d(np.asarray(points, dtype=float))
+        inside = np.ones(len(points), dtype=bool)
+        if self.radius is not None:
+            offset = points[:, :2] - self.center
+            inside &= np.einsum('ij,ij->i', offset, offset) <= self.radius * self.radius
+        if self.polygon is not None:
+            inside &= self.in_polygon(points[:, 0], points[:, 1])
+        if points.shape[1] > 2:
+            if self.floor is not None:
+                inside &= points[:, 2] >= self.floor
+            if self.ceiling is not None:
+                inside &= points[:, 2] <= self.ceiling
+        return inside
+
+    def contains_point(self, x, y, z=None):
+        """ True if a single point is inside the fence. """
+        point = (x, y) if z is None else (x, y, z)
+        return bool(self.contains([point])[0])
+
+    def in_polygon(self, x, y):
+        """ Even-odd ray casting of every point against every polygon edge. """
+        x1, y1 = self.polygon[:, 0], self.polygon[:, 1]
+        x2, y2 = np.roll(x1, -1), np.roll(y1, -1)
+        x, y = x[:, None], y[:, None]
+        crosses = (y1 > y) != (y2 > y)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x_cross = x1 + (y - y1) * (x2 - x1) / (y2 - y1)
+        return np.count_nonzero(crosses & (x < x_cross), axis=1) % 2 == 1
+
+    def sample_segments(self, starts, ends):
+        """
+        Samples straight segments every resolution cm, endpoints included.
+        Returns the points and the index of the segment each point came from.
+        """
+        starts = np.asarray(starts, dtype=float).reshape(-1, 3)
+        ends = np.asarray(ends, dtype=float).reshape(-1, 3)
+        lengths = np.linalg.norm(ends - starts, axis=1)
+        steps = np.maximum(np.ceil(lengths / self.resolution), 1).astype(int)
+        segment = np.repeat(np.arange(len(starts)), steps + 1)
+        first = np.repeat(np.cumsum(steps + 1) - (steps + 1), steps + 1)
+        t = (np.arange(len(segment)) - first) / steps[segment]
+        points = starts[segment] + t[:, None] * (ends - starts)[segment]
+        return points, segment
+
+    def sample_arcs(self, starts, vias, ends):
+        """
+        Samples circular arcs from start through via to end every resolution
+        cm. Returns the points and the index of the arc each point came from.
+        """
+        a = np.asarray(starts, dtype=float).reshape(-1, 3)
+        b = np.asarray(vias, dtype=float).reshape(-1, 3)
+        c = np.asarray(ends, dtype=float).reshape(-1, 3)
+        u, v = b - a, c - a
+        normal = np.cross(u, v)
+        norm2 = np.einsum('ij,ij->i', normal, normal)[:, None]
+        uu = np.einsum('ij,ij->i', u, u)[:, None]
+        vv = np.einsum('ij,ij->i', v, v)[:, None]
+        center = a + np.cross(uu * v - vv * u, normal) / (2 * norm2)
+        radius = np.linalg.norm(a - center, axis=1)
+        e1 = (a - center) / radius[:, None]
+        e2 = np.cross(normal / np.sqrt(norm2), e1)
+        end = c - center
+        sweep = np.arctan2(np.einsum('ij,ij->i', end, e2), np.einsum('ij,ij->i', end, e1)) % (2 * np.pi)
+        steps = np.maximum(np.ceil(radius * sweep / self.resolution), 1).astype(int)
+        arc = np.repeat(np.arange(len(a)), steps + 1)
+        first = np.repeat(np.cumsum(steps + 1) - (steps + 1), steps + 1)
+        angle = ((np.arange(len(arc)) - first) / steps[arc] * sweep[arc])[:, None]
+        points = center[arc] + radius[arc, None] * (np.cos(angle) * e1[arc] + np.sin(angle) * e2[arc])
+        return points, arc
+
+    def check_path(self, path):
+        """ Checks the straight legs between consecutive (x, y, z) points. """
+        path = np.asarray(path, dtype=float).reshape(-1, 3)
+        if len(path) < 2:
+            return self.check_samples(path, np.zeros(len(path), dtype=int))
+        return self.check_samples(*self.sample_segments(path[:-1], path[1:]))
+
+    def check_plan(self, plan):
+        """
+        Checks every command of a compiled MissionPlan, following the arc of
+        each 'curve' and not just its end points.
+        """
+        commands = list(plan)
+        lines = [i for i, command in enumerate(commands) if command.via is None]
+        arcs = [i for i, command in enumerate(commands) if command.via is not None]
+        points, owners = [np.empty((0, 3))], [np.empty(0, dtype=int)]
+        if lines:
+            sampled, index = self.sample_segments([commands[i].start for i in lines],
+                                                  [commands[i].end for i in lines])
+            points.append(sampled)
+            owners.append(np.asarray(lines)[index])
+        if arcs:
+            sampled, index = self.sample_arcs([commands[i].start for i in arcs],
+                                              [commands[i].via for i in arcs],
+                                              [commands[i].end for i in arcs])
+            points.append(sampled)
+            owners.append(np.asarray(arcs)[index])
+        return self.check_samples(np.concatenate(points), np.concatenate(owners))
+
+    def check_samples(self, points, owners):
+        """ Tests sampled points, owners[i] being the segment of points[i]. """
+        outside = ~self.contains(points)
+        return FenceCheck(not outside.any(), points[outside], np.unique(owners[outside]), len(points))
@@ -0,0 +1,223 @@
+import threading
+import time
+from collections import namedtuple
+from functools import lru_cache
+
+from Util import dji_matrix as djim
+from Util.CommandChannel import CommandChannel
+
+
+# One picture for the 8x8 LED matrix, compiled once. red, blue and purple
+# are 64 bit masks, bit 0 being the top left LED and bit 63 the bottom right.
+# command is the SDK command that shows the picture.
+MatrixFrame = namedtuple("MatrixFrame", "red blue purple command")
+
+COLORS = "rbp"
+
+
+def pack(pattern, color='b'):
+    """
+    Turns a 64 letter dji_matrix pattern into a MatrixFrame. '*' lights an
+    LED in color, 'r', 'b' and 'p' in their own color and '0' leaves it off.
+    """
+    if len(pattern) != 64:
+        raise ValueError(f"A matrix pattern has 64 letters, not {len(pattern)}")
+    color = color.lower() if color.lower() in COLORS else 'b'
+    masks = {'r': 0, 'b': 0, 'p': 0}
+    for i, letter in enumerate(pattern.lower()):
+        letter = color if letter == '*' else letter
+        if letter in masks:
+            masks[letter] |= 1 << i
+    return frame_from_masks(masks['r'], masks['b'], masks['p'])
+
+
+def frame_from_masks(red, blue=0, purple=0):
+    """ Builds a MatrixFrame, and its command, from three bit masks. """
+    letters = []
+    for i in range(64):
+        bit = 1 << i
+        letters.append('r' if red & bit else 'b' if blue & bit else 'p' if purple & bit else '0')
+    return MatrixFrame(red, blue, purple, f"EXT mled g {''.join(letters)}")
+
+
+@lru_cache(maxsize=256)
+def compile_pattern(pattern, color='b'):
+    """ pack() with a cache, for patterns that are shown again and again. """
+    return pack(pattern, color)
+
+
+OFF = pack("0" * 64)
+
+# The dji_matrix pictures in every color
+NUMBERS = {color: [pack(number, color) for number in djim.numbers] for color in COLORS}
+KEY = {color: pack(djim.key, color) for color in COLORS}
+LOGO = {color: pack(djim.heads_up_flight_logo, color) for color in COLORS}
+
+
+def countdown(start=9, color='b', end=0):
+    """ Frames that count down from start to end and then go dark. """
+    return [NUMBERS[color][number] for number in range(start, end - 1, -1)] + [OFF]
+
+
+def scroll(patterns, color='b', gap=1):
+    """
+    Frames that scroll the patterns from right to left across the matrix,
+    one column per frame, with gap dark columns between them.
+    """
+    columns = []
+    for pattern in patterns:
+        rows = [pattern[row * 8:row * 8 + 8] for row in range(8)]
+        columns.extend(''.join(row[column] for row in rows) for column in range(8))
+        columns.extend(['0' * 8] * gap)
+    # Start and end with a dark screen
+    columns = ['0' * 8] * 8 + columns + ['0' * 8] * 8
+    frames = []
+    for left in range(len(columns) - 7):
+        window = columns[left:left + 8]
+        frames.append(pack(''.join(window[column][row] for row in range(8) for column in range(8)),
+                           color))
+    return frames
+
+
+def scroll_digits(text, color='b'):
+    """ Frames that scroll a string of digits across the matrix. """
+    return scroll([djim.numbers[int(digit)] for digit in text if digit.isdigit()], color)
+
+
+class LedMatrix:
+    """
+    The drone's LED matrix. Remembers the frame it is showing and skips any
+    command that would show the same frame again.
+    """
+
+    def __init__(self, drone, channel=None):
+        """
+        Arguments
+            drone:   A djitellopy.Tello object
+            channel: Util.CommandChannel of the drone; installed if missing
+        """
+        self.drone = drone
+        self.channel = channel or CommandChannel.of(drone)
+        self.shown = None
+        self.sent = 0
+        self.skipped = 0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def of(cls, drone):
+        """ Returns the drone's LedMatrix, creating it the first time. """
+        matrix = getattr(drone, 'led_matrix', None)
+        if matrix is None:
+            matrix = drone.led_matrix = cls(drone)
+        return matrix
+
+    def show(self, frame, color='b', block=True):
+        """
+        Shows a MatrixFrame or a dji_matrix pattern. Returns True if a
+        command was sent, False if the frame was already showing and None if
+        block is False and the command channel was busy.
+        """
+        if isinstance(frame, str):
+            frame = compile_pattern(frame, color)
+        with self.lock:
+            if frame == self.shown:
+                self.skipped += 1
+                return False
+            if block:
+                self.drone.send_control_command(frame.command)
+            elif self.channel.try_send(frame.command) is None:
+                return None
+            self.shown = frame
+            self.sent += 1
+            return True
+
+    def off(self, block=True):
+        return self.show(OFF, block=block)
+
+    def forget(self):
+        """ Makes the next show() send its command, e.g. after a reboot. """
+        with self.lock:
+            self.shown = None
+
+
+class MatrixSequencer:
+    """
+    Plays a list of frames on an LedMatrix at a steady rate from a
+    background thread, so the caller can keep flying:
+
+        sequencer = MatrixSequencer(LedMatrix.of(tello))
+        sequencer.play(countdown(9), rate=1)
+        ...
+        sequencer.wait()
+
+    Frame i is due at start + i / rate. The sequencer only sends while no
+    other command is in flight, so a flight command waits for at most the
+    one LED command already on its way. If the channel stays busy until the
+    next frame is due, the late frame is dropped and the newer one is shown
+    instead. The last frame
+    of an animation that doesn't loop is never dropped.
+    """
+
+    def __init__(self, matrix, max_rate=10, poll=0.01):
+        """
+        Arguments
+            matrix:   LedMatrix to play on
+            max_rate: Most frames per second that will be sent
+            poll:     Seconds between attempts while the channel is busy
+        """
+        self.matrix = matrix
+        self.max_rate = max_rate
+        self.poll = poll
+        self.dropped = 0
+        self.stopping = threading.Event()
+        self.worker = None
+
+    @property
+    def playing(self):
+        return self.worker is not None and self.worker.is_alive()
+
+    def play(self, frames, rate=5, loop=False):
+        """ Stops the current animation and starts playing frames. """
+        self.stop()
+        self.stopping = threading.Event()
+        rate = min(rate, self.max_rate)
+        self.worker = threading.Thread(target=self.run, args=(list(frames), rate, loop, self.stopping),
+                                       name="matrix-sequencer", daemon=True)
+        self.worker.start()
+        return self
+
+    def run(self, frames, rate, loop, stopping):
+        """ Worker thread: shows each frame when it is due. """
+        period = 1 / rate
+        start = time.monotonic()
+        index = 0
+        while frames and not stopping.is_set():
+            if index >= len(frames):
+                if not loop:
+                    break
+                start += len(frames) * period
+                index = 0
+            if index == len(frames) - 1 and not loop:
+                # The last frame stays up, so it has to make it to the drone
+                self.matrix.show(frames[index])
+                break
+            deadline = start + (index + 1) * period
+            while self.matrix.show(frames[index], block=False) is None:
+                if time.monotonic() + self.poll >= deadline or stopping.wait(self.poll):
+                    self.dropped += 1
+                    break
+            index += 1
+            stopping.wait(max(start + index * period - time.monotonic(), 0))
+
+    def stop(self):
+        """ Stops the animation; the matrix keeps the frame it is showing. """
+        self.stopping.set()
+        if self.worker is not None and self.worker is not threading.current_thread():
+            self.worker.join()
+        self.worker = None
+
+    def wait(self, timeout=None):
+        """ Waits for a non-looping animation to finish. """
+        if self.worker is not None:
+            self.worker.join(timeout)
+        return not self.playing
@@ -1,49 +1,144 @@
+import atexit
 import logging
+import logging.handlers
 import os
+import queue
 import sys
 import time
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that leaves the formatting to the listener thread. The
+    stock one formats and copies every record before queueing it; here only
+    the %-arguments are merged into the message, so later changes to them
+    can't show up in the log.
+    """
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
 class Log:
-    def __init__(self, name, drone, floor, ceiling, log_dir=None, debug_level=logging.INFO):
+    """
+    Mission log that writes to a file and the console.
+
+    Logging calls only put the record on a queue; a QueueListener thread
+    formats it and does the file and console writes, so the control thread
+    never waits on the disk. Each handler has its own level, and the logger
+    itself is set to the most verbose of them, so a message no handler wants
+    is dropped before it is formatted. Messages take %-style arguments that
+    are only formatted if the message is going to be written:
+
+        log.debug("current height: %s", height)
+
+    and work that is only needed for a message can be guarded:
+
+        if log.enabled(logging.DEBUG):
+            log.debug(f"New currentheight: {drone.get_height()}")
+    """
+
+    # The open Log of every name, so a second Log with the same name
+    # replaces the first one's handlers instead of writing every line twice,
+    # and so close_all() can write out whatever is queued at exit
+    listeners = {}
+
+    def __init__(self, name, drone, floor, ceiling, log_dir=None, debug_level=logging.INFO,
+                 file_level=logging.INFO, stream=None):
         """
         Constructor for a custom logging class.
         This class will print logs to a file and console.
+
+        Arguments
+            name:        Mission name, also the name of the logger
+            log_dir:     The file is written to {log_dir}.log
+            debug_level: Level of the messages printed on the console
+            file_level:  Level of the messages written to the file
+            stream:      Console stream, sys.stderr by default
         """
         self.mission_name = name
         self.drone = drone
         self.floor = floor
         self.ceiling = ceiling
 
-        logging.basicConfig()
-
-        # By default the root logger is set to WARNING and all loggers you define
-        # inherit that value. Here we set the root logger to NOTSET. This logging
-        # level is automatically inherited by all existing and new sub-loggers
-        # that do not set a less verbose level.
-        logging.root.setLevel(logging.NOTSET)
-
-        # The following line sets the root logger level as well.
-        # It's equivalent to both previous statements combined:
-        logging.basicConfig(level=logging.NOTSET)
-
         self.logger = logging.getLogger(f'{self.mission_name}')
+        # Our handlers write every line; don't let the root logger repeat it
+        self.logger.propagate = False
 
         # create formatter
-        formatter = logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 
         #self.CheckForFile(log_dir)
         #file handler
-        fileHandler = logging.FileHandler(f"{log_dir}.log")
-        fileHandler.setLevel(logging.INFO)
+        # The listener thread opens the file when it writes the first line
+        fileHandler = logging.FileHandler(f"{log_dir}.log", delay=True)
+        fileHandler.setLevel(file_level)
         fileHandler.setFormatter(formatter)
-        self.logger.addHandler(fileHandler)
 
         #Console Handler
-        consoleHandler = logging.StreamHandler()
-        consoleHandler.setLevel(logging.INFO)
+        consoleHandler = logging.StreamHandler(stream)
+        consoleHandler.setLevel(debug_level)
         consoleHandler.setFormatter(formatter)
-        self.logger.addHandler(consoleHandler)
+        self.handlers = [fileHandler, consoleHandler]
+
+        # The listener thread hands each record to the handlers that want it
+        self.queue = queue.SimpleQueue()
+        self.listener = logging.handlers.QueueListener(self.queue, *self.handlers,
+                                                       respect_handler_level=True)
+        previous = Log.listeners.pop(self.mission_name, None)
+        if previous is not None:
+            previous.close()
+        for handler in list(self.logger.handlers):
+            self.logger.removeHandler(handler)
+        if previous is not None:
+            # This Log writes from now on; let go of the old one's file
+            for handler in previous.handlers:
+                handler.close()
+        self.logger.addHandler(LazyQueueHandler(self.queue))
+        self.logger.setLevel(min(file_level, debug_level))
+        self.listener.start()
+        Log.listeners[self.mission_name] = self
         self.BeginLog()
 
+    def close(self):
+        """
+        Writes out the queued messages and stops the listener thread. Later
+        messages are written right away by the handlers themselves.
+        """
+        if self.listener is None:
+            return
+        self.listener.stop()
+        self.listener = None
+        for handler in list(self.logger.handlers):
+            if isinstance(handler, LazyQueueHandler):
+                self.logger.removeHandler(handler)
+                for direct in self.handlers:
+                    self.logger.addHandler(direct)
+        if Log.listeners.get(self.mission_name) is self:
+            del Log.listeners[self.mission_name]
+
+    @classmethod
+    def close_all(cls):
+        """ Closes every open Log. Runs at exit, so no queued message is lost. """
+        for log in list(cls.listeners.values()):
+            log.close()
+
+    def enabled(self, level):
+        """ True if a message of this level will be written anywhere. """
+        return self.logger.isEnabledFor(level)
+
+    def setLevel(self, level, handler=None):
+        """
+        Sets the level of the 'file' or 'console' handler, or of both when
+        handler is None.
+        """
+        names = {'file': self.handlers[0], 'console': self.handlers[1]}
+        for name, each in names.items():
+            if handler in (None, name):
+                each.setLevel(level)
+        self.logger.setLevel(min(each.level for each in self.handlers))
 
     def CheckForFile(self, log_dir):
         """
@@ -73,32 +168,37 @@ class Log:
         self.logger.info(f"| Ceiling  : {self.ceiling}        |")
         self.logger.info(f"------------------------------------")
 
-    def info(self, message):
+    def info(self, message, *args):
         """
         Logs an info message to the console and file.
         """
-        self.logger.info(message)
+        self.logger.info(message, *args)
 
-    def debug(self, message):
+    def debug(self, message, *args):
         """
         Logs an debug message to the console and file.
         """
-        self.logger.debug(message)
+        self.logger.debug(message, *args)
 
-    def warning(self, message):
+    def warning(self, message, *args):
         """
         Logs an warning message to the console and file.
         """
-        self.logger.warning(message)
+        self.logger.warning(message, *args)
 
-    def critical(self, message):
+    def critical(self, message, *args):
         """
         Logs a critical message to the console and file.
         """
-        self.logger.critical(message)
+        self.logger.critical(message, *args)
 
-    def error(self, message):
+    def error(self, message, *args):
         """
         Logs an error message to the console and file.
         """
-        self.logger.error(message)
+        self.logger.error(message, *args)
+
+
+# One exit hook for all of them; a hook per Log would keep every Log and its
+# listener thread alive until the interpreter exits
+atexit.register(Log.close_all)
@@ -0,0 +1,378 @@
+import bisect
+import contextlib
+import functools
+import math
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+
+# Bucket bounds in seconds: 1 us, 2 us, 4 us ... 67 s. Every bucket is one
+# doubling, which is coarse but keeps observe() to one bisect of 27 floats.
+BOUNDS = tuple(1e-6 * 2 ** step for step in range(27))
+
+
+class Histogram:
+    """
+    Counts how long something took in fixed logarithmic buckets, the way a
+    Prometheus histogram does. observe() takes about a microsecond, so
+    it can sit around every command, read and frame.
+
+    The command, telemetry, log and frame threads all observe the same
+    histograms, so a lock keeps the bucket counts and the sum in step;
+    read them together with snapshot().
+    """
+
+    __slots__ = ('name', 'labels', 'bounds', 'counts', 'sum', 'lock')
+
+    def __init__(self, name, labels=(), bounds=BOUNDS):
+        """
+        Arguments
+            name:   Metric name, e.g. huf_command_seconds
+            labels: ((label, value), ...) that tell this histogram apart
+                    from others of the same name
+            bounds: Upper bucket bounds in seconds, sorted
+        """
+        self.name = name
+        self.labels = tuple(labels)
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, seconds):
+        bucket = bisect.bisect_left(self.bounds, seconds)
+        with self.lock:
+            self.counts[bucket] += 1
+            self.sum += seconds
+
+    def snapshot(self):
+        """ Returns (bucket counts, sum) as of one moment. """
+        with self.lock:
+            return list(self.counts), self.sum
+
+    def time(self):
+        """ A context manager that observes how long its block took. """
+        return Timer(self)
+
+    def timed(self, function):
+        """ Wraps function so that every call is observed. """
+        observe, clock = self.observe, time.perf_counter
+
+        @functools.wraps(function)
+        def timed_call(*args, **kwargs):
+            start = clock()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                observe(clock() - start)
+
+        timed_call.histogram = self
+        return timed_call
+
+    @property
+    def count(self):
+        return sum(self.snapshot()[0])
+
+    def percentile(self, pct):
+        """ The upper bound of the bucket holding the pct percentile, 0 if empty. """
+        counts, _ = self.snapshot()
+        total = sum(counts)
+        if not total:
+            return 0.0
+        rank = max(math.ceil(pct / 100 * total), 1)
+        seen = 0
+        for bucket, count in enumerate(counts):
+            seen += count
+            if seen >= rank:
+                break
+        return self.bounds[bucket] if bucket < len(self.bounds) else math.inf
+
+
+class Timer:
+    """ Observes the time between entering and leaving a with block. """
+
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+def label_text(labels, extra=()):
+    pairs = tuple(labels) + tuple(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+
+# ---------------------------- BEGIN Metrics CLASS ------------------------------
+
+class Metrics:
+    """
+    The histograms of one program, by name and labels. HeadsUpTello fills
+    them when it is given a Metrics object:
+
+        metrics = Metrics()
+        drone = HeadsUpTello(Tello(), 20, mission, metrics=metrics)
+        metrics.export(path='mission.prom', period=5)    # or port=9100
+        with metrics.profile('mission.folded'):
+            fly(drone)
+        print(metrics.report())
+
+    Times are in seconds and every metric name starts with prefix.
+    """
+
+    def __init__(self, prefix="huf"):
+        self.prefix = prefix
+        self.histograms = {}
+        self.help = {}
+        self.lock = threading.Lock()
+        self.exporters = []
+
+    def histogram(self, name, help="", **labels):
+        """ Returns the histogram of this name and labels, making it the first time. """
+        full = f"{self.prefix}_{name}"
+        key = (full, tuple(sorted(labels.items())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.get(key)
+                if histogram is None:
+                    histogram = self.histograms[key] = Histogram(full, key[1])
+                    if help:
+                        self.help.setdefault(full, help)
+        return histogram
+
+    def wrap(self, owner, attribute, name, help="", **labels):
+        """
+        Replaces owner.attribute, a method of an object or a function of a
+        module, with one that is timed. Wrapping it again does nothing.
+        Returns the histogram.
+        """
+        function = getattr(owner, attribute)
+        if hasattr(function, 'histogram'):
+            return function.histogram
+        histogram = self.histogram(name, help, **labels)
+        setattr(owner, attribute, histogram.timed(function))
+        return histogram
+
+    # ------------------------------- Output ---------------------------------
+
+    def report(self):
+        """
+        Returns a dict per histogram with its name, labels, count, total
+        seconds and the p50 and p99 in ms, slowest total first.
+        """
+        with self.lock:
+            histograms = list(self.histograms.values())
+        rows = [{'name': histogram.name, 'labels': dict(histogram.labels),
+                 'count': histogram.count, 'total_s': histogram.sum,
+                 'p50_ms': histogram.percentile(50) * 1000,
+                 'p99_ms': histogram.percentile(99) * 1000}
+                for histogram in histograms]
+        return sorted(rows, key=lambda row: row['total_s'], reverse=True)
+
+    def render(self):
+        """ Returns every histogram in the Prometheus text format. """
+        with self.lock:
+            histograms = sorted(self.histograms.items())
+        lines = []
+        family = None
+        for (name, labels), histogram in histograms:
+            if name != family:
+                family = name
+                if name in self.help:
+                    lines.append(f"# HELP {name} {self.help[name]}")
+                lines.append(f"# TYPE {name} histogram")
+            counts, total = histogram.snapshot()
+            cumulative = 0
+            for bound, count in zip(histogram.bounds + (math.inf,), counts):
+                cumulative += count
+                le = "+Inf" if bound == math.inf else f"{bound:.6g}"
+                lines.append(f"{name}_bucket{label_text(labels, (('le', le),))} {cumulative}")
+            lines.append(f"{name}_sum{label_text(labels)} {total:.9g}")
+            lines.append(f"{name}_count{label_text(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+    def export(self, path=None, port=None, period=5.0, host="127.0.0.1"):
+        """ Starts a MetricsExporter for these metrics and returns it. """
+        exporter = MetricsExporter(self, path, port, period, host).start()
+        self.exporters.append(exporter)
+        return exporter
+
+    def close(self):
+        """ Stops the exporters, which write their file one last time. """
+        for exporter in self.exporters:
+            exporter.close()
+        self.exporters = []
+
+    @contextlib.contextmanager
+    def profile(self, path=None, interval=0.005, thread=None):
+        """
+        Runs a SamplingProfiler on the calling thread, or on thread, for
+        the length of a with block, e.g. one mission. The folded stacks are
+        written to path when the block ends.
+        """
+        profiler = SamplingProfiler(interval, thread).start()
+        try:
+            yield profiler
+        finally:
+            profiler.stop()
+            if path is not None:
+                profiler.write(path)
+
+# ---------------------------- END OF Metrics CLASS -----------------------------
+
+
+class MetricsExporter:
+    """
+    Writes a Metrics object's histograms in the Prometheus text format to a
+    file every period seconds, for node_exporter's textfile collector or a
+    quick look, and/or serves them at http://host:port/metrics. The file is
+    replaced in one step, so readers never see half of it.
+    """
+
+    def __init__(self, metrics, path=None, port=None, period=5.0, host="127.0.0.1"):
+        """
+        Arguments
+            metrics: The Metrics to export
+            path:    File to write, or None
+            port:    Port to serve on, or None; 0 picks a free one
+            period:  Seconds between writes of the file
+            host:    Address to serve on
+        """
+        if path is None and port is None:
+            raise ValueError("Give a path, a port or both to export to")
+        self.metrics = metrics
+        self.path = path
+        self.port = port
+        self.period = period
+        self.host = host
+        self.server = None
+        self.stopped = threading.Event()
+        self.threads = []
+
+    def start(self):
+        """ Starts writing and serving. Returns self. """
+        if self.path is not None:
+            self.threads.append(threading.Thread(target=self.write_loop, name="metrics-file",
+                                                 daemon=True))
+        if self.port is not None:
+            # Only programs that serve their metrics pay for importing a web server
+            from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+            metrics = self.metrics
+
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path.split("?")[0] not in ("/", "/metrics"):
+                        self.send_error(404)
+                        return
+                    body = metrics.render().encode()
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/plain; version=0.0.4")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, *args):
+                    pass
+
+            self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+            self.port = self.server.server_address[1]
+            self.threads.append(threading.Thread(target=self.server.serve_forever,
+                                                 name="metrics-http", daemon=True))
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def write(self):
+        """ Writes the file once. """
+        temporary = f"{self.path}.tmp"
+        with open(temporary, "w") as file:
+            file.write(self.metrics.render())
+        os.replace(temporary, self.path)
+
+    def write_loop(self):
+        while not self.stopped.wait(self.period):
+            self.write()
+
+    def close(self):
+        """ Stops serving and writes the file a last time. """
+        self.stopped.set()
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        for thread in self.threads:
+            thread.join()
+        if self.path is not None:
+            self.write()
+
+
+class SamplingProfiler:
+    """
+    Looks at one thread's call stack every interval seconds from a thread
+    of its own and counts the stacks it sees. The profiled thread doesn't
+    run any extra code, it only shares the interpreter with the sampler.
+    folded() returns the counts in the format of Brendan Gregg's
+    flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, interval=0.005, thread=None):
+        """
+        Arguments
+            interval: Seconds between samples
+            thread:   threading.Thread to profile, the creating thread by default
+        """
+        self.interval = interval
+        self.ident = (thread or threading.current_thread()).ident
+        self.stacks = Counter()
+        self.samples = 0
+        self.stopped = threading.Event()
+        self.worker = None
+
+    def start(self):
+        self.worker = threading.Thread(target=self.sample_loop, name="profiler", daemon=True)
+        self.worker.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        if self.worker is not None:
+            self.worker.join()
+
+    def sample_loop(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.ident)
+            if frame is None:
+                break
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def folded(self):
+        """ One 'outer;...;inner count' line per stack, most samples first. """
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common())
+
+    def top(self, n=10):
+        """ The n functions seen at the top of the stack most often, with their counts. """
+        functions = Counter()
+        for stack, count in self.stacks.items():
+            functions[stack.rsplit(";", 1)[-1]] += count
+        return functions.most_common(n)
+
+    def write(self, path):
+        with open(path, "w") as file:
+            file.write(self.folded() + "\n")
@@ -0,0 +1,142 @@
+import math
+import threading
+from collections import namedtuple
+
+
+# Position in cm in the HeadsUpTello frame (x forward, y left, z up) and the
+# heading in degrees clockwise from the x axis, as of timestamp.
+Pose = namedtuple("Pose", "x y z heading timestamp")
+
+
+class PoseEstimator:
+    """
+    Dead reckoning from the state stream. Every state packet's velocities are
+    integrated into a position, the height is pulled towards the ToF reading
+    and the heading comes straight from the drone's yaw. The estimator runs on
+    the telemetry receiver thread, so it sees every packet at the packet rate.
+
+    The drone reports velocities in whole dm/s at about 10 Hz, so integration
+    can be off by up to one packet period of motion at each end of a move.
+    When a motion finishes we blend the integrated and commanded displacement,
+    each weighted by how far off it is likely to be. If the packets show much
+    less movement than was commanded (packets were lost, or a simulator
+    answered instantly) we trust the commanded distance alone.
+    """
+
+    def __init__(self, telemetry, body_velocities=False, tof_gain=0.2, max_gap=0.5,
+                 command_error=(0.05, 5.0)):
+        """
+        Arguments
+            telemetry:       Util.Telemetry object that feeds the estimator
+            body_velocities: True if vgx/vgy are in the drone's body frame
+                             instead of the takeoff frame
+            tof_gain:        How strongly each ToF reading corrects the height
+            max_gap:         Longest gap in seconds we integrate across
+            command_error:   (fraction, cm) of a commanded distance that the
+                             drone typically misses by
+        """
+        self.telemetry = telemetry
+        self.body_velocities = body_velocities
+        self.tof_gain = tof_gain
+        self.max_gap = max_gap
+        self.command_error = command_error
+        self.period = 0.1
+        self.peak_speed = 0.0
+        self.x = self.y = self.z = 0.0
+        self.velocity = (0.0, 0.0, 0.0)
+        self.timestamp = None
+        self.tof_ground = None
+        self.heading_offset = None
+        self.motion_start = None
+        self.fallbacks = 0
+        self.lock = threading.Lock()
+        telemetry.add_listener(self.update)
+
+    def update(self, state, timestamp):
+        """ Integrates one state packet. """
+        if 'vgx' not in state:
+            return
+        with self.lock:
+            if self.heading_offset is None and 'yaw' in state:
+                self.heading_offset = state['yaw']
+            velocity = [state['vgx'] * 10, state['vgy'] * 10, state['vgz'] * 10]
+            if self.body_velocities and 'yaw' in state:
+                heading = math.radians(state['yaw'] - (self.heading_offset or 0))
+                forward, left = velocity[0], velocity[1]
+                velocity[0] = forward * math.cos(heading) + left * math.sin(heading)
+                velocity[1] = -forward * math.sin(heading) + left * math.cos(heading)
+            if self.timestamp is not None:
+                dt = min(timestamp - self.timestamp, self.max_gap)
+                self.period += 0.1 * (dt - self.period)
+                # Trapezoidal integration between the last two packets
+                self.x += (self.velocity[0] + velocity[0]) / 2 * dt
+                self.y += (self.velocity[1] + velocity[1]) / 2 * dt
+                self.z += (self.velocity[2] + velocity[2]) / 2 * dt
+            if 'tof' in state:
+                if self.tof_ground is None:
+                    self.tof_ground = state['tof']
+                self.z += self.tof_gain * (state['tof'] - self.tof_ground - self.z)
+            self.peak_speed = max(self.peak_speed, math.hypot(velocity[0], velocity[1]))
+            self.velocity = tuple(velocity)
+            self.timestamp = timestamp
+
+    def position(self):
+        """ Returns the estimated (x, y, z). """
+        with self.lock:
+            return self.x, self.y, self.z
+
+    def heading(self):
+        """ Returns the heading in degrees (0-360) relative to the reference. """
+        yaw = self.telemetry.get_yaw()
+        with self.lock:
+            if self.heading_offset is None:
+                self.heading_offset = yaw
+            return (yaw - self.heading_offset) % 360
+
+    def pose(self):
+        """ Returns the estimated Pose. """
+        heading = self.heading()
+        with self.lock:
+            return Pose(self.x, self.y, self.z, heading, self.timestamp)
+
+    def set_position(self, x=None, y=None):
+        """ Overrides the estimated horizontal position. """
+        with self.lock:
+            if x is not None:
+                self.x = float(x)
+            if y is not None:
+                self.y = float(y)
+
+    def set_heading(self, heading):
+        """ Declares that the drone's current yaw is heading degrees. """
+        yaw = self.telemetry.get_yaw()
+        with self.lock:
+            self.heading_offset = yaw - heading
+
+    def begin_motion(self):
+        """ Remembers where the drone was when a motion command was sent. """
+        with self.lock:
+            self.motion_start = (self.x, self.y)
+            self.peak_speed = math.hypot(self.velocity[0], self.velocity[1])
+
+    def end_motion(self, dx, dy):
+        """
+        Called when the drone answered a motion command that should have moved
+        it by (dx, dy). Blends the integrated and commanded displacement.
+        """
+        with self.lock:
+            if self.motion_start is None:
+                return
+            start_x, start_y = self.motion_start
+            self.motion_start = None
+            commanded = math.hypot(dx, dy)
+            moved_x, moved_y = self.x - start_x, self.y - start_y
+            if math.hypot(moved_x, moved_y) < commanded / 2:
+                self.x, self.y = start_x + dx, start_y + dy
+                self.fallbacks += 1
+                return
+            integrated_error = max(self.peak_speed * self.period, 1.0)
+            command_error = self.command_error[0] * commanded + self.command_error[1]
+            weight = command_error ** 2 / (command_error ** 2 + integrated_error ** 2)
+            self.x = start_x + weight * moved_x + (1 - weight) * dx
+            self.y = start_y + weight * moved_y + (1 - weight) * dy
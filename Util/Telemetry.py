@@ -0,0 +1,226 @@
+import re
+import threading
+import time
+from array import array
+
+from djitellopy import tello as tello_module
+
+
+# State packet fields that we keep, in the order they are stored.
+FIELDS = ('pitch', 'roll', 'yaw', 'vgx', 'vgy', 'vgz', 'templ', 'temph',
+          'tof', 'h', 'bat', 'baro', 'time', 'agx', 'agy', 'agz')
+INDEX = {name: i for i, name in enumerate(FIELDS)}
+
+
+class _StateHook(dict):
+    """
+    Stands in for djitellopy's per-drone dictionary so that every state packet
+    the library parses is also pushed to a Telemetry object the moment it
+    arrives. The library only ever assigns whole packets to the 'state' key.
+    """
+
+    def __init__(self, udp_object, callback):
+        super().__init__(udp_object)
+        self.callback = callback
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        if key == 'state':
+            self.callback(value)
+
+
+class Telemetry:
+    """
+    Keeps the latest state packet from the drone's 8890 state stream in two
+    fixed-size arrays, one for the values and one for when each value arrived.
+    Reads are served from the arrays while they are fresh and fall back to a
+    synchronous SDK query when they are older than max_age seconds.
+
+    After a motion the cached values describe where the drone used to be, so
+    callers invalidate() the cache and the next read waits for a packet that
+    arrived after the motion instead of returning the old value.
+    """
+
+    def __init__(self, drone, max_age=0.5):
+        """
+        Arguments
+            drone:   A djitellopy.Tello (or compatible) object
+            max_age: Seconds a cached value may be old before we query the drone
+        """
+        self.drone = drone
+        self.max_age = max_age
+        self.values = array('d', [0.0] * len(FIELDS))
+        self.stamps = array('d', [float('-inf')] * len(FIELDS))
+        self.packets = 0
+        self.queries = 0
+        self.last_packet = float('-inf')
+        self.barrier = float('-inf')
+        self.lock = threading.Lock()
+        self.fresh = threading.Condition(self.lock)
+        self.listeners = []
+
+    def attach(self):
+        """
+        Subscribes to the drone's state stream. Drones that are not backed by
+        djitellopy's receiver thread are left alone and every read becomes a
+        synchronous query. Returns True if the stream is attached.
+        """
+        try:
+            host = self.drone.address[0]
+            udp_object = self.drone.get_own_udp_object()
+        except (AttributeError, KeyError):
+            return False
+        if not isinstance(udp_object, _StateHook):
+            tello_module.drones[host] = _StateHook(udp_object, self.feed)
+        return True
+
+    def feed(self, state, timestamp=None):
+        """ Stores one parsed state packet. Called from the receiver thread. """
+        if not state:
+            return
+        timestamp = time.monotonic() if timestamp is None else timestamp
+        with self.lock:
+            for name, value in state.items():
+                i = INDEX.get(name)
+                if i is not None:
+                    self.values[i] = value
+                    self.stamps[i] = timestamp
+            self.packets += 1
+            self.last_packet = timestamp
+            self.fresh.notify_all()
+        for listener in self.listeners:
+            listener(state, timestamp)
+
+    def wait_for_packet(self, timeout):
+        """ Waits up to timeout seconds for the first state packet. Returns True once one came. """
+        deadline = time.monotonic() + timeout
+        with self.fresh:
+            while self.packets == 0:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.fresh.wait(remaining)
+        return True
+
+    def add_listener(self, listener):
+        """ Calls listener(state, timestamp) for every state packet. """
+        self.listeners.append(listener)
+
+    def invalidate(self):
+        """ Marks every cached value as old, e.g. after the drone moved. """
+        with self.lock:
+            self.barrier = time.monotonic()
+
+    def read(self, name, max_age=None):
+        """
+        Returns the cached value of a state field, or None if it is older than
+        max_age seconds (defaults to the object's staleness bound). If the
+        cache was invalidated and the stream is alive, waits up to max_age for
+        the next packet.
+        """
+        i = INDEX[name]
+        max_age = self.max_age if max_age is None else max_age
+        deadline = time.monotonic() + max_age
+        with self.fresh:
+            while True:
+                now = time.monotonic()
+                value, stamp = self.values[i], self.stamps[i]
+                if stamp >= self.barrier and now - stamp <= max_age:
+                    return value
+                if now - self.last_packet > max_age or now >= deadline:
+                    return None
+                self.fresh.wait(deadline - now)
+
+    def age(self, name):
+        """ Returns how many seconds ago a field was last updated. """
+        with self.lock:
+            return time.monotonic() - self.stamps[INDEX[name]]
+
+    def snapshot(self):
+        """ Returns a consistent copy of every field and its timestamp. """
+        with self.lock:
+            return dict(zip(FIELDS, self.values)), dict(zip(FIELDS, self.stamps))
+
+    def query(self, name, command, scale=1.0):
+        """
+        Asks the drone for one value with a blocking read command, stores it in
+        the cache and returns it. Range answers such as '62~65C' are averaged.
+        """
+        response = self.drone.send_read_command(command)
+        numbers = [float(number) for number in re.findall(r'-?\d+(?:\.\d+)?', response)]
+        if not numbers:
+            raise ValueError(f"Could not read {name} from '{response}'")
+        value = sum(numbers) / len(numbers) * scale
+        with self.lock:
+            self.values[INDEX[name]] = value
+            self.stamps[INDEX[name]] = time.monotonic()
+            self.queries += 1
+        return value
+
+    # The getters below return None instead of querying the drone when the
+    # cache is stale and query is False.
+
+    def get_barometer(self, max_age=None, query=True):
+        """ Returns the barometer reading in cm. """
+        baro = self.read('baro', max_age)
+        if baro is None:
+            if not query:
+                return None
+            baro = self.query('baro', 'baro?')
+        return baro * 100
+
+    def get_height(self, useBar=False, barHeight=0, max_age=None, query=True):
+        """
+        Returns the height in cm, either from the barometer relative to
+        barHeight or from the drone's own height estimate.
+        """
+        if useBar:
+            baro = self.get_barometer(max_age, query)
+            return None if baro is None else baro - barHeight
+        height = self.read('h', max_age)
+        if height is None:
+            if not query:
+                return None
+            # 'height?' answers in decimeters, e.g. '8dm'
+            height = self.query('h', 'height?', scale=10)
+        return height
+
+    def get_battery(self, max_age=None, query=True):
+        """ Returns the battery level as a percent. """
+        battery = self.read('bat', max_age)
+        if battery is None:
+            if not query:
+                return None
+            battery = self.query('bat', 'battery?')
+        return int(battery)
+
+    def get_yaw(self, max_age=None, query=True):
+        """ Returns the yaw in degrees, growing clockwise. """
+        yaw = self.read('yaw', max_age)
+        if yaw is None:
+            if not query:
+                return None
+            # 'attitude?' answers 'pitch:0;roll:0;yaw:45;'
+            response = self.drone.send_read_command('attitude?')
+            match = re.search(r'yaw:(-?\d+)', response)
+            if match is None:
+                raise ValueError(f"Could not read yaw from '{response}'")
+            yaw = float(match.group(1))
+            with self.lock:
+                self.values[INDEX['yaw']] = yaw
+                self.stamps[INDEX['yaw']] = time.monotonic()
+                self.queries += 1
+        return yaw
+
+    def get_temperature(self, max_age=None, query=True):
+        """ Returns the average internal temperature. """
+        low, high = self.read('templ', max_age), self.read('temph', max_age)
+        if low is None or high is None:
+            if not query:
+                return None
+            temperature = self.query('templ', 'temp?')
+            with self.lock:
+                self.values[INDEX['temph']] = temperature
+                self.stamps[INDEX['temph']] = self.stamps[INDEX['templ']]
+            return temperature
+        return (low + high) / 2
@@ -0,0 +1,286 @@
+import threading
+import time
+
+from Util import dji_matrix as djim
+from Util.CommandChannel import CommandChannel
+
+
+OFF = (0, 0, 0)
+
+
+def led_command(color):
+    """ The SDK command that turns the top LED to an (r, g, b) color. """
+    red, green, blue = (djim.capped_color(int(round(value))) for value in color)
+    return f"EXT led {red} {green} {blue}"
+
+
+class Effect:
+    """
+    Something the top LED shows over time. duration is in seconds, or None
+    for an effect that runs until another effect is queued behind it.
+    """
+
+    duration = None
+
+    def begin(self, color):
+        """ Called with the LED's color when the effect starts. """
+
+    def color(self, t):
+        """ The (r, g, b) color t seconds into the effect. """
+        raise NotImplementedError
+
+    def done(self, t):
+        return self.duration is not None and t >= self.duration
+
+
+class Fade(Effect):
+    """ Changes the color linearly over duration seconds. """
+
+    def __init__(self, end, duration, start=None):
+        self.start = start
+        self.end = tuple(end)
+        self.duration = duration
+
+    def begin(self, color):
+        if self.start is None:
+            self.start = color
+
+    def color(self, t):
+        if self.duration <= 0 or t >= self.duration:
+            return self.end
+        share = t / self.duration
+        return tuple(a + (b - a) * share for a, b in zip(self.start, self.end))
+
+
+class Hold(Effect):
+    """ Shows one color for duration seconds, or until the next effect. """
+
+    def __init__(self, color, duration=None):
+        self.end = tuple(color)
+        self.duration = duration
+
+    def color(self, t):
+        return self.end
+
+
+class Blink(Effect):
+    """
+    Switches between color and low every period seconds, count times (None
+    for ever), on for duty of each period. Ends on low.
+    """
+
+    def __init__(self, color, period=1.0, count=None, duty=0.5, low=OFF):
+        self.on = tuple(color)
+        self.end = tuple(low)
+        self.period = period
+        self.duty = duty
+        self.duration = None if count is None else count * period
+
+    def color(self, t):
+        if self.done(t):
+            return self.end
+        return self.on if t % self.period < self.duty * self.period else self.end
+
+
+class Pulse(Blink):
+    """ Like Blink, but fades smoothly from low up to color and back down. """
+
+    def color(self, t):
+        if self.done(t):
+            return self.end
+        phase = (t % self.period) / self.period
+        share = 1 - abs(2 * phase - 1)
+        return tuple(a + (b - a) * share for a, b in zip(self.end, self.on))
+
+
+class TopLed:
+    """
+    Plays color effects (Fade, Hold, Blink, Pulse) on the drone's top LED
+    from a timer thread, so the caller never waits on LED commands.
+
+    The timer works out the color every tick, at most max_rate times a
+    second, and sends it only if it differs from what the LED shows. Commands
+    go out through the CommandChannel with try_send() and only after the
+    channel has been quiet for idle seconds; while the drone is busy with
+    another command the tick is skipped, and the next tick sends whatever
+    color is current by then. Intermediate colors of a fade are dropped, the
+    last color of an effect never is.
+
+        led = TopLed(tello)
+        led.fade((0, 0, 0), 10, start=(0, 200, 50))
+        led.hold((200, 10, 10), 2, append=True)
+        led.hold((0, 0, 0), append=True)
+    """
+
+    def __init__(self, drone, channel=None, max_rate=10, idle=0.05):
+        """
+        Arguments
+            drone:    A djitellopy.Tello object
+            channel:  Util.CommandChannel of the drone; installed if missing
+            max_rate: Most LED commands per second
+            idle:     Seconds the channel has to be quiet before we send
+        """
+        self.drone = drone
+        self.channel = channel or CommandChannel.of(drone)
+        self.period = 1 / max_rate
+        self.idle = idle
+        self.effects = []
+        self.effect_start = None
+        self.target = OFF
+        self.shown = None
+        self.sent = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.wake = threading.Condition()
+        self.closed = False
+        self.worker = None
+
+    @classmethod
+    def of(cls, drone):
+        """ Returns the drone's TopLed, creating it the first time. """
+        led = getattr(drone, 'top_led', None)
+        if led is None:
+            led = drone.top_led = cls(drone)
+        return led
+
+    # ------------------------------ Effects ---------------------------------
+
+    def play(self, *effects, append=False):
+        """ Replaces the running effects, or queues these after them. """
+        with self.wake:
+            if not append:
+                self.effects = []
+                self.effect_start = None
+            self.effects.extend(effects)
+            self.start()
+            self.wake.notify()
+        return self
+
+    def set(self, red, green, blue):
+        """ Turns the LED to a color and leaves it there. """
+        return self.play(Hold((red, green, blue)))
+
+    def off(self):
+        return self.set(*OFF)
+
+    def show(self, red, green, blue):
+        """
+        Turns the LED to a color right away, from the calling thread, like
+        LedMatrix.show(), and stops any effect. Nothing is sent if the LED
+        already shows the color. Returns True if a command was sent.
+        """
+        command = led_command((red, green, blue))
+        with self.wake:
+            self.effects = []
+            self.effect_start = None
+            self.target = (red, green, blue)
+            if command == self.shown:
+                return False
+        self.drone.send_control_command(command)
+        with self.wake:
+            self.shown = command
+            self.sent += 1
+            # A tick that sent an older color meanwhile sends this one again
+            self.wake.notify()
+        return True
+
+    def fade(self, color, duration, start=None, append=False):
+        return self.play(Fade(color, duration, start), append=append)
+
+    def hold(self, color, duration=None, append=False):
+        return self.play(Hold(color, duration), append=append)
+
+    def blink(self, color, period=1.0, count=None, duty=0.5, append=False):
+        return self.play(Blink(color, period, count, duty), append=append)
+
+    def pulse(self, color, period=2.0, count=None, append=False):
+        return self.play(Pulse(color, period, count), append=append)
+
+    @property
+    def busy(self):
+        """ True while an effect is running or a color hasn't been sent yet. """
+        with self.wake:
+            return bool(self.effects) or self.shown != self.current_command()
+
+    def wait(self, timeout=None):
+        """
+        Waits until the effects have played and the last color was sent.
+        Returns False on timeout, or right away if an effect runs for ever.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.busy:
+            with self.wake:
+                forever = self.effects and self.effects[-1].duration is None and \
+                          not isinstance(self.effects[-1], Hold)
+            if forever or deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(self.period / 2)
+        return True
+
+    # ------------------------------- Timer ----------------------------------
+
+    def start(self):
+        if self.worker is None or not self.worker.is_alive():
+            self.closed = False
+            self.worker = threading.Thread(target=self.run, name="top-led", daemon=True)
+            self.worker.start()
+
+    def close(self):
+        """ Stops the timer thread. The LED keeps its color. """
+        with self.wake:
+            self.closed = True
+            self.wake.notify()
+        if self.worker is not None:
+            self.worker.join()
+
+    def current_command(self):
+        return led_command(self.target)
+
+    def advance(self, now):
+        """
+        Works out the color for now, moving on to the next effect when one
+        ends. An effect without a duration ends when another is queued, and
+        a Hold without one ends right away, since its color never changes.
+        """
+        while self.effects:
+            effect = self.effects[0]
+            if self.effect_start is None:
+                self.effect_start = now
+                effect.begin(self.target)
+            t = now - self.effect_start
+            self.target = effect.color(t)
+            endless = effect.duration is None
+            if not effect.done(t) and not (endless and (len(self.effects) > 1 or
+                                                        isinstance(effect, Hold))):
+                return
+            self.effects.pop(0)
+            self.effect_start = None
+
+    def run(self):
+        """ Timer thread: sends the current color when it changed. """
+        next_tick = time.monotonic()
+        while True:
+            with self.wake:
+                if self.closed:
+                    return
+                self.advance(time.monotonic())
+                command = self.current_command()
+                if command == self.shown and not self.effects:
+                    # Nothing left to do until someone plays a new effect
+                    self.wake.wait()
+                    next_tick = time.monotonic()
+                    continue
+            if command != self.shown:
+                try:
+                    if self.channel.try_send(command, self.idle) is None:
+                        self.coalesced += 1
+                    else:
+                        self.shown = command
+                        self.sent += 1
+                except Exception:
+                    # The drone refused it; the next tick tries again
+                    self.errors += 1
+            next_tick = max(next_tick + self.period, time.monotonic())
+            with self.wake:
+                if not self.closed:
+                    self.wake.wait(max(next_tick - time.monotonic(), 0))
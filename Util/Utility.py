@@ -1,7 +1,10 @@
+import inspect
 import math
+import sys
 from itertools import product
 from math import radians, sin
-from Util import dji_matrix as djim
+from Util.LedMatrix import LedMatrix
+from Util.TopLed import TopLed
 from djitellopy import Tello
 
 
@@ -33,8 +36,7 @@ def get_Height(drone, barHeight, useBar):
 def top_led_off(drone):
     """ Turn off the top LED. """
 
-    cmd = f"EXT led 0 0 0"
-    drone.send_control_command(cmd)
+    TopLed.of(drone).show(0, 0, 0)
     return
 
 
@@ -48,25 +50,25 @@ def matrix_pattern(drone, flattened_pattern: str, color: str = 'b'):
     Arguments
         flattened_pattern: see examples in dji_matrix.py
         color:             'r', 'b', or 'p'
+
+    Patterns are compiled once and nothing is sent if the matrix already
+    shows this one, see Util.LedMatrix.
     """
 
-    if color.lower() not in "rpb":
-        color = 'b'
-    cmd = f"EXT mled g {flattened_pattern.replace('*', color.lower())}"
-    drone.send_control_command(cmd)
+    LedMatrix.of(drone).show(flattened_pattern, color)
     return
 
 
-def printHeight(drone, logger, mission_obj):
+def printHeight(drone, logger, mission_obj, barHeight=0, useBar=False):
     """
     Function to print height to log, so we aren't being repetitive.
     :return:
     """
     floorHeight = mission_obj["floor"]
     ceilingHeight = mission_obj["ceiling"]
-    currentHeight = get_Height(drone)
-    logger.debug(f"ceiling height: {ceilingHeight} || floor height: {floorHeight}")
-    logger.debug(f"current height: {currentHeight}")
+    currentHeight = get_Height(drone, barHeight, useBar)
+    logger.debug("ceiling height: %s || floor height: %s", ceilingHeight, floorHeight)
+    logger.debug("current height: %s", currentHeight)
 
 
 def check_battery(drone, minBatteryLevel, logger):
@@ -90,21 +92,19 @@ def top_led_color(drone, red: int, green: int, blue: int):
         red:   0-255
         green: 0-255
         blue:  0-255
+
+    Goes through the drone's Util.TopLed, so it stops any effect and is
+    not sent if the LED already shows the color.
     """
 
-    r = djim.capped_color(red)
-    g = djim.capped_color(green)
-    b = djim.capped_color(blue)
-    cmd = f"EXT led {r} {g} {b}"
-    drone.send_control_command(cmd)
+    TopLed.of(drone).show(red, green, blue)
     return
 
 
 def matrix_off(drone):
     """ Turn off the 64 LED matrix. """
 
-    off_pattern = "0" * 64
-    matrix_pattern(drone, off_pattern)
+    LedMatrix.of(drone).off()
     return
 
 
@@ -148,7 +148,19 @@ def isInTether(center_x, center_y, rad, x, y):
     Checks if the points x and y are within a circle
     with center_x and center_y with the given radius
     """
-    if ((x - center_x) * (x - center_y) + (y - center_x) * (y - center_y) <= rad * rad):
+    if ((x - center_x) * (x - center_x) + (y - center_y) * (y - center_y) <= rad * rad):
         return True
     else:
         return False
+
+
+def instrument(metrics):
+    """
+    Times every function of this module in a Util.Metrics.Metrics object,
+    as utility_seconds{function=...}. Calls through the module, such as
+    Utility.get_battery(drone), are timed from then on.
+    """
+    module = sys.modules[__name__]
+    for name, function in list(vars(module).items()):
+        if name != 'instrument' and inspect.isfunction(function) and function.__module__ == __name__:
+            metrics.wrap(module, name, "utility_seconds", "Utility function calls", function=name)
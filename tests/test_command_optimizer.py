@@ -0,0 +1,45 @@
+import pytest
+
+from Util.CommandOptimizer import CommandOptimizer
+
+
+class Abort(Exception):
+    pass
+
+
+def recording_optimizer():
+    sent = []
+    optimizer = CommandOptimizer(lambda command, *args, **kwargs: sent.append(command) or True)
+    return optimizer, sent
+
+
+def test_batch_flies_held_moves_on_exit():
+    optimizer, sent = recording_optimizer()
+    with optimizer.batch():
+        optimizer.submit('forward 100')
+        optimizer.submit('forward 50')
+    assert sent == ['forward 150']
+
+
+def test_failed_batch_sends_no_held_move():
+    optimizer, sent = recording_optimizer()
+    with pytest.raises(Abort):
+        with optimizer.batch():
+            optimizer.submit('forward 100')
+            optimizer.submit('forward 50')
+            raise Abort()
+    assert sent == []
+    assert optimizer.held is None
+    assert optimizer.report()['dropped'] == 2
+    assert optimizer.saved == 0
+
+
+def test_failed_nested_batch_sends_no_held_move():
+    optimizer, sent = recording_optimizer()
+    with pytest.raises(Abort):
+        with optimizer.batch():
+            with optimizer.batch():
+                optimizer.submit('left 30')
+                raise Abort()
+    assert sent == []
+    assert not optimizer.batching